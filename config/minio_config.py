@@ -11,6 +11,7 @@ class MinioConfig:
     INITALIZED: bool = False
     USER: str
     PASSWORD: str
+    POOL_SIZE = 64  # ? Keep-alive connections to minio per process
 
     @staticmethod
     def initialize():
@@ -19,6 +20,7 @@ class MinioConfig:
                 raise ServerConfigNotInitializedError()
             MinioConfig.USER = getenv("MINIO_ROOT_USER")
             MinioConfig.PASSWORD = getenv("MINIO_ROOT_PASSWORD")
+            MinioConfig.POOL_SIZE = int(getenv("MINIO_POOL_SIZE", MinioConfig.POOL_SIZE))
             MinioConfig.INITALIZED = True
         except Exception as error:
             raise UnableToInitializeServiceError("MinioConfig") from error
@@ -74,11 +74,15 @@ class Paths:
     class Messages:
         _base_path = f'{_base_api_path}/messages'
         GET_CHATS = f'{_base_api_path}/chats'
+        GET_TOTAL_UNREAD_COUNT = f'{_base_api_path}/chats/unread'
         GET_MESSAGES = _base_path
+        GET_CHANGES = f'{_base_path}/changes'
         CREATE_MESSAGE = _base_path
         DELETE_MESSAGE = _base_path
         MARK_READED = f'{_base_path}/mark_readed'
+        MARK_READ_UNTIL = f'{_base_path}/mark_read_until'
 
     class Admin:
         _base_path = f'{_base_api_path}/admin'
-        GET_MINIO_STAT = f'{_base_path}/minio'
\ No newline at end of file
+        GET_MINIO_STAT = f'{_base_path}/minio'
+        GET_METRICS = f'{_base_path}/metrics'
@@ -1,8 +1,22 @@
-from os import getenv
+from enum import Enum
+from os import getenv, getpid
+from socket import gethostname
 
 from models.exceptions.initalize_exceptions import UnableToInitializeServiceError
 
 
+class ServerRole(Enum):
+    all = "all"
+    rest = "rest"  # ? HTTP api only, emits into realtime nodes through redis
+    realtime = "realtime"  # ? Socket.IO only
+
+
+class MediaDelivery(Enum):
+    stream = "stream"  # ? Bytes are streamed through python
+    accel = "accel"  # ? X-Accel-Redirect to the nginx internal location
+    signed = "signed"  # ? Redirect to a short-lived presigned link
+
+
 class ServerConfig:
     INITIALIZED: bool = False
     RUN_IN_DOCKER = False
@@ -20,6 +34,22 @@ class ServerConfig:
     OTP_CODE_DURABILITY_MIN = 15
     MAX_IMAGES_IN_POST = 10
     MAX_IMAGES_IN_MESSAGE = 10
+    STATELESS_AUTH = True  # ? Check access tokens by redis revocation marks only
+    PRESENCE_DEBOUNCE_SECONDS = 3.0  # ? Presence changes inside the window are coalesced
+    PRESENCE_FLUSH_SECONDS = 30  # ? How often live presence is written behind to MySQL
+    MULTI_NODE = False  # ? Several server processes behind one redis (socket.io pub/sub manager)
+    NODE_ID: str
+    WORKERS = 1  # ? > 1 forks workers sharing the listen socket (SO_REUSEPORT)
+    WORKER_INDEX: int | None = None  # ? Set inside a forked worker
+    ROLE = ServerRole.all
+    MEDIA_DELIVERY = MediaDelivery.stream
+    MEDIA_LINK_SECONDS = 60  # ? Lifetime of presigned media links
+    MEDIA_CACHE_MEMORY_MB = 64  # ? In-process cache of small media (per worker)
+    MEDIA_CACHE_MAX_ITEM_KB = 256  # ? Bigger objects (originals, apks) aren't cached
+    MEDIA_CACHE_DIR: str | None = None  # ? Enables the local disk tier
+    MEDIA_CACHE_DISK_MB = 1024
+    NODE_HEARTBEAT_SECONDS = 10
+    NODE_TTL_SECONDS = 30  # ? Node without a heartbeat for so long is treated as crashed
 
     @staticmethod
     def initialize():
@@ -32,6 +62,67 @@ class ServerConfig:
             ServerConfig.HOST = getenv("SERVER_HOST")
             ServerConfig.PORT = int(getenv("SERVER_PORT"))
             ServerConfig.OWNER_KEY = getenv("OWNER_KEY")
+            ServerConfig.STATELESS_AUTH = getenv("STATELESS_AUTH", "1").lower() in (
+                "1",
+                "true",
+                "yes",
+            )
+            ServerConfig.PRESENCE_DEBOUNCE_SECONDS = float(
+                getenv("PRESENCE_DEBOUNCE_SECONDS", ServerConfig.PRESENCE_DEBOUNCE_SECONDS)
+            )
+            ServerConfig.PRESENCE_FLUSH_SECONDS = int(
+                getenv("PRESENCE_FLUSH_SECONDS", ServerConfig.PRESENCE_FLUSH_SECONDS)
+            )
+            ServerConfig.MULTI_NODE = getenv("MULTI_NODE", "0").lower() in (
+                "1",
+                "true",
+                "yes",
+            )
+            ServerConfig.MEDIA_DELIVERY = MediaDelivery(
+                getenv("MEDIA_DELIVERY", MediaDelivery.stream.value)
+            )
+            ServerConfig.MEDIA_CACHE_MEMORY_MB = int(
+                getenv("MEDIA_CACHE_MEMORY_MB", ServerConfig.MEDIA_CACHE_MEMORY_MB)
+            )
+            ServerConfig.MEDIA_CACHE_MAX_ITEM_KB = int(
+                getenv("MEDIA_CACHE_MAX_ITEM_KB", ServerConfig.MEDIA_CACHE_MAX_ITEM_KB)
+            )
+            ServerConfig.MEDIA_CACHE_DIR = getenv("MEDIA_CACHE_DIR") or None
+            ServerConfig.MEDIA_CACHE_DISK_MB = int(
+                getenv("MEDIA_CACHE_DISK_MB", ServerConfig.MEDIA_CACHE_DISK_MB)
+            )
+            ServerConfig.ROLE = ServerRole(getenv("SERVER_ROLE", ServerRole.all.value))
+            ServerConfig.WORKERS = max(1, int(getenv("WORKERS", ServerConfig.WORKERS)))
+            worker_index = getenv("WORKER_INDEX")
+            ServerConfig.WORKER_INDEX = int(worker_index) if worker_index else None
+            ServerConfig.NODE_ID = getenv("NODE_ID") or gethostname()
+            if ServerConfig.WORKER_INDEX is not None:
+                # * Old and new worker live together during a rolling restart
+                ServerConfig.NODE_ID += f"-w{ServerConfig.WORKER_INDEX}-{getpid()}"
+            elif not getenv("NODE_ID"):
+                ServerConfig.NODE_ID += f"-{getpid()}"
             ServerConfig.INITIALIZED = True
         except Exception as error:
             raise UnableToInitializeServiceError("SERVER_CONFIG") from error
+
+    @staticmethod
+    def is_distributed() -> bool:
+        # ? Sockets of one user may be held by another process
+        return (
+            ServerConfig.MULTI_NODE
+            or ServerConfig.WORKERS > 1
+            or ServerConfig.ROLE != ServerRole.all
+        )
+
+    @staticmethod
+    def serves_rest() -> bool:
+        return ServerConfig.ROLE in (ServerRole.all, ServerRole.rest)
+
+    @staticmethod
+    def serves_realtime() -> bool:
+        return ServerConfig.ROLE in (ServerRole.all, ServerRole.realtime)
+
+    @staticmethod
+    def runs_maintenance() -> bool:
+        # ? Periodic cleanups run in the single process or in the first worker only
+        return ServerConfig.serves_rest() and ServerConfig.WORKER_INDEX in (None, 0)
@@ -23,6 +23,8 @@ from repositories.fcm_token_repository import FCMTokenRepository
 from repositories.otp_repository import OtpRepository
 from repositories.user_repository import UserRepository
 from services.email_service import EmailService
+from services.revocation_store import RevocationStore
+from services.session_store import SessionStore
 from services.tokens_service import TokensService
 from utils.my_validator.my_validator import ValidateField, validate_request_body
 
@@ -161,6 +163,8 @@ class AuthConrtoller:
         if deleted_fcm_tokens_count:
             self._logger.debug("FCM token was deleted")
         await request.db_session.commit()
+        await RevocationStore.revoke_user_tokens(user.id)
+        await SessionStore.invalidate_user(user.id)
         self._logger.debug(f"@{user.username} has logged out")
         raise UnauthorizedError()
 
@@ -17,6 +17,7 @@ from models.pagination import Pagination
 from repositories.comments_repository import CommentsRepository
 from repositories.post_repository import PostRepository
 from repositories.user_repository import UserRepository
+from services.presence_service import PresenceService
 from utils.my_validator.my_validator import ValidateField, validate_request_body
 from utils.my_validator.rules import IsInstanceRule, LengthRule
 
@@ -42,10 +43,20 @@ class CommentsController:
             pagination=pagination,
         )
 
+        presences = await PresenceService.get_presences(
+            author_id
+            for comment in comments
+            for author_id in (
+                comment.author_id,
+                comment.reply_to.author_id if comment.reply_to is not None else None,
+            )
+        )
         json_comments = tuple(
             map(
                 lambda comment: comment.to_json(
-                    include_reply=True, detect_rels_for_user_id=request.user_id
+                    include_reply=True,
+                    detect_rels_for_user_id=request.user_id,
+                    presences=presences,
                 ),
                 comments,
             )
@@ -3,6 +3,7 @@ from logging import Logger
 from aiohttp.web import Request, json_response
 
 from controllers.middlewares import authenticate, owner_role
+from services.metrics import Metrics
 from services.minio_service import MinioService
 
 
@@ -15,4 +16,9 @@ class AdminController:
     async def get_minio_stat(self, request: Request):
         stats = await MinioService.get_all_stats()
         json_stats = tuple(map(lambda stat: stat.to_json(), stats))
-        return json_response(json_stats)
\ No newline at end of file
+        return json_response(json_stats)
+
+    @authenticate()
+    @owner_role()
+    async def get_metrics(self, request: Request):
+        return json_response(Metrics.to_json())
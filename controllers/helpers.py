@@ -2,6 +2,6 @@
 
 
 
-def parse_short_flag(query: dict[str, str]) -> bool:
-    raw = query.get("short", "").strip().lower()
+def parse_bool_flag(query: dict[str, str], name: str) -> bool:
+    raw = query.get(name, "").strip().lower()
     return raw in {"1", "true", "yes", "on"}
@@ -1,20 +1,222 @@
-import asyncio
+from datetime import timedelta, timezone
+from email.utils import format_datetime
 from logging import Logger
 
-from aiohttp.web import Request, StreamResponse
-from aiohttp.web_exceptions import HTTPNotImplemented
+from aiohttp import hdrs
+from aiohttp.helpers import ETAG_ANY
+from aiohttp.web import Request, Response, StreamResponse
+from aiohttp.web_exceptions import (
+    HTTPNotImplemented,
+    HTTPRequestRangeNotSatisfiable,
+)
 
+from config.server_config import MediaDelivery, ServerConfig
 from controllers.middlewares import authenticate
-from models.exceptions.api_exceptions import ForbiddenError, ValidationError
+from models.exceptions.api_exceptions import (
+    ForbiddenError,
+    MinioNotFoundError,
+    ValidationError,
+)
 from models.image_sizes import ImageSizes
+from models.media_variant import MediaVariant
 from repositories.message_repository import MessagesRepository
+from services.media_cache import MediaCache
+from services.media_index import MediaIndex
+from services.metrics import Metrics
 from services.minio_service import Buckets, MinioService
+from services.s3_client import S3ObjectStream
 
 
 class MediaController:
+    # ? Locations of nginx.conf.template proxying minio
+    INTERNAL_MEDIA_LOCATION = "/internal_media"
+    TEMP_MEDIA_LOCATION = "/temp_media"
+    IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+    REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
     def __init__(self, logger: Logger):
         self._logger = logger
 
+    @staticmethod
+    async def _find_image_variant(
+        bucket: Buckets, media_id: str, requested_size: ImageSizes
+    ) -> MediaVariant:
+        variants = await MediaIndex.get_variants(bucket, media_id)
+        if variants is None:
+            Metrics.increment("media_index_missing_hits")
+            raise MinioNotFoundError(key=f"{media_id=}, {requested_size=}")
+        variant = MediaIndex.pick(variants, requested_size)
+        if variant is not None:
+            Metrics.increment("media_index_hits")
+            return variant
+        # * Not indexed yet (uploaded before the index or redis was restarted)
+        Metrics.increment("media_index_misses")
+        listed_variants = await MinioService.list_variants(bucket, media_id)
+        if not listed_variants:
+            await MediaIndex.mark_missing(bucket, media_id)
+            raise MinioNotFoundError(key=f"{media_id=}, {requested_size=}")
+        await MediaIndex.add_variants(bucket, listed_variants)
+        variant = MediaIndex.pick(
+            {listed.name: listed for listed in listed_variants}, requested_size
+        )
+        if variant is None:
+            raise MinioNotFoundError(key=f"{media_id=}, {requested_size=}")
+        return variant
+
+    @staticmethod
+    def _cache_control(bucket: Buckets) -> str:
+        # ? Image keys are content-addressed (new id on every upload),
+        # ? an apk may be reuploaded with the same version, so it's revalidated
+        if bucket.is_image_bucket:
+            return MediaController.IMMUTABLE_CACHE_CONTROL
+        return MediaController.REVALIDATE_CACHE_CONTROL
+
+    @staticmethod
+    def _supports_ranges(bucket: Buckets, variant: MediaVariant) -> bool:
+        return bucket == Buckets.apks or variant.name == ImageSizes.s_original.str_view
+
+    @staticmethod
+    def _validator_headers(bucket: Buckets, variant: MediaVariant) -> dict:
+        headers = {"Cache-Control": MediaController._cache_control(bucket)}
+        if variant.etag:
+            headers["ETag"] = f'"{variant.etag}"'
+        if variant.last_modified is not None:
+            headers["Last-Modified"] = format_datetime(
+                variant.last_modified.astimezone(timezone.utc), usegmt=True
+            )
+        return headers
+
+    @staticmethod
+    def _is_not_modified(request: Request, variant: MediaVariant) -> bool:
+        if_none_match = request.if_none_match
+        if if_none_match is not None:
+            # * Weak comparison, RFC 9110 13.1.2
+            return variant.etag is not None and any(
+                etag.value in (variant.etag, ETAG_ANY) for etag in if_none_match
+            )
+        if_modified_since = request.if_modified_since
+        if if_modified_since is None or variant.last_modified is None:
+            return False
+        return variant.last_modified.replace(microsecond=0) <= if_modified_since
+
+    @staticmethod
+    def _requested_range(
+        request: Request, variant: MediaVariant
+    ) -> tuple[int, int] | None:
+        # % (offset, length) of a single "bytes=" range or None for the full body
+        if hdrs.RANGE not in request.headers:
+            return None
+        if_range = request.headers.get(hdrs.IF_RANGE)
+        if if_range is not None and if_range != f'"{variant.etag}"':
+            # * The client has a stale part, it gets the whole new object
+            return None
+        try:
+            requested = request.http_range
+        except ValueError:
+            # * Multiple or malformed ranges are ignored (RFC 9110 14.2)
+            return None
+        size = variant.byte_size
+        start, stop = requested.start, requested.stop
+        if start < 0:
+            start = max(0, size + start)
+        if start >= size:
+            raise HTTPRequestRangeNotSatisfiable(
+                headers={"Content-Range": f"bytes */{size}"}
+            )
+        stop = size if stop is None else min(stop, size)
+        return start, stop - start
+
+    async def _deliver(
+        self,
+        request: Request,
+        bucket: Buckets,
+        key: str,
+        variant: MediaVariant | None,
+    ) -> StreamResponse:
+        # ? Don't hold a pooled connection while the body is delivered
+        await request.db_session.release()
+        if variant is not None:
+            key = variant.object_key
+        if ServerConfig.MEDIA_DELIVERY == MediaDelivery.stream:
+            if variant is None:
+                variant = await MinioService.get_variant(bucket=bucket, key=key)
+            headers = self._validator_headers(bucket, variant)
+            if self._is_not_modified(request, variant):
+                Metrics.increment("media_not_modified")
+                return Response(status=304, headers=headers)
+            headers["Content-Type"] = variant.content_type
+            byte_range = None
+            if self._supports_ranges(bucket, variant):
+                headers["Accept-Ranges"] = "bytes"
+                byte_range = self._requested_range(request, variant)
+            if (
+                byte_range is None
+                and bucket.is_image_bucket
+                and MediaCache.accepts(variant.byte_size)
+            ):
+                body = await MinioService.get_bytes(bucket=bucket, key=key)
+                return Response(body=body, headers=headers)
+            if byte_range is None:
+                data = await MinioService.get_data(bucket=bucket, key=key)
+                headers["Content-Length"] = str(variant.byte_size)
+                return await self._stream(request, data, headers)
+            offset, length = byte_range
+            Metrics.increment("media_partial_responses")
+            data = await MinioService.get_data(
+                bucket=bucket, key=key, offset=offset, length=length
+            )
+            headers["Content-Length"] = str(length)
+            headers["Content-Range"] = (
+                f"bytes {offset}-{offset + length - 1}/{variant.byte_size}"
+            )
+            return await self._stream(request, data, headers, status=206)
+
+        if variant is not None and self._is_not_modified(request, variant):
+            Metrics.increment("media_not_modified")
+            return Response(
+                status=304, headers=self._validator_headers(bucket, variant)
+            )
+
+        # * Python never touches the payload, nginx fetches it from minio
+        # * by a short-lived presigned (HMAC signed) link
+        presigned_path = await MinioService.generate_presigned_path(
+            bucket=bucket,
+            key=key,
+            expires=timedelta(seconds=ServerConfig.MEDIA_LINK_SECONDS),
+        )
+        if ServerConfig.MEDIA_DELIVERY == MediaDelivery.accel:
+            Metrics.increment("media_accel_redirects")
+            return Response(
+                headers={
+                    "X-Accel-Redirect": f"{self.INTERNAL_MEDIA_LOCATION}{presigned_path}",
+                    # * nginx keeps Content-Type and Cache-Control of this response,
+                    # * ETag, Last-Modified and ranges come from minio itself
+                    "Cache-Control": self._cache_control(bucket),
+                    "Content-Type": variant.content_type
+                    if variant is not None
+                    else MinioService.guess_mime_type(key),
+                }
+            )
+        Metrics.increment("media_signed_redirects")
+        return Response(
+            status=307,
+            headers={"Location": f"{self.TEMP_MEDIA_LOCATION}{presigned_path}"},
+        )
+
+    @staticmethod
+    async def _stream(
+        request: Request, data: S3ObjectStream, headers: dict, status: int = 200
+    ) -> StreamResponse:
+        stream_response = StreamResponse(status=status, headers=headers)
+        try:
+            await stream_response.prepare(request)
+            async for chunk in data.iter_chunks(64 * 1024):
+                await stream_response.write(chunk)
+            await stream_response.write_eof()
+        finally:
+            data.close()
+        return stream_response
+
     @authenticate()
     async def get(self, request: Request):
         category = request.match_info["category"]
@@ -28,37 +230,14 @@ class MediaController:
                 server_message=f"Bad category: {category}",
             )
         key = request.match_info["key"]
+        variant = None
         if category.is_image_bucket:
-            size = ImageSizes.from_request(request)
-            existing_name = await MinioService.find_existing_with_size(
-                bucket=category,
-                prefix=key,
-                requested_size=size,
-            )
-            data, stat = await MinioService.get_first_with_prefix(
-                bucket=category,
-                prefix=existing_name,
-            )
-        else:
-            data, stat = await MinioService.get(
+            variant = await self._find_image_variant(
                 bucket=category,
-                key=key,
+                media_id=key,
+                requested_size=ImageSizes.from_request(request),
             )
-        stream_response = StreamResponse(
-            headers={
-                "Content-Type": stat.content_type or "application/octet-stream",
-                "Content-Length": str(stat.size),
-            }
-        )
-        await stream_response.prepare(request)
-        chunk_size = 8192
-        while True:
-            chunk = await asyncio.to_thread(data.read, chunk_size)
-            if not chunk:
-                break
-            await stream_response.write(chunk)
-        await stream_response.write_eof()
-        return stream_response
+        return await self._deliver(request, category, key, variant)
 
     @authenticate()
     async def get_avatar_image(self, request: Request):
@@ -101,31 +280,11 @@ class MediaController:
 
         key = request.match_info["key"]
         prefix = f"{folder}/{key}"
+        variant = None
         if category.is_image_bucket:
-            size = ImageSizes.from_request(request)
-            existing_name = await MinioService.find_existing_with_size(
-                bucket=category,
-                prefix=prefix,
-                requested_size=size,
-            )
-            data, stat = await MinioService.get_first_with_prefix(
+            variant = await self._find_image_variant(
                 bucket=category,
-                prefix=existing_name,
+                media_id=prefix,
+                requested_size=ImageSizes.from_request(request),
             )
-        else:
-            data, stat = await MinioService.get(
-                bucket=category,
-                key=f"{folder}/{key}",
-            )
-        stream_response = StreamResponse(
-            headers={"Content-Type": stat.content_type or "application/octet-stream"}
-        )
-        await stream_response.prepare(request)
-        chunk_size = 8192
-        while True:
-            chunk = await asyncio.to_thread(data.read, chunk_size)
-            if not chunk:
-                break
-            await stream_response.write(chunk)
-        await stream_response.write_eof()
-        return stream_response
+        return await self._deliver(request, category, prefix, variant)
@@ -1,4 +1,5 @@
 import asyncio
+from datetime import datetime
 from io import BytesIO
 from logging import Logger
 
@@ -6,6 +7,7 @@ from aiohttp.web import Request, json_response
 
 from config.length_requirements import LengthRequirements
 from config.server_config import ServerConfig
+from controllers.helpers import parse_bool_flag
 from controllers.middlewares import authenticate, content_type_is_multipart
 from controllers.sio_controller import SioController
 from models.exceptions.api_exceptions import (
@@ -24,11 +26,13 @@ from models.exceptions.api_exceptions import (
     ValidationError,
 )
 from models.message import Message
-from models.pagination import Pagination
+from models.pagination import CursorPagination, Pagination
 from repositories.message_repository import MessagesRepository
 from repositories.post_repository import PostRepository
 from repositories.user_repository import UserRepository
+from services.media_index import MediaIndex
 from services.minio_service import Buckets, MinioService
+from services.presence_service import PresenceService
 from utils.image_utils import ImageUtils, VerifyImageError
 
 
@@ -37,6 +41,33 @@ class MessagesController:
         self._logger = logger
         self._sio = main_sio_namespace
 
+    async def _messages_to_json(
+        self, request: Request, messages: list[Message], compact: bool = False
+    ) -> tuple[dict]:
+        if compact:
+            return tuple(
+                map(
+                    lambda msg: msg.to_compact_json(
+                        detect_rels_for_user_id=request.user_id
+                    ),
+                    messages,
+                )
+            )
+        liked_post_ids = await PostRepository.get_liked_post_ids(
+            request.db_session,
+            request.user_id,
+            [msg.attached_post_id for msg in messages],
+        )
+        return tuple(
+            map(
+                lambda msg: msg.to_json(
+                    detect_rels_for_user_id=request.user_id,
+                    liked_post_ids=liked_post_ids,
+                ),
+                messages,
+            )
+        )
+
     @authenticate()
     async def get_chats(self, request: Request):
         pagination = Pagination.from_request(request)
@@ -47,20 +78,19 @@ class MessagesController:
             user_id=user_id,
             pagination=pagination,
         )
+        presences = await PresenceService.get_presences(
+            chat.user2_id if chat.user1_id == request.user_id else chat.user1_id
+            for chat in chats
+        )
         json_chats = tuple(
             map(
-                lambda chat: chat.to_json(detect_rels_for_user_id=request.user_id),
+                lambda chat: chat.to_json(
+                    detect_rels_for_user_id=request.user_id,
+                    presences=presences,
+                ),
                 chats,
             )
         )
-        for i, json_chat in enumerate(json_chats):
-            unread_count = await MessagesRepository.get_unread_count(
-                session=request.db_session,
-                chat_id=json_chat.get('id'),
-                messages_owner_id=json_chat.get('opponent').get('id'),
-            )
-            json_chats[i]['unread_count'] = unread_count
-
         return json_response(
             {
                 "count": len(json_chats),
@@ -72,9 +102,16 @@ class MessagesController:
             }
         )
 
+    @authenticate()
+    async def get_total_unread_count(self, request: Request):
+        total_unread_count = await MessagesRepository.get_total_unread_count(
+            session=request.db_session,
+            user_id=request.user_id,
+        )
+        return json_response({"total_unread_count": total_unread_count})
+
     @authenticate()
     async def get_messages(self, request: Request):
-        pagination = Pagination.from_request(request)
         target_user_id = request.query.get("target_uid")
         if not target_user_id:
             raise UserIdNotSpecifiedError(field_name="target_uid")
@@ -87,28 +124,126 @@ class MessagesController:
             raise UserNotFoundError(
                 user_id=target_user_id, error_message="Target user not found"
             )
-        messages = await MessagesRepository.get_messages(
-            session=request.db_session,
-            current_user_id=request.user_id,
-            other_user_id=target_user_id,
-            pagination=pagination,
-        )
-        json_messages = tuple(
-            map(
-                lambda msg: msg.to_json(
-                    detect_rels_for_user_id=request.user_id,
+        compact = parse_bool_flag(request.query, "compact")
+        if CursorPagination.is_requested(
+            request, "before"
+        ) or CursorPagination.is_requested(request, "after"):
+            before_pagination = CursorPagination.from_request(request, "before")
+            after_pagination = CursorPagination.from_request(request, "after")
+            messages = await MessagesRepository.get_messages_by_cursor(
+                session=request.db_session,
+                current_user_id=request.user_id,
+                other_user_id=target_user_id,
+                before=before_pagination.cursor,
+                after=after_pagination.cursor,
+                limit=before_pagination.limit,
+                compact=compact,
+            )
+            sync_cursor = await MessagesRepository.get_sync_cursor(
+                session=request.db_session,
+                current_user_id=request.user_id,
+                other_user_id=target_user_id,
+            )
+            pagination_json = {
+                "limit": before_pagination.limit,
+                # % Older page, null when there are no more messages
+                "before": CursorPagination.encode(
+                    MessagesRepository.created_cursor(messages[-1])
+                    if len(messages) == before_pagination.limit
+                    else None
                 ),
-                messages,
+                # % Newer page, null when nothing has been loaded
+                "after": CursorPagination.encode(
+                    MessagesRepository.created_cursor(messages[0])
+                    if messages
+                    else after_pagination.cursor
+                ),
+                # % For GET changes
+                "since": CursorPagination.encode(sync_cursor),
+            }
+        else:
+            pagination = Pagination.from_request(request)
+            messages = await MessagesRepository.get_messages(
+                session=request.db_session,
+                current_user_id=request.user_id,
+                other_user_id=target_user_id,
+                pagination=pagination,
+                compact=compact,
             )
+            pagination_json = {
+                "offset": pagination.offset,
+                "limit": pagination.limit,
+            }
+        json_messages = await self._messages_to_json(
+            request, messages, compact=compact
         )
 
         return json_response(
             {
                 "count": len(json_messages),
                 "messages": json_messages,
+                "pagination": pagination_json,
+            }
+        )
+
+    @authenticate()
+    async def get_changes(self, request: Request):
+        target_user_id = request.query.get("target_uid")
+        if not target_user_id:
+            raise UserIdNotSpecifiedError(field_name="target_uid")
+        since_pagination = CursorPagination.from_request(request, "since")
+        since = since_pagination.cursor
+        compact = parse_bool_flag(request.query, "compact")
+        changed_messages = await MessagesRepository.get_changes(
+            session=request.db_session,
+            current_user_id=request.user_id,
+            other_user_id=target_user_id,
+            since=since,
+            limit=since_pagination.limit,
+            compact=compact,
+        )
+
+        # ? created_at has seconds precision, so a message from the cursor second
+        # ? is sent as new again (clients upsert messages by id)
+        since_second = None
+        if since is not None:
+            since_second = datetime.fromisoformat(since["updated_at"]).replace(
+                microsecond=0, tzinfo=None
+            )
+        new_messages: list[Message] = []
+        read_message_ids: list[str] = []
+        deleted_message_ids: list[str] = []
+        for msg in changed_messages:
+            if msg.deleted_at is not None:
+                deleted_message_ids.append(msg.id)
+            elif (
+                since_second is None
+                or not msg.readed
+                or msg.created_at.replace(tzinfo=None) >= since_second
+            ):
+                new_messages.append(msg)
+            else:
+                read_message_ids.append(msg.id)
+
+        has_more = len(changed_messages) == since_pagination.limit
+        next_since = (
+            MessagesRepository.updated_cursor(changed_messages[-1])
+            if changed_messages
+            else since
+        )
+        if not has_more:
+            next_since = MessagesRepository.settled_cursor(next_since)
+        return json_response(
+            {
+                "new_messages": await self._messages_to_json(
+                    request, new_messages, compact=compact
+                ),
+                "read_message_ids": read_message_ids,
+                "deleted_message_ids": deleted_message_ids,
                 "pagination": {
-                    "offset": pagination.offset,
-                    "limit": pagination.limit,
+                    "limit": since_pagination.limit,
+                    "since": CursorPagination.encode(next_since),
+                    "has_more": has_more,
                 },
             }
         )
@@ -286,10 +421,11 @@ class MessagesController:
 
             # % Copying attached message images if they exist
             if attached_message.attached_images_count:
-                await MinioService.copy_message_images(
+                copied_variants = await MinioService.copy_message_images(
                     source_msg_id=attached_message.id,
                     to_msg_id=cloned_message.id,
                 )
+                await MediaIndex.add_variants(Buckets.messages, copied_variants)
         else:
             # % Usual message, without forwarding
             new_message = await MessagesRepository.create_message(
@@ -311,12 +447,13 @@ class MessagesController:
                     ImageUtils.split_image_sync,
                     image_buffer=image["content"],
                 )
-                for size, buffer in splitted_images.items():
-                    await MinioService.save(
-                        bucket=Buckets.messages,
-                        key=f"{new_message.id}/{image['index']}/{size.str_view}{image['ext']}",
-                        bytes=buffer,
-                    )
+                variants = await MinioService.save_image_variants(
+                    bucket=Buckets.messages,
+                    media_id=f"{new_message.id}/{image['index']}",
+                    images=splitted_images,
+                    extension=image["ext"],
+                )
+                await MediaIndex.add_variants(Buckets.messages, variants)
 
         # ***************************** End devil logic ***************************** #
 
@@ -333,10 +470,18 @@ class MessagesController:
                     f"Forwarded from user: @{new_msg.forwarded_from_user.username}"
                 )
             self._logger.debug("")
+        attached_post_ids = [new_msg.attached_post_id for new_msg in new_messages]
+        liked_post_ids_by_sender = await PostRepository.get_liked_post_ids(
+            request.db_session, request.user_id, attached_post_ids
+        )
+        liked_post_ids_by_target = await PostRepository.get_liked_post_ids(
+            request.db_session, target_uid, attached_post_ids
+        )
         json_messages_for_sender = tuple(
             map(
                 lambda new_msg: new_msg.to_json(
                     detect_rels_for_user_id=request.user_id,
+                    liked_post_ids=liked_post_ids_by_sender,
                 ),
                 new_messages,
             )
@@ -345,24 +490,22 @@ class MessagesController:
             map(
                 lambda new_msg: new_msg.to_json(
                     detect_rels_for_user_id=target_uid,
+                    liked_post_ids=liked_post_ids_by_target,
                 ),
                 new_messages,
             )
         )
-        await self._sio.emit_user(
-            user_id=request.user_id,
+        await self._sio.emit_users(
             event="new_messages",
-            data={
-                "new_messages": json_messages_for_sender,
-                "chat_opponent_id": target_uid,
-            },
-        )
-        await self._sio.emit_user(
-            user_id=target_uid,
-            event="new_messages",
-            data={
-                "new_messages": json_messages_for_target,
-                "chat_opponent_id": request.user_id,
+            data_by_user_id={
+                request.user_id: {
+                    "new_messages": json_messages_for_sender,
+                    "chat_opponent_id": target_uid,
+                },
+                target_uid: {
+                    "new_messages": json_messages_for_target,
+                    "chat_opponent_id": request.user_id,
+                },
             },
         )
         return json_response({"new_messages": json_messages_for_sender})
@@ -390,13 +533,17 @@ class MessagesController:
             target_message_id=message_id,
         )
         if was_images:
-            await MinioService.delete_all_by_prefix(
+            deleted_keys = await MinioService.delete_all_by_prefix(
                 bucket=Buckets.messages,
                 prefix=message_id,
             )
+            await MediaIndex.remove_objects(Buckets.messages, deleted_keys)
 
         json_deleted_message = deleted_message.to_json(
             detect_rels_for_user_id=request.user_id,
+            liked_post_ids=await PostRepository.get_liked_post_ids(
+                request.db_session, request.user_id, [deleted_message.attached_post_id]
+            ),
         )
 
         json_chat_last_message_for_sender = None
@@ -411,22 +558,19 @@ class MessagesController:
                 detect_rels_for_user_id=deleted_message.recipient_id,
             )
 
-        await self._sio.emit_user(
-            user_id=deleted_message.sender_id,
-            event="message_was_deleted",
-            data={
-                "message_id": deleted_message.id,
-                "chat_opponent_id": deleted_message.recipient_id,
-                "previous_message": json_chat_last_message_for_sender,
-            },
-        )
-        await self._sio.emit_user(
-            user_id=deleted_message.recipient_id,
+        await self._sio.emit_users(
             event="message_was_deleted",
-            data={
-                "message_id": deleted_message.id,
-                "chat_opponent_id": deleted_message.sender_id,
-                "previous_message": json_chat_last_message_for_recipient,
+            data_by_user_id={
+                deleted_message.sender_id: {
+                    "message_id": deleted_message.id,
+                    "chat_opponent_id": deleted_message.recipient_id,
+                    "previous_message": json_chat_last_message_for_sender,
+                },
+                deleted_message.recipient_id: {
+                    "message_id": deleted_message.id,
+                    "chat_opponent_id": deleted_message.sender_id,
+                    "previous_message": json_chat_last_message_for_recipient,
+                },
             },
         )
         return json_response(
@@ -449,9 +593,15 @@ class MessagesController:
             raise MessageNotFoundError(message_id)
         if target_message.recipient_id != request.user_id:
             raise ForbiddenToReadMessageError()
+        liked_post_ids = await PostRepository.get_liked_post_ids(
+            request.db_session, request.user_id, [target_message.attached_post_id]
+        )
         if target_message.readed:
             return json_response(
-                target_message.to_json(detect_rels_for_user_id=request.user_id)
+                target_message.to_json(
+                    detect_rels_for_user_id=request.user_id,
+                    liked_post_ids=liked_post_ids,
+                )
             )
 
         updated_message = await MessagesRepository.mark_readed(
@@ -467,5 +617,35 @@ class MessagesController:
             },
         )
         return json_response(
-            updated_message.to_json(detect_rels_for_user_id=request.user_id)
+            updated_message.to_json(
+                detect_rels_for_user_id=request.user_id,
+                liked_post_ids=liked_post_ids,
+            )
+        )
+
+    @authenticate()
+    async def mark_read_until(self, request: Request):
+        target_uid = request.query.get("target_uid")
+        if not target_uid:
+            raise UserIdNotSpecifiedError(field_name="target_uid")
+        message_id = request.query.get("message_id")
+        if not message_id:
+            raise MessageIdNotSpecifiedError()
+        until_message, read_count = await MessagesRepository.mark_read_until(
+            session=request.db_session,
+            reader_id=request.user_id,
+            opponent_id=target_uid,
+            until_message_id=message_id,
+        )
+        await self._sio.emit_messages_were_read(
+            sender_id=target_uid,
+            reader_id=request.user_id,
+            until_message_id=until_message.id,
+            read_count=read_count,
+        )
+        return json_response(
+            {
+                "until_message_id": until_message.id,
+                "read_count": read_count,
+            }
         )
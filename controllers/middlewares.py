@@ -5,7 +5,9 @@ from time import time
 from aiohttp.web import Request, Response, json_response, middleware
 from aiohttp.web_exceptions import HTTPError
 
+from config.server_config import ServerConfig
 from database.database import Database
+from database.lazy_session import LazySession
 from models.exceptions.api_exceptions import (
     ApiError,
     BadContentTypeError,
@@ -18,6 +20,7 @@ from models.exceptions.api_exceptions import (
 )
 from models.role import Role
 from repositories.user_repository import UserRepository
+from services.revocation_store import RevocationStore
 from services.tokens_service import TokensService
 from utils.my_validator.exceptions import MyValidatorError
 
@@ -49,9 +52,15 @@ def authenticate():
             try:
                 data = _get_access_token_data(request.headers.get("authorization"))
                 user_id = data.get("id")
-                user = await UserRepository.get_by_id_with_relations(request.db_session, user_id)
-                if not user:
+                if not user_id:
                     raise UnauthorizedError()
+                if ServerConfig.STATELESS_AUTH:
+                    if await RevocationStore.is_revoked(user_id, data.get("iat")):
+                        raise UnauthorizedError()
+                else:
+                    user = await UserRepository.get_by_id(request.db_session, user_id)
+                    if not user:
+                        raise UnauthorizedError()
                 request.user_id = user_id
                 request.user_role = Role(data.get("role"))
             except Exception as _:
@@ -120,11 +129,13 @@ def registration_completed():
     def decorator(handler):
         @wraps(handler)
         async def wrapper(self, request: Request):
-            user = await UserRepository.get_by_id_with_relations(request.db_session, request.user_id)
-            if not user:
+            state = await UserRepository.get_registration_state(
+                request.db_session, request.user_id
+            )
+            if not state:
                 raise UnauthorizedError()
-            if not user.is_registration_completed:
-                raise IncompleteRegistrationError(email=user.email_address)
+            if not state.is_registration_completed:
+                raise IncompleteRegistrationError(email=state.email_address)
             return await handler(self, request)
 
         return wrapper
@@ -243,12 +254,14 @@ class Middlewares:
 
     @middleware
     async def database_session(self, request: Request, handler):
-        async with Database.session_maker() as session:
-            request.db_session = session
-            try:
-                response = await handler(request)
-                await session.commit()
-                return response
-            except Exception:
-                await session.rollback()
-                raise
+        request.db_session = LazySession(
+            Database.session_maker,
+            read_only=request.method in ("GET", "HEAD"),
+        )
+        try:
+            response = await handler(request)
+        except Exception:
+            await request.db_session.release(commit=False)
+            raise
+        await request.db_session.release()
+        return response
@@ -6,7 +6,7 @@ from aiohttp.web import Request, json_response
 
 from config.length_requirements import LengthRequirements
 from config.server_config import ServerConfig
-from controllers.helpers import parse_short_flag
+from controllers.helpers import parse_bool_flag
 from controllers.middlewares import authenticate, content_type_is_multipart
 from controllers.sio_controller import SioController
 from models.exceptions.api_exceptions import (
@@ -20,10 +20,12 @@ from models.exceptions.api_exceptions import (
     TooManyImagesInPostError,
     ValidationError,
 )
-from models.pagination import Pagination
+from models.pagination import CursorPagination, Pagination
 from models.post import Post
 from repositories.post_repository import PostRepository
+from services.media_index import MediaIndex
 from services.minio_service import Buckets, MinioService
+from services.presence_service import PresenceService
 from utils.image_utils import ImageUtils, VerifyImageError
 from utils.sizes import SizeUtils
 
@@ -35,29 +37,56 @@ class PostsController:
 
     @authenticate()
     async def get_all(self, request: Request):
-        pagination = Pagination.from_request(request)
         user_id = request.query.get("user_id")
-        short = parse_short_flag(request.query)
-        posts = await PostRepository.get_all(
-            session=request.db_session,
-            user_id=user_id,
-            pagination=pagination,
-        )
+        short = parse_bool_flag(request.query, "short")
+        if CursorPagination.is_requested(request):
+            cursor_pagination = CursorPagination.from_request(request)
+            posts, next_cursor = await PostRepository.get_all_by_cursor(
+                session=request.db_session,
+                user_id=user_id,
+                cursor=cursor_pagination.cursor,
+                limit=cursor_pagination.limit,
+            )
+            pagination_json = {
+                "limit": cursor_pagination.limit,
+                "next_cursor": CursorPagination.encode(next_cursor),
+            }
+        else:
+            pagination = Pagination.from_request(request)
+            posts = await PostRepository.get_all(
+                session=request.db_session,
+                user_id=user_id,
+                pagination=pagination,
+            )
+            pagination_json = {
+                "offset": pagination.offset,
+                "limit": pagination.limit,
+            }
+
+        liked_post_ids = set()
+        presences = {}
+        if not short:
+            liked_post_ids = await PostRepository.get_liked_post_ids(
+                request.db_session, request.user_id, [post.id for post in posts]
+            )
+            presences = await PresenceService.get_presences(
+                post.author_id for post in posts
+            )
 
         json_posts = tuple(
             map(
                 lambda post: post.to_json(
-                    detect_rels_for_user_id=request.user_id, short=short
+                    detect_rels_for_user_id=request.user_id,
+                    short=short,
+                    liked_post_ids=liked_post_ids,
+                    presences=presences,
                 ),
                 posts,
             )
         )
         json_result = {
             "count": len(posts),
-            "pagination": {
-                "offset": pagination.offset,
-                "limit": pagination.limit,
-            },
+            "pagination": pagination_json,
         }
         if user_id:
             json_result["user_id"] = user_id
@@ -74,7 +103,17 @@ class PostsController:
         )
         if not post:
             raise PostNotFoundError(post_id)
-        return json_response(data=post.to_json(detect_rels_for_user_id=request.user_id))
+        liked_post_ids = await PostRepository.get_liked_post_ids(
+            request.db_session, request.user_id, [post.id]
+        )
+        presences = await PresenceService.get_presences([post.author_id])
+        return json_response(
+            data=post.to_json(
+                detect_rels_for_user_id=request.user_id,
+                liked_post_ids=liked_post_ids,
+                presences=presences,
+            )
+        )
 
     @authenticate()
     @content_type_is_multipart()
@@ -165,14 +204,17 @@ class PostsController:
                 ImageUtils.split_image_sync,
                 image_buffer=image["content"],
             )
-            for size, buffer in splitted_images.items():
-                await MinioService.save(
-                    bucket=Buckets.posts,
-                    key=f"{new_post.id}/{image['index']}/{size.str_view}{image['ext']}",
-                    bytes=buffer,
-                )
+            variants = await MinioService.save_image_variants(
+                bucket=Buckets.posts,
+                media_id=f"{new_post.id}/{image['index']}",
+                images=splitted_images,
+                extension=image["ext"],
+            )
+            await MediaIndex.add_variants(Buckets.posts, variants)
 
-        return json_response(new_post.to_json(detect_rels_for_user_id=request.user_id))
+        return json_response(
+            new_post.to_json(detect_rels_for_user_id=request.user_id, liked_post_ids=set())
+        )
 
     @authenticate()
     async def delete(self, request: Request):
@@ -190,13 +232,20 @@ class PostsController:
         deleted_post = await PostRepository.soft_delete(
             session=request.db_session, target_post_id=post_id
         )
-        await MinioService.delete_all_by_prefix(
+        deleted_keys = await MinioService.delete_all_by_prefix(
             bucket=Buckets.posts,
             prefix=post.id,
         )
+        await MediaIndex.remove_objects(Buckets.posts, deleted_keys)
         await self._sio.emit_post_deleted(post_id=post_id)
+        liked_post_ids = await PostRepository.get_liked_post_ids(
+            request.db_session, request.user_id, [post_id]
+        )
         return json_response(
-            data=deleted_post.to_json(detect_rels_for_user_id=request.user_id)
+            data=deleted_post.to_json(
+                detect_rels_for_user_id=request.user_id,
+                liked_post_ids=liked_post_ids,
+            )
         )
 
     @authenticate()
@@ -212,7 +261,10 @@ class PostsController:
             logger=self._logger,
         )
         return json_response(
-            data=liked_post.to_json(detect_rels_for_user_id=request.user_id)
+            data=liked_post.to_json(
+                detect_rels_for_user_id=request.user_id,
+                liked_post_ids={liked_post.id},
+            )
         )
 
     @authenticate()
@@ -227,5 +279,8 @@ class PostsController:
             user_id=request.user_id,
         )
         return json_response(
-            data=updated_post.to_json(detect_rels_for_user_id=request.user_id)
+            data=updated_post.to_json(
+                detect_rels_for_user_id=request.user_id,
+                liked_post_ids=set(),
+            )
         )
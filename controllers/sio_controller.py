@@ -1,4 +1,5 @@
 import asyncio
+import time
 from datetime import datetime
 from functools import wraps
 from logging import Logger
@@ -6,13 +7,19 @@ from logging import Logger
 from jwt.exceptions import ExpiredSignatureError, PyJWTError
 from socketio import AsyncNamespace
 
+from config.server_config import ServerConfig
 from database.database import Database
 from models.comment import Comment
+from models.exceptions.api_exceptions import ApiError
 from models.sio.authorize_error import AuthorizeError
 from models.sio.sio_ack import SioAck
 from models.sio.sio_rooms import SioRooms
 from models.sio.sio_session import SioSession
+from repositories.message_repository import MessagesRepository
 from repositories.user_repository import UserRepository
+from services.metrics import Metrics
+from services.presence_service import PresenceService
+from services.revocation_store import RevocationStore
 from services.session_store import SessionStore
 from services.tokens_service import TokensService
 from utils.serialize_util import serialize_value
@@ -33,27 +40,68 @@ def check_authorization(handler):
 
 
 class SioController(AsyncNamespace):
+    MAX_PRESENCE_SUBSCRIPTIONS = 500
+    AUTHORIZATION_TIMEOUT_SECONDS = 60
+    SWEEP_INTERVAL_SECONDS = 1
+    SWEEP_BATCH_SIZE = 1000
+    PRESENCE_AUDIENCE_LIMIT = 5000  # ? Bigger audiences get presence by subscription only
+
     def __init__(self, logger: Logger, namespace="/"):
         super().__init__(namespace)
         self._logger = logger
-        self._wait_authorization_tasks: dict[str, asyncio.Task] = {}
+        # ? sid -> deadline. The timeout is the same for everyone,
+        # ? so insertion order is deadline order and one sweeper is enough
+        self._pending_authorizations: dict[str, float] = {}
+        self._authorization_sweeper: asyncio.Task | None = None
+        self._presence_emit_tasks: dict[str, asyncio.Task] = {}
 
-    async def _wait_authorization(self, sid):
-        await asyncio.sleep(60)
-        sio_session = await SessionStore.get_session_by_sid(sid)
-        if not sio_session:
-            self._logger.info(
-                f"[{sid}] Didn't authorize for a minute, disconnecting...\n"
+    def _wait_authorization(self, sid):
+        self._pending_authorizations[sid] = (
+            time.monotonic() + self.AUTHORIZATION_TIMEOUT_SECONDS
+        )
+        if self._authorization_sweeper is None or self._authorization_sweeper.done():
+            self._authorization_sweeper = asyncio.create_task(
+                self._sweep_unauthorized()
             )
-            await self.disconnect(sid)
-        self._cancel_wait_authorization(sid)
 
     def _cancel_wait_authorization(self, sid):
-        task = self._wait_authorization_tasks.get(sid)
-        if task:
-            task.cancel()
-            self._wait_authorization_tasks.pop(sid, None)
-            self._logger.debug(f"[{sid}] Wait authorization task canceled\n")
+        if self._pending_authorizations.pop(sid, None) is not None:
+            self._logger.debug(f"[{sid}] Stopped waiting for authorization\n")
+
+    def _pop_expired_authorizations(self) -> list[str]:
+        now = time.monotonic()
+        expired_sids = []
+        for sid, deadline in self._pending_authorizations.items():
+            if deadline > now or len(expired_sids) >= self.SWEEP_BATCH_SIZE:
+                break
+            expired_sids.append(sid)
+        for sid in expired_sids:
+            self._pending_authorizations.pop(sid, None)
+        return expired_sids
+
+    async def _disconnect_unauthorized(self, sid):
+        try:
+            if not await SessionStore.get_session_by_sid(sid):
+                await self.disconnect(sid)
+        except Exception as error:
+            self._logger.error(f"[{sid}] Error on disconnect unauthorized: {error}")
+
+    async def _sweep_unauthorized(self):
+        while self._pending_authorizations:
+            await asyncio.sleep(self.SWEEP_INTERVAL_SECONDS)
+            # * Disconnecting by batches not to flood the loop after a reconnect storm
+            while expired_sids := self._pop_expired_authorizations():
+                self._logger.info(
+                    f"{len(expired_sids)} connections didn't authorize for a minute, disconnecting...\n"
+                )
+                Metrics.increment("unauthorized_disconnects", len(expired_sids))
+                await asyncio.gather(
+                    *(self._disconnect_unauthorized(sid) for sid in expired_sids)
+                )
+            Metrics.set_gauge(
+                "pending_authorizations", len(self._pending_authorizations)
+            )
+        Metrics.set_gauge("pending_authorizations", 0)
 
     async def _authorize(self, db_session, sid, data) -> SioSession:
         try:
@@ -72,11 +120,16 @@ class SioController(AsyncNamespace):
             token_data = TokensService.decode_access(access_token)
             user_id = token_data.get("id")
             user_role = token_data.get("role")
-            user = await UserRepository.get_by_id_with_relations(
+            if await RevocationStore.is_revoked(user_id, token_data.get("iat")):
+                raise AuthorizeError(
+                    internal_message=f"Access token of user({user_id}) was revoked",
+                    ack_message="Bad token",
+                )
+            registration_state = await UserRepository.get_registration_state(
                 session=db_session,
                 user_id=user_id,
             )
-            if not user:
+            if not registration_state:
                 raise AuthorizeError(
                     internal_message=f"Access token is valid, but unable to find user with id({user_id})",
                     ack_message="Bad token",
@@ -114,36 +167,65 @@ class SioController(AsyncNamespace):
                 internal_message=f"Unecxecpted error on authorization: {unexcepted_error}"
             )
 
+    def _schedule_presence_emit(self, user_id: str):
+        # ? A flapping client produces one event per window at most
+        if user_id in self._presence_emit_tasks:
+            Metrics.increment("presence_changes_coalesced")
+            return
+        self._presence_emit_tasks[user_id] = asyncio.create_task(
+            self._debounced_presence_emit(user_id)
+        )
+
+    async def _debounced_presence_emit(self, user_id: str):
+        try:
+            await asyncio.sleep(ServerConfig.PRESENCE_DEBOUNCE_SECONDS)
+        finally:
+            self._presence_emit_tasks.pop(user_id, None)
+        try:
+            presence = (await PresenceService.get_presences([user_id])).get(user_id)
+            if presence is None or not await PresenceService.swap_emitted(presence):
+                Metrics.increment("presence_emits_skipped")
+                return
+            if presence.is_online:
+                await self.emit_user_is_online(user_id)
+            else:
+                await self.emit_user_is_offline(user_id, presence.last_seen)
+        except Exception as error:
+            self._logger.error(f"Error on emit presence of user {user_id}: {error}")
+
     # * ------------------------ Event Listeners ------------------------
     async def on_connect(self, sid, environ, auth=None):
-        self._wait_authorization_tasks[sid] = asyncio.create_task(
-            self._wait_authorization(sid)
-        )
+        self._wait_authorization(sid)
         self._logger.info(f"[{sid}] Connected, waiting for authorization...\n")
 
     async def on_disconnect(self, sid, reason):
-        async with Database.session_maker() as db_session:
-            self._logger.info(f"[{sid}] Disconnected ({reason})\n")
-            self._cancel_wait_authorization(sid)
-            sio_session: SioSession | None = await SessionStore.get_session_by_sid(sid)
+        self._logger.info(f"[{sid}] Disconnected ({reason})\n")
+        self._cancel_wait_authorization(sid)
+        sio_session: SioSession | None = await SessionStore.get_session_by_sid(sid)
 
-            # * Set user disconnected
-            if sio_session:
+        # * Set user disconnected
+        if sio_session:
+            user_id = sio_session.user_id
+            async with Database.session_maker() as db_session:
                 try:
-                    updated_user = await UserRepository.set_current_sid(
-                        db_session, sio_session.user_id, new_sid=None
+                    await UserRepository.set_current_sid(
+                        db_session, user_id, new_sid=None, only_if_sid=sid
                     )
                     await db_session.commit()
-                    await self.emit_user_is_offline(
-                        user_id=sio_session.user_id,
-                        last_seen=updated_user.last_seen,
-                    )
-                    await SessionStore.remove_session(sid)
                 except Exception as db_error:
                     await db_session.rollback()
                     self._logger.error(
-                        f"(on_disconnect) Error on set current sid to user {sio_session.user_id}: {db_error}"
+                        f"(on_disconnect) Error on reset current sid of user {user_id}: {db_error}"
                     )
+            try:
+                await SessionStore.remove_session(sid)
+                if not await SessionStore.get_sids_by_user_id(user_id):
+                    await PresenceService.set_offline(user_id)
+                    self._schedule_presence_emit(user_id)
+            except Exception as error:
+                self._logger.error(
+                    f"(on_disconnect) Error on set user {user_id} offline: {error}"
+                )
 
     async def on_authorize(self, sid, data=None):
         if not data or not isinstance(data, dict):
@@ -192,44 +274,32 @@ class SioController(AsyncNamespace):
         self._logger.debug(f"[{sid}] got event (put_app_in_background)\n")
 
         # * Set user offline
-        async with Database.session_maker() as db_session:
-            try:
-                updated_user = await UserRepository.toggle_online(
-                    db_session, sio_session.user_id, False
-                )
-                await db_session.commit()
-                await self.emit_user_is_offline(
-                    user_id=sio_session.user_id, last_seen=updated_user.last_seen
-                )
-                return SioAck.success().to_json()
-            except Exception as error:
-                self._logger.error(
-                    f"(on_put_app_in_background) error on toggle online: {error}"
-                )
-                await db_session.rollback()
-                return SioAck.failed().to_json()
+        try:
+            await PresenceService.set_offline(sio_session.user_id)
+        except Exception as error:
+            self._logger.error(
+                f"(on_put_app_in_background) error on set presence: {error}"
+            )
+            return SioAck.failed().to_json()
+        self._schedule_presence_emit(sio_session.user_id)
+        return SioAck.success().to_json()
 
     @check_authorization
     async def on_put_app_in_foreground(
         self, sid, data=None, sio_session: SioSession = None
     ):
         self._logger.debug(f"[{sid}] got event (put_app_in_foreground)\n")
-        await self.emit_user_is_online(sio_session.user_id)
 
         # * Set user online
-        async with Database.session_maker() as db_session:
-            try:
-                await UserRepository.toggle_online(
-                    db_session, sio_session.user_id, True
-                )
-                await db_session.commit()
-                return SioAck.success().to_json()
-            except Exception as error:
-                self._logger.error(
-                    f"(on_put_app_in_background) error on toggle online: {error}"
-                )
-                await db_session.rollback()
-                return SioAck.failed().to_json()
+        try:
+            await PresenceService.set_online(sio_session.user_id)
+        except Exception as error:
+            self._logger.error(
+                f"(on_put_app_in_foreground) error on set presence: {error}"
+            )
+            return SioAck.failed().to_json()
+        self._schedule_presence_emit(sio_session.user_id)
+        return SioAck.success().to_json()
 
     @check_authorization
     async def on_join_to_post_room(
@@ -261,27 +331,125 @@ class SioController(AsyncNamespace):
         self._logger.info(f"User({sio_session.user_id}) left the room ({post_room})\n")
         return SioAck.success()
 
+    @check_authorization
+    async def on_mark_read_until(
+        self, sid, data: dict | None = None, sio_session: SioSession = None
+    ):
+        if not isinstance(data, dict):
+            return SioAck.failed(
+                error_text="Target uid and message id must be specified"
+            ).to_json()
+        target_uid = data.get("target_uid")
+        message_id = data.get("message_id")
+        if not target_uid or not message_id:
+            return SioAck.failed(
+                error_text="Target uid and message id must be specified"
+            ).to_json()
+        async with Database.session_maker() as db_session:
+            try:
+                until_message, read_count = await MessagesRepository.mark_read_until(
+                    session=db_session,
+                    reader_id=sio_session.user_id,
+                    opponent_id=target_uid,
+                    until_message_id=message_id,
+                )
+                await db_session.commit()
+            except ApiError as api_error:
+                await db_session.rollback()
+                return SioAck.failed(error_text=api_error.global_errors[0]).to_json()
+            except Exception as error:
+                await db_session.rollback()
+                self._logger.error(f"(on_mark_read_until) error on mark read: {error}")
+                return SioAck.failed().to_json()
+        await self.emit_messages_were_read(
+            sender_id=target_uid,
+            reader_id=sio_session.user_id,
+            until_message_id=until_message.id,
+            read_count=read_count,
+        )
+        return SioAck.success(
+            data={"until_message_id": until_message.id, "read_count": read_count}
+        ).to_json()
+
+    @check_authorization
+    async def on_subscribe_presence(
+        self, sid, data: dict | None = None, sio_session: SioSession = None
+    ):
+        user_ids = data.get("user_ids") if isinstance(data, dict) else None
+        if not isinstance(user_ids, list) or not user_ids:
+            return SioAck.failed(error_text="User ids must be specified").to_json()
+        if len(user_ids) > self.MAX_PRESENCE_SUBSCRIPTIONS:
+            return SioAck.failed(
+                error_text=f"Max {self.MAX_PRESENCE_SUBSCRIPTIONS} user ids at once"
+            ).to_json()
+        for user_id in user_ids:
+            await self.enter_room(
+                sid=sid, room=SioRooms.get_presence_room(user_id=str(user_id))
+            )
+        Metrics.increment("presence_subscriptions", len(user_ids))
+        return SioAck.success().to_json()
+
+    @check_authorization
+    async def on_unsubscribe_presence(
+        self, sid, data: dict | None = None, sio_session: SioSession = None
+    ):
+        user_ids = data.get("user_ids") if isinstance(data, dict) else None
+        if not isinstance(user_ids, list):
+            return SioAck.failed(error_text="User ids must be specified").to_json()
+        for user_id in user_ids:
+            await self.leave_room(
+                sid=sid, room=SioRooms.get_presence_room(user_id=str(user_id))
+            )
+        return SioAck.success().to_json()
+
     # * ------------------------ Emitters ------------------------
     async def on_logout(self, user_sid: str | None):
         if user_sid:
             await self.disconnect(user_sid)
 
-    async def on_user_deleted(self, user_sid: str | None):
-        if user_sid:
-            await self.disconnect(user_sid)
+    async def on_user_deleted(self, user_id: str):
+        # * Disconnect goes through the manager, so sockets on other nodes are closed too
+        # * and on_disconnect cleans up their sessions and presence
+        user_sids = await SessionStore.get_sids_by_user_id(user_id)
+        await asyncio.gather(*(self.disconnect(sid) for sid in user_sids))
+
+    async def _emit_presence(self, event: str, user_id: str, data: dict):
+        # ? Only to online followers and chat partners and to explicit subscribers
+        async with Database.session_maker() as db_session:
+            audience_ids = await UserRepository.get_presence_audience_ids(
+                db_session, user_id, limit=self.PRESENCE_AUDIENCE_LIMIT
+            )
+        rooms = [SioRooms.get_presence_room(user_id=user_id)]
+        if audience_ids is None:
+            # * A popular user, only those who subscribed get the change
+            Metrics.increment("presence_fanout_capped")
+        else:
+            presences = await PresenceService.get_presences(audience_ids)
+            rooms.extend(
+                SioRooms.get_personal_room(user_id=uid)
+                for uid, presence in presences.items()
+                if presence.is_online
+            )
+        local_recipients = sum(
+            1 for _ in self.server.manager.get_participants(self.namespace, rooms)
+        )
+        Metrics.increment(f"{event}_events")
+        Metrics.observe("presence_fanout_rooms", len(rooms))
+        Metrics.observe("presence_fanout_sids", local_recipients)
+        await self.emit(event=event, data=data, room=rooms)
 
     async def emit_user_is_offline(self, user_id: str, last_seen: datetime):
-        await self.emit(
+        await self._emit_presence(
             event="user_is_offline",
+            user_id=user_id,
             data={"user_id": user_id, "last_seen": serialize_value(last_seen)},
-            room=SioRooms.get_authorized_room(),
         )
 
     async def emit_user_is_online(self, user_id: str):
-        await self.emit(
+        await self._emit_presence(
             event="user_is_online",
+            user_id=user_id,
             data={"user_id": user_id},
-            room=SioRooms.get_authorized_room(),
         )
 
     async def emit_new_follower(
@@ -358,4 +526,31 @@ class SioController(AsyncNamespace):
                 event=event,
                 data=data,
                 to=list(user_sids),
-            )
\ No newline at end of file
+            )
+
+    async def emit_users(self, event: str, data_by_user_id: dict[str, dict]):
+        # ? One redis round trip for all recipients
+        sids_by_user_id = await SessionStore.get_sids_by_user_ids(data_by_user_id)
+        for user_id, data in data_by_user_id.items():
+            user_sids = sids_by_user_id.get(user_id)
+            if user_sids:
+                await self.emit(event=event, data=data, to=list(user_sids))
+
+    async def emit_messages_were_read(
+        self,
+        sender_id: str,
+        reader_id: str,
+        until_message_id: str,
+        read_count: int,
+    ):
+        if not read_count:
+            return
+        await self.emit_user(
+            user_id=sender_id,
+            event="messages_were_read",
+            data={
+                "chat_opponent_id": reader_id,
+                "until_message_id": until_message_id,
+                "read_count": read_count,
+            },
+        )
@@ -9,7 +9,7 @@ from aiohttp.web_exceptions import HTTPNotImplemented
 
 from config.length_requirements import LengthRequirements
 from config.server_config import ServerConfig
-from controllers.helpers import parse_short_flag
+from controllers.helpers import parse_bool_flag
 from controllers.middlewares import (
     authenticate,
     content_type_is_json,
@@ -31,11 +31,16 @@ from models.exceptions.api_exceptions import (
     ValidationError,
 )
 from models.gender import Gender
-from models.pagination import Pagination
+from models.pagination import CursorPagination, Pagination
 from models.role import Role
 from repositories.fcm_token_repository import FCMTokenRepository
 from repositories.user_repository import UserRepository
+from repositories.user_search_repository import UserSearchRepository
+from services.media_index import MediaIndex
 from services.minio_service import Buckets, MinioService
+from services.presence_service import PresenceService
+from services.revocation_store import RevocationStore
+from services.session_store import SessionStore
 from services.tokens_service import TokensService
 from utils.image_utils import ImageUtils, VerifyImageError
 from utils.my_validator.my_validator import ValidateField, validate_request_body
@@ -64,20 +69,21 @@ class UsersController:
         user = await UserRepository.get_by_id_with_relations(
             request.db_session, user_id, include_deleted=True
         )
-        short_flag = parse_short_flag(request.query)
+        short_flag = parse_bool_flag(request.query, "short")
         if user is None:
             raise UserNotFoundError(user_id)
+        presences = await PresenceService.get_presences([user.id])
         return json_response(
             data=user.to_json(
                 safe=user_id == request.user_id,
                 detect_rels_for_user_id=request.user_id,
                 short=short_flag,
+                presences=presences,
             )
         )
 
     @authenticate()
     async def search(self, request: Request):
-        pagination = Pagination.from_request(request)
         search_data = request.query.get("search_data", None)
         ValidateField(
             field_name="search_data",
@@ -86,17 +92,44 @@ class UsersController:
         )(search_data)
         search_data = search_data.strip()
 
-        result = await UserRepository.find_by_pattern(
-            session=request.db_session,
-            pattern=search_data,
-            pagination=pagination,
-            ignore_id=request.user_id,
+        if CursorPagination.is_requested(request):
+            cursor_pagination = CursorPagination.from_request(request)
+            result, next_cursor = await UserSearchRepository.search_by_cursor(
+                session=request.db_session,
+                pattern=search_data,
+                cursor=cursor_pagination.cursor,
+                limit=cursor_pagination.limit,
+                ignore_id=request.user_id,
+            )
+            pagination_json = {
+                "limit": cursor_pagination.limit,
+                "next_cursor": CursorPagination.encode(next_cursor),
+            }
+        else:
+            pagination = Pagination.from_request(request)
+            result = await UserSearchRepository.search_by_offset(
+                session=request.db_session,
+                pattern=search_data,
+                offset=pagination.offset,
+                limit=pagination.limit,
+                ignore_id=request.user_id,
+            )
+            pagination_json = {
+                "offset": pagination.offset,
+                "limit": pagination.limit,
+            }
+        relations = await UserRepository.get_relations(
+            request.db_session, request.user_id, [user.id for user in result]
         )
+        presences = await PresenceService.get_presences(user.id for user in result)
 
         result_json = tuple(
             map(
                 lambda user: user.to_json(
-                    short=True, detect_rels_for_user_id=request.user_id
+                    short=True,
+                    detect_rels_for_user_id=request.user_id,
+                    relations=relations,
+                    presences=presences,
                 ),
                 result,
             )
@@ -105,10 +138,7 @@ class UsersController:
         return json_response(
             data={
                 "count": len(result),
-                "pagination": {
-                    "offset": pagination.offset,
-                    "limit": pagination.limit,
-                },
+                "pagination": pagination_json,
                 "users": result_json,
             }
         )
@@ -276,22 +306,24 @@ class UsersController:
             )
             new_avatar_id = str(uuid4())
             if user.avatar_id is not None:
-                await MinioService.delete_all_by_prefix(
+                deleted_keys = await MinioService.delete_all_by_prefix(
                     bucket=Buckets.avatars,
                     prefix=user.avatar_id,
                 )
+                await MediaIndex.remove_objects(Buckets.avatars, deleted_keys)
             updated_user = await UserRepository.update_avatar(
                 session=request.db_session,
                 user_id=user.id,
                 new_avatar_type=avatar_type,
                 new_avatar_id=new_avatar_id,
             )
-            for size, buffer in splitted_images.items():
-                await MinioService.save(
-                    bucket=Buckets.avatars,
-                    key=f"{new_avatar_id}/{size.str_view}{file_ext}",
-                    bytes=buffer,
-                )
+            variants = await MinioService.save_image_variants(
+                bucket=Buckets.avatars,
+                media_id=new_avatar_id,
+                images=splitted_images,
+                extension=file_ext,
+            )
+            await MediaIndex.add_variants(Buckets.avatars, variants)
             self._logger.debug(f"(update avatar) @{user.username} uploaded new avatar")
             return json_response(
                 data={
@@ -302,10 +334,11 @@ class UsersController:
             )
         else:
             if user.avatar_type is AvatarType.external:
-                await MinioService.delete_all_by_prefix(
+                deleted_keys = await MinioService.delete_all_by_prefix(
                     bucket=Buckets.avatars,
                     prefix=user.avatar_id,
                 )
+                await MediaIndex.remove_objects(Buckets.avatars, deleted_keys)
             updated_user = await UserRepository.update_avatar(
                 session=request.db_session,
                 user_id=user.id,
@@ -331,10 +364,11 @@ class UsersController:
         old_avatar_id = saved_user.avatar_id
         updated_user = await UserRepository.delete_avatar(request.db_session, user_id)
         if old_avatar_id:
-            await MinioService.delete_all_by_prefix(
+            deleted_keys = await MinioService.delete_all_by_prefix(
                 bucket=Buckets.avatars,
                 prefix=old_avatar_id,
             )
+            await MediaIndex.remove_objects(Buckets.avatars, deleted_keys)
         self._logger.debug(f"@{saved_user.username} deleted avatar")
         return json_response(
             data={
@@ -357,19 +391,21 @@ class UsersController:
         updated_target_user = await UserRepository.follow(
             request.db_session, user_id, target_id
         )
-
-        target_user = await UserRepository.get_by_id_with_relations(
-            request.db_session, target_id
+        relations = await UserRepository.get_relations(
+            request.db_session, user_id, [target_id]
         )
+
         await self._sio.emit_new_follower(
-            subscruber_id=target_user.id,
+            subscruber_id=updated_target_user.id,
             follower_id=user_id,
             follower_username=updated_target_user.username,
         )
         return json_response(
             {
                 "updated_user": updated_target_user.to_json(
-                    safe=True, detect_rels_for_user_id=request.user_id
+                    safe=True,
+                    detect_rels_for_user_id=request.user_id,
+                    relations=relations,
                 )
             }
         )
@@ -387,10 +423,15 @@ class UsersController:
         updated_target_user = await UserRepository.unfollow(
             request.db_session, user_id, target_id
         )
+        relations = await UserRepository.get_relations(
+            request.db_session, user_id, [target_id]
+        )
         return json_response(
             {
                 "updated_user": updated_target_user.to_json(
-                    safe=True, detect_rels_for_user_id=request.user_id
+                    safe=True,
+                    detect_rels_for_user_id=request.user_id,
+                    relations=relations,
                 )
             }
         )
@@ -408,6 +449,10 @@ class UsersController:
         target_followings = await UserRepository.get_followings(
             request.db_session, target_id, pagination
         )
+        relations = await UserRepository.get_relations(
+            request.db_session, request.user_id, [user.id for user in target_followings]
+        )
+        presences = await PresenceService.get_presences(user.id for user in target_followings)
         return json_response(
             data={
                 "count": len(target_followings),
@@ -418,7 +463,10 @@ class UsersController:
                 "followings": list(
                     map(
                         lambda u: u.to_json(
-                            short=True, detect_rels_for_user_id=request.user_id
+                            short=True,
+                            detect_rels_for_user_id=request.user_id,
+                            relations=relations,
+                            presences=presences,
                         ),
                         target_followings,
                     )
@@ -439,6 +487,10 @@ class UsersController:
         target_followers = await UserRepository.get_followers(
             request.db_session, target_id, pagination
         )
+        relations = await UserRepository.get_relations(
+            request.db_session, request.user_id, [user.id for user in target_followers]
+        )
+        presences = await PresenceService.get_presences(user.id for user in target_followers)
         return json_response(
             data={
                 "count": len(target_followers),
@@ -449,7 +501,10 @@ class UsersController:
                 "followers": list(
                     map(
                         lambda u: u.to_json(
-                            short=True, detect_rels_for_user_id=request.user_id
+                            short=True,
+                            detect_rels_for_user_id=request.user_id,
+                            relations=relations,
+                            presences=presences,
                         ),
                         target_followers,
                     )
@@ -485,11 +540,19 @@ class UsersController:
         if not target_user.is_registration_completed:
             raise BadRequestError("The target user has not completed registration yet")
         # * End validation
-        await UserRepository.update_role(
-            request.db_session,
-            target_id=target_id,
-            new_role=new_role,
-        )
+        try:
+            await UserRepository.update_role(
+                request.db_session,
+                target_id=target_id,
+                new_role=new_role,
+            )
+            await request.db_session.commit()
+        except Exception as _:
+            await request.db_session.rollback()
+            raise
+        # * Only after commit, otherwise a refresh in between gets the old role again
+        await RevocationStore.revoke_user_tokens(target_id)
+        await SessionStore.update_user_role(target_id, new_role)
         owner = await UserRepository.get_owner(request.db_session)
         self._logger.warning(
             f"OWNER({owner.username}) updated role for @{target_user.username} to ({new_role.name})"
@@ -501,7 +564,6 @@ class UsersController:
         user = await UserRepository.get_by_id(request.db_session, request.user_id)
         if user is None:
             raise UserNotFoundError(request.user_id)
-        user_sid = user.current_sid
         try:
             await UserRepository.soft_delete(
                 session=request.db_session, target_id=user.id
@@ -517,7 +579,9 @@ class UsersController:
         except Exception as _:
             await request.db_session.rollback()
             raise
-        await self._sio.on_user_deleted(user_sid)
+        await RevocationStore.revoke_user_tokens(user.id)
+        await SessionStore.invalidate_user(user.id)
+        await self._sio.on_user_deleted(user.id)
         self._logger.warning(f"User (@{user.username}) has been deleted (by himself)\n")
         raise UnauthorizedError()
 
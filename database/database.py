@@ -7,6 +7,7 @@ from sqlalchemy.ext.asyncio import (
 )
 
 from config.database_config import DatabaseConfig
+from config.server_config import ServerConfig, ServerRole
 from models.exceptions.initalize_exceptions import (
 	ConfigNotInitalizedButUsingError,
 	DatabaseNotInitializedError,
@@ -66,6 +67,9 @@ class Database:
 	async def after_initialize():
 		if not Database.INITIALIZED:
 			raise DatabaseNotInitializedError()
+		if ServerConfig.MULTI_NODE or ServerConfig.ROLE != ServerRole.all:
+			# ? Other nodes are alive, sessions of crashed ones are cleaned by heartbeats
+			return
 		async with Database.session_maker() as session:
 			try:
 				await UserRepository.reset_sids(session)
@@ -0,0 +1,51 @@
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+
+def _start_read_only_transaction(session, transaction, connection):
+	connection.exec_driver_sql('SET TRANSACTION READ ONLY')
+
+
+class LazySession:
+	# ? Proxy for AsyncSession, the real session is created on first use only
+	def __init__(self, session_maker: async_sessionmaker, read_only: bool = False):
+		self._session_maker = session_maker
+		self._read_only = read_only
+		self._session: AsyncSession | None = None
+
+	@property
+	def is_opened(self) -> bool:
+		return self._session is not None
+
+	@property
+	def read_only(self) -> bool:
+		return self._read_only
+
+	def _get_session(self) -> AsyncSession:
+		if self._session is None:
+			self._session = self._session_maker()
+			if self._read_only:
+				event.listen(
+					self._session.sync_session,
+					'after_begin',
+					_start_read_only_transaction,
+				)
+		return self._session
+
+	def __getattr__(self, name):
+		return getattr(self._get_session(), name)
+
+	async def release(self, commit: bool = True):
+		# ? Ends the transaction and gives the connection back to the pool.
+		# ? The proxy stays usable, the next call opens a new session
+		if self._session is None:
+			return
+		session = self._session
+		self._session = None
+		try:
+			if commit and not self._read_only:
+				await session.commit()
+			else:
+				await session.rollback()
+		finally:
+			await session.close()
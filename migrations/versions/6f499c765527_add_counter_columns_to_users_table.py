@@ -0,0 +1,39 @@
+"""add counter columns to users table
+
+Revision ID: 6f499c765527
+Revises: 1e6463f1b45c
+Create Date: 2026-10-17 12:04:18.512703
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6f499c765527'
+down_revision: Union[str, None] = '1e6463f1b45c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('users', sa.Column('following_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('followers_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('posts_count', sa.Integer(), server_default='0', nullable=False))
+    # * Backfill
+    op.execute(
+        'UPDATE users SET '
+        'following_count = (SELECT COUNT(*) FROM user_subscriptions WHERE user_subscriptions.follower_id = users.id), '
+        'followers_count = (SELECT COUNT(*) FROM user_subscriptions WHERE user_subscriptions.following_id = users.id), '
+        'posts_count = (SELECT COUNT(*) FROM posts WHERE posts.author_id = users.id AND posts.deleted_at IS NULL)'
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('users', 'posts_count')
+    op.drop_column('users', 'followers_count')
+    op.drop_column('users', 'following_count')
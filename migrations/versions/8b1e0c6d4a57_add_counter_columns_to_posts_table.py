@@ -0,0 +1,36 @@
+"""add counter columns to posts table
+
+Revision ID: 8b1e0c6d4a57
+Revises: 5d2f7a8c1e94
+Create Date: 2026-10-17 15:48:12.204571
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b1e0c6d4a57'
+down_revision: Union[str, None] = '5d2f7a8c1e94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('posts', sa.Column('likes_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('posts', sa.Column('comments_count', sa.Integer(), server_default='0', nullable=False))
+    # * Backfill
+    op.execute(
+        'UPDATE posts SET '
+        'likes_count = (SELECT COUNT(*) FROM post_likes WHERE post_likes.post_id = posts.id), '
+        'comments_count = (SELECT COUNT(*) FROM comments WHERE comments.post_id = posts.id)'
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('posts', 'comments_count')
+    op.drop_column('posts', 'likes_count')
@@ -0,0 +1,37 @@
+"""add fulltext index to users table
+
+Revision ID: a3c9e41d7b20
+Revises: 6f499c765527
+Create Date: 2026-10-17 14:21:07.118304
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3c9e41d7b20'
+down_revision: Union[str, None] = '6f499c765527'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # * Short ngram tokens ("an", "it"...) must not be dropped as stopwords
+    op.execute('SET SESSION innodb_ft_enable_stopword = OFF')
+    op.create_index(
+        'ix_users_username_fullname_fulltext',
+        'users',
+        ['username', 'fullname'],
+        unique=False,
+        mysql_prefix='FULLTEXT',
+        mysql_with_parser='ngram',
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_users_username_fullname_fulltext', table_name='users')
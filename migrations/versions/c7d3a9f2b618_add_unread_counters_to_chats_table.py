@@ -0,0 +1,38 @@
+"""add unread counters to chats table
+
+Revision ID: c7d3a9f2b618
+Revises: 8b1e0c6d4a57
+Create Date: 2026-10-17 16:35:51.903227
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7d3a9f2b618'
+down_revision: Union[str, None] = '8b1e0c6d4a57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('chats', sa.Column('user1_unread_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('chats', sa.Column('user2_unread_count', sa.Integer(), server_default='0', nullable=False))
+    # * Backfill
+    op.execute(
+        'UPDATE chats SET '
+        'user1_unread_count = (SELECT COUNT(*) FROM messages WHERE messages.chat_id = chats.id '
+        'AND messages.recipient_id = chats.user1_id AND messages.readed = 0 AND messages.deleted_at IS NULL), '
+        'user2_unread_count = (SELECT COUNT(*) FROM messages WHERE messages.chat_id = chats.id '
+        'AND messages.recipient_id = chats.user2_id AND messages.readed = 0 AND messages.deleted_at IS NULL)'
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('chats', 'user2_unread_count')
+    op.drop_column('chats', 'user1_unread_count')
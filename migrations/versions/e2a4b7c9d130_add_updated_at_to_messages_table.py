@@ -0,0 +1,34 @@
+"""add updated_at to messages table
+
+Revision ID: e2a4b7c9d130
+Revises: c7d3a9f2b618
+Create Date: 2026-10-17 17:20:36.551862
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2a4b7c9d130'
+down_revision: Union[str, None] = 'c7d3a9f2b618'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('messages', sa.Column('updated_at', mysql.DATETIME(fsp=6), nullable=True))
+    # * Backfill
+    op.execute('UPDATE messages SET updated_at = COALESCE(deleted_at, created_at)')
+    op.alter_column('messages', 'updated_at', existing_type=mysql.DATETIME(fsp=6), nullable=False)
+    op.create_index('ix_messages_chat_id_updated_at_id', 'messages', ['chat_id', 'updated_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_chat_id_updated_at_id', table_name='messages')
+    op.drop_column('messages', 'updated_at')
@@ -7,17 +7,20 @@ from sqlalchemy import (
     DateTime,
     ForeignKey,
     Index,
+    Integer,
     UniqueConstraint,
 )
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
-from models.base import BaseModel
+from models.base import BaseModel, protected_from_json_fields
+from models.presence import Presence
 
 if TYPE_CHECKING:
     from models.message import Message
     from models.user import User
 
 
+@protected_from_json_fields("user1_unread_count", "user2_unread_count")
 class Chat(BaseModel):
     __tablename__ = "chats"
     __table_args__ = (
@@ -55,6 +58,13 @@ class Chat(BaseModel):
         DateTime(timezone=True),
         nullable=True,
     )
+    # * Denormalized unread counters (messages to userN not read yet), maintained by MessagesRepository
+    user1_unread_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
+    user2_unread_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
 
     # * Relationships
     user1: Mapped["User"] = relationship("User", foreign_keys=[user1_id])
@@ -79,6 +89,13 @@ class Chat(BaseModel):
     def is_self_chat(self) -> bool:
         return self.user1_id == self.user2_id
 
+    def unread_count_for(self, reader_id: str) -> int:
+        if reader_id == self.user1_id:
+            return self.user1_unread_count
+        if reader_id == self.user2_id:
+            return self.user2_unread_count
+        return 0
+
     @staticmethod
     def new(user1_id: str, user2_id: str):
         return Chat(
@@ -89,9 +106,12 @@ class Chat(BaseModel):
     def to_json(
         self,
         detect_rels_for_user_id: str | None = None,
-        unread_count: int = 0
+        unread_count: int | None = None,
+        presences: dict[str, Presence] | None = None,
     ):
         json_view = super().to_json(False, False)
+        if unread_count is None:
+            unread_count = self.unread_count_for(detect_rels_for_user_id)
         json_view['unread_count'] = unread_count
 
         #% last message
@@ -106,11 +126,13 @@ class Chat(BaseModel):
             json_view['opponent'] = self.user2.to_json(
                 short=True,
                 detect_rels_for_user_id=detect_rels_for_user_id,
+                presences=presences,
             )
         elif self.user2_id == detect_rels_for_user_id:
             json_view['opponent'] = self.user1.to_json(
                 short=True,
                 detect_rels_for_user_id=detect_rels_for_user_id,
+                presences=presences,
             )
 
         return json_view
@@ -11,6 +11,7 @@ from sqlalchemy import (
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from models.base import BaseModel
+from models.presence import Presence
 
 if TYPE_CHECKING:
     from models.post import Post
@@ -77,16 +78,24 @@ class Comment(BaseModel):
     def __repr__(self):
         return f"<Comment>({self.id}, {self.created_at})"
 
-    def to_json(self, include_reply=False, detect_rels_for_user_id: str | None = None):
+    def to_json(
+        self,
+        include_reply=False,
+        detect_rels_for_user_id: str | None = None,
+        presences: dict[str, Presence] | None = None,
+    ):
         json_view = super().to_json(safe=False, short=False)
         json_view["author"] = self.author.to_json(
-            short=True, detect_rels_for_user_id=detect_rels_for_user_id
+            short=True,
+            detect_rels_for_user_id=detect_rels_for_user_id,
+            presences=presences,
         )
         if include_reply:
             json_view["reply_to"] = None
             if self.reply_to is not None:
                 json_view["reply_to"] = self.reply_to.to_json(
-                    detect_rels_for_user_id=detect_rels_for_user_id
+                    detect_rels_for_user_id=detect_rels_for_user_id,
+                    presences=presences,
                 )
         if detect_rels_for_user_id:
             json_view["is_our"] = detect_rels_for_user_id == self.author_id
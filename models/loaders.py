@@ -1,7 +1,6 @@
-from sqlalchemy.orm import load_only, selectinload
+from sqlalchemy.orm import lazyload, load_only, selectinload
 
 from models.chat import Chat
-from models.comment import Comment
 from models.message import Message
 from models.post import Post
 from models.user import User
@@ -17,14 +16,26 @@ load_short_user_option = load_only(
     User.last_seen,
 )
 
+# ? Without follow graph (relations are resolved by UserRepository.get_relations)
+load_user_without_graph_options: list = [
+    lazyload(User.following),
+    lazyload(User.followers),
+    lazyload(User.liked_posts),
+]
+
+load_short_user_only_options: list = [
+    load_short_user_option,
+    *load_user_without_graph_options,
+]
+
 load_full_post_options: list = [
     selectinload(Post.author).options(
         load_short_user_option,
         selectinload(User.followers).load_only(User.id),
         selectinload(User.following).load_only(User.id),
     ),
-    selectinload(Post.comments).load_only(Comment.id),
-    selectinload(Post.liked_by).load_only(User.id),
+    lazyload(Post.comments),
+    lazyload(Post.liked_by),
 ]
 
 load_full_message_options: list = [
@@ -34,6 +45,25 @@ load_full_message_options: list = [
     selectinload(Message.forwarded_from_user).options(load_short_user_option),
 ]
 
+# ? Attached post as a card only, see Message.to_compact_json
+load_compact_message_options: list = [
+    selectinload(Message.attached_post).options(
+        load_only(
+            Post.id,
+            Post.author_id,
+            Post.images_count,
+            Post.likes_count,
+            Post.comments_count,
+            Post.created_at,
+            Post.deleted_at,
+        ),
+        selectinload(Post.author).options(*load_short_user_only_options),
+        lazyload(Post.comments),
+        lazyload(Post.liked_by),
+    ),
+    selectinload(Message.forwarded_from_user).options(*load_short_user_only_options),
+]
+
 load_chat_options: list = [
     selectinload(Chat.user1).options(
         load_short_user_option,
@@ -0,0 +1,61 @@
+from datetime import datetime
+
+
+class MediaVariant:
+    # ? One stored object of a media (image size or a single file)
+    def __init__(
+        self,
+        object_key: str,
+        byte_size: int,
+        etag: str | None = None,
+        content_type: str | None = None,
+        last_modified: datetime | None = None,
+    ):
+        self.object_key = object_key
+        self.byte_size = byte_size
+        self.etag = etag.strip('"') if etag else None
+        self.content_type = content_type or "application/octet-stream"
+        self.last_modified = last_modified
+
+    @property
+    def media_id(self) -> str:
+        # % posts/messages: {id}/{index}, avatars: {id}
+        return self.object_key.rsplit("/", 1)[0]
+
+    @property
+    def name(self) -> str:
+        # % 256 | 512 | 1024 | original
+        return self.object_key.rsplit("/", 1)[-1].split(".", 1)[0]
+
+    @property
+    def extension(self) -> str:
+        file_name = self.object_key.rsplit("/", 1)[-1]
+        return f".{file_name.split('.', 1)[1]}" if "." in file_name else ""
+
+    def __repr__(self):
+        return f"<MediaVariant>({self.object_key}, {self.byte_size} bytes)"
+
+    def to_json(self) -> dict:
+        return {
+            "object_key": self.object_key,
+            "extension": self.extension,
+            "byte_size": self.byte_size,
+            "etag": self.etag,
+            "content_type": self.content_type,
+            "last_modified": self.last_modified.isoformat()
+            if self.last_modified is not None
+            else None,
+        }
+
+    @staticmethod
+    def from_json(json_variant: dict) -> "MediaVariant":
+        last_modified = json_variant.get("last_modified")
+        return MediaVariant(
+            object_key=json_variant.get("object_key"),
+            byte_size=int(json_variant.get("byte_size")),
+            etag=json_variant.get("etag"),
+            content_type=json_variant.get("content_type"),
+            last_modified=datetime.fromisoformat(last_modified)
+            if last_modified
+            else None,
+        )
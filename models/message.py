@@ -14,6 +14,7 @@ from sqlalchemy import (
 from sqlalchemy import (
     Enum as SqlAlchemyEnum,
 )
+from sqlalchemy.dialects.mysql import DATETIME
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from models.base import BaseModel, short_fields
@@ -41,6 +42,7 @@ class Message(BaseModel):
     __table_args__ = (
         Index("ix_messages_chat_id", "chat_id"),
         Index("ix_messages_chat_id_created_at", "chat_id", "created_at"),
+        Index("ix_messages_chat_id_updated_at_id", "chat_id", "updated_at", "id"),
         Index("ix_messages_sender_id", "sender_id"),
         Index("ix_messages_recipient_id", "recipient_id"),
         Index("ix_messages_created_at", "created_at"),
@@ -75,6 +77,13 @@ class Message(BaseModel):
     deleted_at: Mapped[datetime | None] = mapped_column(
         DateTime(timezone=True), nullable=True
     )
+    # * Any change (read, delete), used for sync after reconnect. Microseconds to keep changes ordered
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True).with_variant(DATETIME(fsp=6), "mysql"),
+        nullable=False,
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
 
     attached_images_count: Mapped[int | None] = mapped_column(Integer, nullable=True)
     forwarded_from_user_id: Mapped[str | None] = mapped_column(
@@ -175,6 +184,7 @@ class Message(BaseModel):
         self,
         short=False,
         detect_rels_for_user_id: str | None = None,
+        liked_post_ids: set[str] | None = None,
     ):
         json_view = super().to_json(safe=False, short=short)
         if detect_rels_for_user_id:
@@ -196,6 +206,7 @@ class Message(BaseModel):
             json_view["attached_post"] = self.attached_post.to_json(
                 short=short,
                 detect_rels_for_user_id=detect_rels_for_user_id,
+                liked_post_ids=liked_post_ids,
             )
 
         # % forwaded message
@@ -207,3 +218,17 @@ class Message(BaseModel):
                     short=True,
                 )
         return json_view
+
+    def to_compact_json(self, detect_rels_for_user_id: str | None = None):
+        # ? Without user pair (chat already knows it) and with a post card instead of a full post
+        json_view = super().to_json(safe=False, short=False)
+        if detect_rels_for_user_id:
+            json_view["is_our"] = self.sender_id == detect_rels_for_user_id
+        if self.attached_post_id:
+            json_view["attached_post"] = self.attached_post.to_card_json()
+        json_view["is_forwarded"] = self.is_forwarded
+        if self.forwarded_from_user_id:
+            json_view["forwarded_from_user"] = self.forwarded_from_user.to_json(
+                short=True
+            )
+        return json_view
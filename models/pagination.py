@@ -1,3 +1,6 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
 from aiohttp.web import Request
 
 from models.exceptions.api_exceptions import BadRequestError
@@ -28,3 +31,47 @@ class Pagination:
 
     def __str__(self):
         return f"<Pagination>(offset: {self.offset}, limit: {self.limit})"
+
+
+class CursorPagination:
+    # ? Keyset pagination, the cursor is an opaque base64 JSON for clients
+    def __init__(self, cursor: dict | None, limit: int):
+        self.cursor = cursor
+        self.limit = limit
+
+    @staticmethod
+    def is_requested(request: Request, param: str = "cursor") -> bool:
+        return param in request.query
+
+    @staticmethod
+    def from_request(request: Request, param: str = "cursor"):
+        try:
+            limit = int(request.query.get("limit", 10))
+        except Exception as _:
+            raise BadRequestError("Invalid pagination data")
+        if limit < 0:
+            raise BadRequestError("Invalid pagination data")
+        raw_cursor = request.query.get(param, "")
+        cursor = CursorPagination.decode(raw_cursor) if raw_cursor else None
+        return CursorPagination(cursor=cursor, limit=limit)
+
+    @staticmethod
+    def encode(cursor: dict | None) -> str | None:
+        if cursor is None:
+            return None
+        raw = json.dumps(cursor, separators=(",", ":")).encode()
+        return urlsafe_b64encode(raw).decode().rstrip("=")
+
+    @staticmethod
+    def decode(raw_cursor: str) -> dict:
+        try:
+            padding = "=" * (-len(raw_cursor) % 4)
+            cursor = json.loads(urlsafe_b64decode(raw_cursor + padding))
+        except Exception as _:
+            raise BadRequestError("Invalid cursor")
+        if not isinstance(cursor, dict):
+            raise BadRequestError("Invalid cursor")
+        return cursor
+
+    def __str__(self):
+        return f"<CursorPagination>(cursor: {self.cursor}, limit: {self.limit})"
@@ -6,6 +6,7 @@ from sqlalchemy import (
     CHAR,
     DateTime,
     ForeignKey,
+    Index,
     Integer,
     String,
     inspect,
@@ -13,6 +14,8 @@ from sqlalchemy import (
 from sqlalchemy.orm import Mapped, backref, mapped_column, relationship
 
 from models.base import BaseModel, short_fields
+from models.presence import Presence
+from utils.serialize_util import serialize_value
 
 if TYPE_CHECKING:
     from models.comment import Comment
@@ -22,6 +25,11 @@ if TYPE_CHECKING:
 @short_fields("id", "created_at", "deleted_at", "images_count")
 class Post(BaseModel):
     __tablename__ = "posts"
+    __table_args__ = (
+        # * Keyset pagination of the feed: (created_at, id) DESC
+        Index("ix_posts_created_at_id", "created_at", "id"),
+        Index("ix_posts_author_id_created_at_id", "author_id", "created_at", "id"),
+    )
 
     id: Mapped[CHAR] = mapped_column(
         CHAR(36),
@@ -43,6 +51,13 @@ class Post(BaseModel):
     deleted_at: Mapped[datetime | None] = mapped_column(
         DateTime(timezone=True), nullable=True
     )
+    # * Denormalized counters, maintained by PostRepository and CommentsRepository
+    likes_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
+    comments_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
 
     author: Mapped["User"] = relationship(
         "User",
@@ -60,8 +75,8 @@ class Post(BaseModel):
     liked_by = relationship(
         "User",
         secondary="post_likes",
-        backref=backref("liked_posts", lazy="selectin"),
-        lazy="selectin",
+        backref=backref("liked_posts", lazy="select"),
+        lazy="select",
         cascade="all, delete",
         passive_deletes=True,
     )
@@ -85,23 +100,49 @@ class Post(BaseModel):
     def is_deleted(self) -> bool:
         return self.deleted_at is not None
 
-    def to_json(self, detect_rels_for_user_id: str | None = None, short: bool = False):
+    @property
+    def first_image_key(self) -> str | None:
+        # ? Key for media WITH_FOLDER path: posts/{post_id}/{index}
+        if not self.images_count:
+            return None
+        return f"{self.id}/0"
+
+    def to_card_json(self):
+        return {
+            "id": self.id,
+            "author": self.author.to_json(short=True),
+            "first_image_key": self.first_image_key,
+            "likes_count": self.likes_count,
+            "comments_count": self.comments_count,
+            "created_at": serialize_value(self.created_at),
+            "deleted_at": serialize_value(self.deleted_at),
+        }
+
+    def to_json(
+        self,
+        detect_rels_for_user_id: str | None = None,
+        short: bool = False,
+        liked_post_ids: set[str] | None = None,
+        presences: dict[str, Presence] | None = None,
+    ):
         json_view = super().to_json(safe=False, short=short)
         if short:
             return json_view
         json_view["author"] = self.author.to_json(
-            short=True, detect_rels_for_user_id=detect_rels_for_user_id
+            short=True,
+            detect_rels_for_user_id=detect_rels_for_user_id,
+            presences=presences,
         )
 
-        liked_ids = tuple(map(lambda user: user.id, self.liked_by))
-        json_view["likes_count"] = len(liked_ids)
-
-        insp = inspect(self)
-        comments = insp.attrs.comments.loaded_value
-        if isinstance(comments, list):
-            json_view["comments_count"] = len(comments)
         if detect_rels_for_user_id:
-            json_view["is_liked"] = detect_rels_for_user_id in liked_ids
+            if liked_post_ids is not None:
+                json_view["is_liked"] = self.id in liked_post_ids
+            else:
+                liked_by = inspect(self).attrs.liked_by.loaded_value
+                if isinstance(liked_by, list):
+                    json_view["is_liked"] = any(
+                        user.id == detect_rels_for_user_id for user in liked_by
+                    )
             json_view["is_our"] = detect_rels_for_user_id == self.author_id
 
         return json_view
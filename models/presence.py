@@ -0,0 +1,24 @@
+from datetime import datetime
+
+from utils.serialize_util import serialize_value
+
+
+class Presence:
+    def __init__(
+        self,
+        user_id: str,
+        is_online: bool = False,
+        last_seen: datetime | None = None,
+    ):
+        self.user_id = user_id
+        self.is_online = is_online
+        self.last_seen = last_seen
+
+    def __repr__(self):
+        return f"<Presence>({self.user_id}, online: {self.is_online}, last_seen: {self.last_seen})"
+
+    def to_json(self) -> dict:
+        return {
+            "is_online": self.is_online,
+            "last_seen": serialize_value(self.last_seen),
+        }
@@ -10,3 +10,7 @@ class SioRooms:
     @staticmethod
     def get_post_room(post_id: str) -> str:
         return f"post_room_{post_id}"
+
+    @staticmethod
+    def get_presence_room(user_id: str) -> str:
+        return f"presence_room_{user_id}"
@@ -8,6 +8,8 @@ from sqlalchemy import (
     CHAR,
     DATE,
     DateTime,
+    Index,
+    Integer,
     String,
     inspect,
 )
@@ -30,7 +32,9 @@ from models.base import (
     short_fields,
 )
 from models.gender import Gender
+from models.presence import Presence
 from models.role import Role
+from models.user_relations import UserRelations
 from models.user_subscriptions import user_subscriptions
 
 if TYPE_CHECKING:
@@ -67,6 +71,16 @@ if TYPE_CHECKING:
 )
 class User(BaseModel):
     __tablename__ = "users"
+    __table_args__ = (
+        # * Substring search over username and fullname (see UserSearchRepository)
+        Index(
+            "ix_users_username_fullname_fulltext",
+            "username",
+            "fullname",
+            mysql_prefix="FULLTEXT",
+            mysql_with_parser="ngram",
+        ),
+    )
 
     id: Mapped[str] = mapped_column(
         CHAR(36),
@@ -100,6 +114,16 @@ class User(BaseModel):
     deleted_at: Mapped[datetime | None] = mapped_column(
         DateTime(timezone=True), nullable=True
     )
+    # * Denormalized counters, maintained by UserRepository and PostRepository
+    following_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
+    followers_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
+    posts_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
 
     following = relationship(
         "User",
@@ -157,12 +181,26 @@ class User(BaseModel):
         return self.deleted_at is not None
 
     def to_json(
-        self, safe=False, short=False, detect_rels_for_user_id: str | None = None
+        self,
+        safe=False,
+        short=False,
+        detect_rels_for_user_id: str | None = None,
+        relations: UserRelations | None = None,
+        presences: dict[str, Presence] | None = None,
     ):
         json_view = super().to_json(safe, short)
+        presence = presences.get(self.id) if presences and not self.deleted_at else None
+        if presence is not None:
+            # ? Live state from redis, MySQL values may be behind by PRESENCE_FLUSH_SECONDS
+            json_view.update(presence.to_json())
         if detect_rels_for_user_id:
             json_view["its_me"] = self.id == detect_rels_for_user_id
 
+            if relations is not None:
+                json_view["is_followed_by"] = relations.is_followed_by(self.id)
+                json_view["is_following"] = relations.is_following(self.id)
+                return json_view
+
             insp = inspect(self)
             if "following" not in insp.unloaded:
                 following_ids = map(lambda u: u.id, self.following)
@@ -171,10 +209,4 @@ class User(BaseModel):
             if "followers" not in insp.unloaded:
                 followers_ids = map(lambda u: u.id, self.followers)
                 json_view["is_following"] = detect_rels_for_user_id in followers_ids
-
-        if not short:
-            json_view["following_count"] = len(self.following)
-            json_view["followers_count"] = len(self.followers)
-            posts = tuple(filter(lambda p: not p.is_deleted, self.posts))
-            json_view["posts_count"] = len(posts)
         return json_view
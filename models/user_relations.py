@@ -0,0 +1,19 @@
+class UserRelations:
+    def __init__(
+        self,
+        viewer_id: str,
+        following_ids: set[str] | None = None,
+        followed_by_ids: set[str] | None = None,
+    ):
+        self.viewer_id = viewer_id
+        self.following_ids = following_ids or set()  # ? viewer follows them
+        self.followed_by_ids = followed_by_ids or set()  # ? they follow the viewer
+
+    def is_following(self, user_id: str) -> bool:
+        return user_id in self.following_ids
+
+    def is_followed_by(self, user_id: str) -> bool:
+        return user_id in self.followed_by_ids
+
+    def __repr__(self):
+        return f"<UserRelations>({self.viewer_id}, following: {len(self.following_ids)}, followed by: {len(self.followed_by_ids)})"
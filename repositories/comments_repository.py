@@ -11,6 +11,7 @@ from models.loaders import load_short_user_option
 from models.pagination import Pagination
 from models.post import Post
 from models.user import User
+from repositories.post_repository import PostRepository
 
 
 class CommentsRepository:
@@ -72,6 +73,9 @@ class CommentsRepository:
         session.add(new_comment)
         try:
             await session.flush()
+            await PostRepository.shift_counters(
+                session, new_comment.post_id, comments_count=1
+            )
             return new_comment
         except Exception as error:
             await session.rollback()
@@ -82,5 +86,7 @@ class CommentsRepository:
         target_comment = await session.get(Comment, target_comment_id)
         if not target_comment:
             raise CommentNotFoundError(target_comment_id)
+        post_id = target_comment.post_id
         await session.delete(target_comment)
         await session.flush()
+        await PostRepository.shift_counters(session, post_id, comments_count=-1)
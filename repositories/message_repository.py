@@ -1,19 +1,27 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
-from sqlalchemy import and_, func, or_, select
+from sqlalchemy import and_, case, func, or_, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from models import (
     Chat,
     Pagination,
     load_chat_options,
+    load_compact_message_options,
     load_full_message_options,
 )
-from models.exceptions.api_exceptions import ChatNotFoundError, MessageNotFoundError
+from models.exceptions.api_exceptions import (
+    BadRequestError,
+    ChatNotFoundError,
+    ForbiddenToReadMessageError,
+    MessageNotFoundError,
+)
 from models.message import Message
 
 
 class MessagesRepository:
+    CHANGES_SAFETY_WINDOW = timedelta(seconds=10)  # ? > the longest commit delay
+
     @staticmethod
     async def get_message_by_id(
         session: AsyncSession, message_id: str, include_deleted: bool = False
@@ -90,25 +98,131 @@ class MessagesRepository:
         return result.all()
 
     @staticmethod
-    async def get_unread_count(
-        session: AsyncSession,
-        chat_id: str,
-        messages_owner_id: str,
-    ):
-        query = (
-            select(func.count())
-            .select_from(Message)
-            .where(
-                and_(
-                    Message.chat_id == chat_id,
-                    Message.sender_id == messages_owner_id,
+    async def get_total_unread_count(session: AsyncSession, user_id: str) -> int:
+        query = select(
+            func.coalesce(
+                func.sum(
+                    case(
+                        (Chat.user1_id == user_id, Chat.user1_unread_count),
+                        else_=Chat.user2_unread_count,
+                    )
+                ),
+                0,
+            )
+        ).where(
+            or_(Chat.user1_id == user_id, Chat.user2_id == user_id),
+            Chat.last_message_id.is_not(None),
+        )
+        return int(await session.scalar(query))
+
+    @staticmethod
+    async def shift_unread_count(
+        session: AsyncSession, chat_id: str, reader_id: str, delta: int
+    ) -> None:
+        def shifted(counter):
+            return case((counter + delta < 0, 0), else_=counter + delta)
+
+        # ? In a self chat (user1 == user2) only user1 counter is used
+        await session.execute(
+            update(Chat)
+            .where(Chat.id == chat_id)
+            .values(
+                user1_unread_count=case(
+                    (Chat.user1_id == reader_id, shifted(Chat.user1_unread_count)),
+                    else_=Chat.user1_unread_count,
+                ),
+                user2_unread_count=case(
+                    (
+                        and_(Chat.user2_id == reader_id, Chat.user1_id != reader_id),
+                        shifted(Chat.user2_unread_count),
+                    ),
+                    else_=Chat.user2_unread_count,
+                ),
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+    @staticmethod
+    async def recalculate_unread_counters(
+        session: AsyncSession, after_id: str | None = None, limit: int = 1000
+    ) -> list[str]:
+        ids_query = select(Chat.id).order_by(Chat.id).limit(limit)
+        if after_id is not None:
+            ids_query = ids_query.where(Chat.id > after_id)
+        ids = list((await session.scalars(ids_query)).all())
+        if not ids:
+            return ids
+
+        def unread_count(reader_id_column):
+            return (
+                select(func.count())
+                .select_from(Message)
+                .where(
+                    Message.chat_id == Chat.id,
+                    Message.recipient_id == reader_id_column,
                     Message.readed.is_(False),
                     Message.deleted_at.is_(None),
                 )
+                .scalar_subquery()
             )
+
+        await session.execute(
+            update(Chat)
+            .values(
+                user1_unread_count=unread_count(Chat.user1_id),
+                user2_unread_count=unread_count(Chat.user2_id),
+            )
+            .where(Chat.id.in_(ids))
+            .execution_options(synchronize_session=False)
+        )
+        await session.flush()
+        return ids
+
+    @staticmethod
+    def _chat_id_subquery(uid1: str, uid2: str):
+        user1_id, user2_id = sorted([uid1, uid2])
+        return (
+            select(Chat.id)
+            .where(Chat.user1_id == user1_id, Chat.user2_id == user2_id)
+            .scalar_subquery()
         )
-        result = await session.execute(query)
-        return result.scalar_one()
+
+    @staticmethod
+    def _parse_cursor(cursor: dict, time_key: str) -> tuple[datetime, str]:
+        try:
+            return datetime.fromisoformat(cursor[time_key]), str(cursor["id"])
+        except Exception as _:
+            raise BadRequestError("Invalid cursor")
+
+    @staticmethod
+    def _message_options(compact: bool) -> list:
+        if compact:
+            return load_compact_message_options
+        return load_full_message_options
+
+    @staticmethod
+    def created_cursor(message: Message) -> dict:
+        return {"created_at": message.created_at.isoformat(), "id": message.id}
+
+    @staticmethod
+    def updated_cursor(message: Message) -> dict:
+        return {"updated_at": message.updated_at.isoformat(), "id": message.id}
+
+    @staticmethod
+    def settled_cursor(cursor: dict | None) -> dict | None:
+        # ? updated_at comes from the app clock before commit, so a late commit
+        # ? may land behind a cursor already handed out. A caught-up cursor never
+        # ? goes past now - CHANGES_SAFETY_WINDOW: the last seconds are read again
+        # ? by the next sync (clients upsert by id, read/delete ids are idempotent)
+        if cursor is None:
+            return None
+        updated_at = datetime.fromisoformat(cursor["updated_at"])
+        settled_at = datetime.now(timezone.utc) - MessagesRepository.CHANGES_SAFETY_WINDOW
+        if updated_at.tzinfo is None:
+            settled_at = settled_at.replace(tzinfo=None)
+        if updated_at <= settled_at:
+            return cursor
+        return {"updated_at": settled_at.isoformat(), "id": ""}
 
     @staticmethod
     async def get_messages(
@@ -116,30 +230,119 @@ class MessagesRepository:
         current_user_id: str,
         other_user_id: str,
         pagination=Pagination.default(),
+        compact: bool = False,
     ) -> list[Message]:
-        user1_id, user2_id = sorted([current_user_id, other_user_id])
-        chat_query = select(Chat).where(
-            and_(
-                Chat.user1_id == user1_id,
-                Chat.user2_id == user2_id,
-            )
-        )
-        chat_result = await session.scalar(chat_query)
-        if not chat_result:
-            return []
         messages_query = (
             select(Message)
             .where(
-                and_(Message.chat_id == chat_result.id, Message.deleted_at.is_(None))
+                Message.chat_id
+                == MessagesRepository._chat_id_subquery(current_user_id, other_user_id),
+                Message.deleted_at.is_(None),
             )
-            .options(*load_full_message_options)
-            .order_by(Message.created_at.desc())
+            .options(*MessagesRepository._message_options(compact))
+            .order_by(Message.created_at.desc(), Message.id.desc())
             .offset(pagination.offset)
             .limit(pagination.limit)
         )
         messages_result = await session.scalars(messages_query)
         return messages_result.all()
 
+    @staticmethod
+    async def get_messages_by_cursor(
+        session: AsyncSession,
+        current_user_id: str,
+        other_user_id: str,
+        before: dict | None = None,
+        after: dict | None = None,
+        limit: int = 10,
+        compact: bool = False,
+    ) -> list[Message]:
+        # ? Newest first in any case. Without cursors it is the latest page
+        query = (
+            select(Message)
+            .where(
+                Message.chat_id
+                == MessagesRepository._chat_id_subquery(current_user_id, other_user_id),
+                Message.deleted_at.is_(None),
+            )
+            .options(*MessagesRepository._message_options(compact))
+            .limit(limit)
+        )
+        if before is not None:
+            created_at, message_id = MessagesRepository._parse_cursor(before, "created_at")
+            query = query.where(
+                or_(
+                    Message.created_at < created_at,
+                    and_(Message.created_at == created_at, Message.id < message_id),
+                )
+            )
+        if after is not None:
+            created_at, message_id = MessagesRepository._parse_cursor(after, "created_at")
+            query = query.where(
+                or_(
+                    Message.created_at > created_at,
+                    and_(Message.created_at == created_at, Message.id > message_id),
+                )
+            )
+        if after is not None and before is None:
+            # % The oldest messages right after the cursor
+            query = query.order_by(Message.created_at.asc(), Message.id.asc())
+            return list(reversed((await session.scalars(query)).all()))
+        query = query.order_by(Message.created_at.desc(), Message.id.desc())
+        return (await session.scalars(query)).all()
+
+    @staticmethod
+    async def get_sync_cursor(
+        session: AsyncSession, current_user_id: str, other_user_id: str
+    ) -> dict | None:
+        last_changed = (
+            await session.execute(
+                select(Message.updated_at, Message.id)
+                .where(
+                    Message.chat_id
+                    == MessagesRepository._chat_id_subquery(current_user_id, other_user_id)
+                )
+                .order_by(Message.updated_at.desc(), Message.id.desc())
+                .limit(1)
+            )
+        ).first()
+        if not last_changed:
+            return None
+        return MessagesRepository.settled_cursor(
+            {"updated_at": last_changed.updated_at.isoformat(), "id": last_changed.id}
+        )
+
+    @staticmethod
+    async def get_changes(
+        session: AsyncSession,
+        current_user_id: str,
+        other_user_id: str,
+        since: dict | None,
+        limit: int = 100,
+        compact: bool = False,
+    ) -> list[Message]:
+        # ? Messages created, read or deleted after the cursor, in change order
+        query = (
+            select(Message)
+            .where(
+                Message.chat_id
+                == MessagesRepository._chat_id_subquery(current_user_id, other_user_id)
+            )
+            .options(*MessagesRepository._message_options(compact))
+            .execution_options(populate_existing=True)
+            .order_by(Message.updated_at.asc(), Message.id.asc())
+            .limit(limit)
+        )
+        if since is not None:
+            updated_at, message_id = MessagesRepository._parse_cursor(since, "updated_at")
+            query = query.where(
+                or_(
+                    Message.updated_at > updated_at,
+                    and_(Message.updated_at == updated_at, Message.id > message_id),
+                )
+            )
+        return (await session.scalars(query)).all()
+
     @staticmethod
     async def soft_delete_message(
         session: AsyncSession,
@@ -151,6 +354,7 @@ class MessagesRepository:
         )
         if not target_message:
             raise MessageNotFoundError(target_message_id)
+        was_unread = not target_message.readed
 
         target_message.text_content = ""
         target_message.attachment_type = None
@@ -185,6 +389,10 @@ class MessagesRepository:
 
         target_message.deleted_at = datetime.now(timezone.utc)
         await session.flush()
+        if was_unread:
+            await MessagesRepository.shift_unread_count(
+                session, chat.id, target_message.recipient_id, -1
+            )
         return target_message, previous_message
 
     @staticmethod
@@ -225,6 +433,9 @@ class MessagesRepository:
         chat.last_message_id = message.id
         chat.last_message_created_at = message.created_at
         await session.flush()
+        await MessagesRepository.shift_unread_count(
+            session, chat.id, message.recipient_id, 1
+        )
         return message
 
     @staticmethod
@@ -238,6 +449,56 @@ class MessagesRepository:
         )
         if not message:
             raise MessageNotFoundError(message_id)
+        if message.readed:
+            return message
         message.readed = True
         await session.flush()
+        await MessagesRepository.shift_unread_count(
+            session, message.chat_id, message.recipient_id, -1
+        )
         return message
+
+    @staticmethod
+    async def mark_read_until(
+        session: AsyncSession,
+        reader_id: str,
+        opponent_id: str,
+        until_message_id: str,
+    ) -> tuple[Message, int]:
+        until_message = await session.scalar(
+            select(Message).where(
+                Message.id == until_message_id, Message.deleted_at.is_(None)
+            )
+        )
+        if not until_message:
+            raise MessageNotFoundError(until_message_id)
+        if sorted((until_message.sender_id, until_message.recipient_id)) != sorted(
+            (reader_id, opponent_id)
+        ):
+            raise ForbiddenToReadMessageError()
+
+        # ? Everything up to the message (inclusive) in (created_at, id) order
+        result = await session.execute(
+            update(Message)
+            .where(
+                Message.chat_id == until_message.chat_id,
+                Message.recipient_id == reader_id,
+                Message.readed.is_(False),
+                Message.deleted_at.is_(None),
+                or_(
+                    Message.created_at < until_message.created_at,
+                    and_(
+                        Message.created_at == until_message.created_at,
+                        Message.id <= until_message.id,
+                    ),
+                ),
+            )
+            .values(readed=True)
+            .execution_options(synchronize_session=False)
+        )
+        read_count = result.rowcount
+        if read_count:
+            await MessagesRepository.shift_unread_count(
+                session, until_message.chat_id, reader_id, -read_count
+            )
+        return until_message, read_count
@@ -1,20 +1,21 @@
 from datetime import datetime, timezone
 
-from sqlalchemy import select
+from sqlalchemy import and_, delete, func, insert, literal, or_, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
 
 from models.comment import Comment
 from models.exceptions.api_exceptions import (
     AlreadyLikedError,
+    BadRequestError,
     DatabaseError,
     NotLikedAnywayError,
     PostNotFoundError,
     UserNotFoundError,
 )
-from models.loaders import load_short_user_option
+from models.loaders import load_full_post_options
 from models.pagination import Pagination
 from models.post import Post
+from models.post_likes import post_likes
 from models.user import User
 from repositories.user_repository import UserRepository
 
@@ -43,15 +44,7 @@ class PostRepository:
         query = (
             select(Post)
             .where(Post.id == post_id)
-            .options(
-                selectinload(Post.author).options(
-                    load_short_user_option,
-                    selectinload(User.followers).load_only(User.id),
-                    selectinload(User.following).load_only(User.id),
-                ),
-                selectinload(Post.comments).load_only(Comment.id),
-                selectinload(Post.liked_by).load_only(User.id),
-            )
+            .options(*load_full_post_options)
             .execution_options(populate_existing=True)
         )
         if not include_deleted:
@@ -60,28 +53,15 @@ class PostRepository:
         return post
 
     @staticmethod
-    async def get_all(
-        session: AsyncSession,
-        pagination=Pagination.default(),
+    def _feed_query(
         include_deleted: bool = False,
         include_deleted_user: bool = False,
         user_id: str | None = None,
-    ) -> list[Post]:
+    ):
         query = (
             select(Post)
-            .options(
-                selectinload(Post.author).options(
-                    load_short_user_option,
-                    selectinload(User.followers).load_only(User.id),
-                    selectinload(User.following).load_only(User.id),
-                ),
-                selectinload(Post.comments).load_only(Comment.id),
-                selectinload(Post.liked_by).load_only(User.id),
-            )
+            .options(*load_full_post_options)
             .execution_options(populate_existing=True)
-            .offset(pagination.offset)
-            .limit(pagination.limit)
-            .order_by(Post.created_at.desc())
         )
         if not include_deleted:
             query = query.where(Post.deleted_at.is_(None))
@@ -89,14 +69,76 @@ class PostRepository:
             query = query.join(Post.author).where(User.deleted_at.is_(None))
         if user_id:
             query = query.where(Post.author_id == user_id)
+        return query
+
+    @staticmethod
+    async def get_all(
+        session: AsyncSession,
+        pagination=Pagination.default(),
+        include_deleted: bool = False,
+        include_deleted_user: bool = False,
+        user_id: str | None = None,
+    ) -> list[Post]:
+        query = (
+            PostRepository._feed_query(
+                include_deleted=include_deleted,
+                include_deleted_user=include_deleted_user,
+                user_id=user_id,
+            )
+            .offset(pagination.offset)
+            .limit(pagination.limit)
+            .order_by(Post.created_at.desc(), Post.id.desc())
+        )
         result = await session.scalars(query)
         return result.all()
 
+    @staticmethod
+    async def get_all_by_cursor(
+        session: AsyncSession,
+        cursor: dict | None = None,
+        limit: int = 10,
+        include_deleted: bool = False,
+        include_deleted_user: bool = False,
+        user_id: str | None = None,
+    ) -> tuple[list[Post], dict | None]:
+        query = (
+            PostRepository._feed_query(
+                include_deleted=include_deleted,
+                include_deleted_user=include_deleted_user,
+                user_id=user_id,
+            )
+            .order_by(Post.created_at.desc(), Post.id.desc())
+            .limit(limit)
+        )
+        if cursor is not None:
+            try:
+                after_created_at = datetime.fromisoformat(cursor["created_at"])
+                after_id = str(cursor["id"])
+            except Exception as _:
+                raise BadRequestError("Invalid cursor")
+            query = query.where(
+                or_(
+                    Post.created_at < after_created_at,
+                    and_(Post.created_at == after_created_at, Post.id < after_id),
+                )
+            )
+        posts = (await session.scalars(query)).all()
+        next_cursor = None
+        if posts and len(posts) == limit:
+            next_cursor = {
+                "created_at": posts[-1].created_at.isoformat(),
+                "id": posts[-1].id,
+            }
+        return posts, next_cursor
+
     @staticmethod
     async def add(session: AsyncSession, new_post: Post) -> Post:
         session.add(new_post)
         try:
             await session.flush()
+            await UserRepository.shift_counters(
+                session, new_post.author_id, posts_count=1
+            )
             await session.refresh(new_post)
             return new_post
         except Exception as error:
@@ -114,48 +156,135 @@ class PostRepository:
         target_post.images_count = 0
         target_post.deleted_at = datetime.now(timezone.utc)
         await session.flush()
+        await UserRepository.shift_counters(
+            session, target_post.author_id, posts_count=-1
+        )
         return target_post
 
     @staticmethod
-    async def like(session: AsyncSession, target_post_id: str, user_id: str, logger):
-        target_post = await PostRepository.get_by_id_with_relations(
-            session=session, post_id=target_post_id
+    async def get_liked_post_ids(
+        session: AsyncSession, user_id: str, post_ids
+    ) -> set[str]:
+        post_ids = set(filter(None, post_ids))
+        if not post_ids:
+            return set()
+        result = await session.scalars(
+            select(post_likes.c.post_id).where(
+                post_likes.c.user_id == user_id,
+                post_likes.c.post_id.in_(post_ids),
+            )
         )
-        user = await UserRepository.get_by_id_with_relations(
-            session=session, user_id=user_id, include_deleted=True
+        return set(result.all())
+
+    @staticmethod
+    async def shift_counters(session: AsyncSession, post_id: str, **deltas: int) -> None:
+        await session.execute(
+            update(Post)
+            .where(Post.id == post_id)
+            .values(
+                {
+                    getattr(Post, counter): getattr(Post, counter) + delta
+                    for counter, delta in deltas.items()
+                }
+            )
+            .execution_options(synchronize_session=False)
         )
-        if not target_post:
+
+    @staticmethod
+    async def recalculate_counters(
+        session: AsyncSession, after_id: str | None = None, limit: int = 1000
+    ) -> list[str]:
+        ids_query = select(Post.id).order_by(Post.id).limit(limit)
+        if after_id is not None:
+            ids_query = ids_query.where(Post.id > after_id)
+        ids = list((await session.scalars(ids_query)).all())
+        if not ids:
+            return ids
+        likes_count = (
+            select(func.count())
+            .select_from(post_likes)
+            .where(post_likes.c.post_id == Post.id)
+            .scalar_subquery()
+        )
+        comments_count = (
+            select(func.count())
+            .select_from(Comment)
+            .where(Comment.post_id == Post.id)
+            .scalar_subquery()
+        )
+        await session.execute(
+            update(Post)
+            .values(likes_count=likes_count, comments_count=comments_count)
+            .where(Post.id.in_(ids))
+            .execution_options(synchronize_session=False)
+        )
+        await session.flush()
+        return ids
+
+    @staticmethod
+    async def _raise_like_conflict(
+        session: AsyncSession, target_post_id: str, user_id: str, error_class
+    ):
+        if not await PostRepository.get_by_id(session, target_post_id):
             raise PostNotFoundError(target_post_id)
-        if not user:
+        if not await UserRepository.get_by_id(
+            session=session, user_id=user_id, include_deleted=True
+        ):
             raise UserNotFoundError(user_id)
-        if user in target_post.liked_by:
-            raise AlreadyLikedError(user_id, target_post_id)
-        target_post.liked_by.append(user)
+        raise error_class(user_id, target_post_id)
+
+    @staticmethod
+    async def like(session: AsyncSession, target_post_id: str, user_id: str, logger):
+        # ? Idempotent insert, the affected rows count tells what happened
+        query = (
+            insert(post_likes)
+            .from_select(
+                ["user_id", "post_id"],
+                select(literal(user_id), Post.id).where(
+                    Post.id == target_post_id, Post.deleted_at.is_(None)
+                ),
+            )
+            .prefix_with("IGNORE", dialect="mysql")
+        )
         try:
-            await session.flush()
-            return target_post
+            inserted_count = (await session.execute(query)).rowcount
+            if inserted_count:
+                await PostRepository.shift_counters(
+                    session, target_post_id, likes_count=1
+                )
         except Exception as error:
             await session.rollback()
             raise DatabaseError(server_message=f"[Post | set_like] {error}")
+        if not inserted_count:
+            await PostRepository._raise_like_conflict(
+                session, target_post_id, user_id, AlreadyLikedError
+            )
+        return await PostRepository.get_by_id_with_relations(
+            session=session, post_id=target_post_id
+        )
 
     @staticmethod
     async def unlike(session: AsyncSession, target_post_id: str, user_id: str):
-        target_post = await PostRepository.get_by_id_with_relations(
-            session=session, post_id=target_post_id
+        not_deleted_post = select(Post.id).where(
+            Post.id == target_post_id, Post.deleted_at.is_(None)
         )
-        user = await UserRepository.get_by_id_with_relations(
-            session=session, user_id=user_id, include_deleted=True
+        query = delete(post_likes).where(
+            post_likes.c.user_id == user_id,
+            post_likes.c.post_id.in_(not_deleted_post),
         )
-        if not target_post:
-            raise PostNotFoundError(target_post_id)
-        if not user:
-            raise UserNotFoundError(user_id)
-        if user not in target_post.liked_by:
-            raise NotLikedAnywayError(user_id, target_post_id)
-        target_post.liked_by.remove(user)
         try:
-            await session.flush()
-            return target_post
+            deleted_count = (await session.execute(query)).rowcount
+            if deleted_count:
+                await PostRepository.shift_counters(
+                    session, target_post_id, likes_count=-1
+                )
         except Exception as error:
             await session.rollback()
             raise DatabaseError(server_message=f"[Post | unset_like] {error}")
+        if not deleted_count:
+            await PostRepository._raise_like_conflict(
+                session, target_post_id, user_id, NotLikedAnywayError
+            )
+        return await PostRepository.get_by_id_with_relations(
+            session=session, post_id=target_post_id
+        )
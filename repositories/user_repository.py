@@ -2,12 +2,13 @@ from datetime import date, datetime, timezone
 from secrets import token_hex
 
 import bcrypt
-from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy import and_, bindparam, case, delete, func, insert, literal, or_, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
 from config.server_config import ServerConfig
 from models.avatar_type import AvatarType
+from models.chat import Chat
 from models.exceptions.api_exceptions import (
     AlreadyFollowingError,
     BadRequestError,
@@ -20,10 +21,16 @@ from models.exceptions.api_exceptions import (
     UserWithEmailHasAlreadyCompletedRegistrationError,
 )
 from models.gender import Gender
+from models.loaders import (
+    load_short_user_only_options,
+    load_user_without_graph_options,
+)
 from models.pagination import Pagination
 from models.post import Post
+from models.presence import Presence
 from models.role import Role
 from models.user import User
+from models.user_relations import UserRelations
 from models.user_subscriptions import user_subscriptions
 
 
@@ -44,6 +51,15 @@ class UserRepository:
         result = await session.scalars(query)
         return result.first()
 
+    @staticmethod
+    async def get_registration_state(session: AsyncSession, user_id: str):
+        # % (is_registration_completed, email_address) or None, no relations loaded
+        query = select(User.is_registration_completed, User.email_address).where(
+            User.id == user_id,
+            User.deleted_at.is_(None),
+        )
+        return (await session.execute(query)).first()
+
     @staticmethod
     async def get_by_id_with_relations(
         session: AsyncSession, user_id: str, include_deleted: bool = False
@@ -54,7 +70,6 @@ class UserRepository:
             .options(
                 selectinload(User.following).load_only(User.id),
                 selectinload(User.followers).load_only(User.id),
-                selectinload(User.posts).load_only(Post.id, Post.deleted_at),
             )
         )
         if not include_deleted:
@@ -71,7 +86,6 @@ class UserRepository:
             .options(
                 selectinload(User.following).load_only(User.id),
                 selectinload(User.followers).load_only(User.id),
-                selectinload(User.posts).load_only(Post.id, Post.deleted_at),
             )
             .execution_options(populate_existing=True)
         )
@@ -90,7 +104,6 @@ class UserRepository:
             .options(
                 selectinload(User.following).load_only(User.id),
                 selectinload(User.followers).load_only(User.id),
-                selectinload(User.posts).load_only(Post.id, Post.deleted_at),
             )
             .execution_options(populate_existing=True)
         )
@@ -134,7 +147,6 @@ class UserRepository:
             .options(
                 selectinload(User.following).load_only(User.id),
                 selectinload(User.followers).load_only(User.id),
-                selectinload(User.posts).load_only(Post.id, Post.deleted_at),
             )
         )
         result = await session.scalars(query)
@@ -157,42 +169,7 @@ class UserRepository:
                     else True,
                 ),
             )
-            .options(
-                selectinload(User.following).load_only(User.id),
-                selectinload(User.followers).load_only(User.id),
-                selectinload(User.posts).load_only(Post.id, Post.deleted_at),
-            )
-            .offset(pagination.offset)
-            .limit(pagination.limit)
-        )
-        result = await session.scalars(query)
-        return result.all()
-
-    @staticmethod
-    async def find_by_pattern(
-        session: AsyncSession,
-        pattern: str,
-        pagination: Pagination = Pagination.default(),
-        ignore_id: str = "",
-    ) -> list[User]:
-        query = (
-            select(User)
-            .where(
-                and_(
-                    or_(
-                        User.username.ilike(f"%{pattern}%"),
-                        User.fullname.ilike(f"%{pattern}%"),
-                    ),
-                    User.id != ignore_id,
-                    User.is_registration_completed,
-                    User.deleted_at.is_(None),
-                ),
-            )
-            .options(
-                selectinload(User.following).load_only(User.id),
-                selectinload(User.followers).load_only(User.id),
-                selectinload(User.posts).load_only(Post.id, Post.deleted_at),
-            )
+            .options(*load_short_user_only_options)
             .offset(pagination.offset)
             .limit(pagination.limit)
         )
@@ -220,32 +197,69 @@ class UserRepository:
             await session.rollback()
             raise DatabaseError(server_message=f"[User | update_password] {error}")
 
+    @staticmethod
+    async def _get_without_graph(
+        session: AsyncSession, user_id: str, include_deleted: bool = False
+    ) -> User | None:
+        query = (
+            select(User)
+            .where(User.id == user_id)
+            .options(*load_user_without_graph_options)
+            .execution_options(populate_existing=True)
+        )
+        if not include_deleted:
+            query = query.where(User.deleted_at.is_(None))
+        return await session.scalar(query)
+
+    @staticmethod
+    async def _get_usernames(
+        session: AsyncSession, *user_ids: str, include_deleted: bool = False
+    ) -> dict[str, str]:
+        query = select(User.id, User.username).where(User.id.in_(user_ids))
+        if not include_deleted:
+            query = query.where(User.deleted_at.is_(None))
+        return dict((await session.execute(query)).all())
+
     @staticmethod
     async def follow(session: AsyncSession, subscriber_id: str, target_id: str) -> User:
         if subscriber_id == target_id:
             raise CantFollowUnlollowYouselfError()
-        subscriber = await UserRepository.get_by_id_with_relations(
-            session=session, user_id=subscriber_id
-        )
-        target = await UserRepository.get_by_id_with_relations(
-            session=session, user_id=target_id
-        )
-        if not subscriber:
-            raise UserNotFoundError(subscriber_id)
-        if not target:
-            raise UserNotFoundError(target_id)
-        if target in await subscriber.awaitable_attrs.following:
-            raise AlreadyFollowingError(
-                sub_username=subscriber.username,
-                target_username=target.username,
+        # ? Idempotent insert, the affected rows count tells what happened
+        query = (
+            insert(user_subscriptions)
+            .from_select(
+                ["follower_id", "following_id"],
+                select(literal(subscriber_id), User.id).where(
+                    User.id == target_id, User.deleted_at.is_(None)
+                ),
             )
-        subscriber.following.append(target)
+            .prefix_with("IGNORE", dialect="mysql")
+        )
         try:
-            await session.flush()
-            return target
+            inserted_count = (await session.execute(query)).rowcount
+            if inserted_count:
+                await UserRepository.shift_counters(
+                    session, subscriber_id, following_count=1
+                )
+                await UserRepository.shift_counters(
+                    session, target_id, followers_count=1
+                )
         except Exception as error:
             await session.rollback()
             raise DatabaseError(server_message=f"[User | follow] {error}")
+        if not inserted_count:
+            usernames = await UserRepository._get_usernames(
+                session, subscriber_id, target_id
+            )
+            if subscriber_id not in usernames:
+                raise UserNotFoundError(subscriber_id)
+            if target_id not in usernames:
+                raise UserNotFoundError(target_id)
+            raise AlreadyFollowingError(
+                sub_username=usernames[subscriber_id],
+                target_username=usernames[target_id],
+            )
+        return await UserRepository._get_without_graph(session, target_id)
 
     @staticmethod
     async def unfollow(
@@ -253,28 +267,37 @@ class UserRepository:
     ) -> User:
         if subscriber_id == target_id:
             raise CantFollowUnlollowYouselfError()
-        subscriber = await UserRepository.get_by_id_with_relations(
-            session=session, user_id=subscriber_id
-        )
-        target = await UserRepository.get_by_id_with_relations(
-            session=session, user_id=target_id, include_deleted=True
+        query = delete(user_subscriptions).where(
+            user_subscriptions.c.follower_id == subscriber_id,
+            user_subscriptions.c.following_id == target_id,
         )
-        if not subscriber:
-            raise UserNotFoundError(subscriber_id)
-        if not target:
-            raise UserNotFoundError(target_id)
-        if target not in await subscriber.awaitable_attrs.following:
-            raise NotFollowingAnywayError(
-                sub_username=subscriber.username,
-                target_username=target.username,
-            )
-        subscriber.following.remove(target)
         try:
-            await session.flush()
-            return target
+            deleted_count = (await session.execute(query)).rowcount
+            if deleted_count:
+                await UserRepository.shift_counters(
+                    session, subscriber_id, following_count=-1
+                )
+                await UserRepository.shift_counters(
+                    session, target_id, followers_count=-1
+                )
         except Exception as error:
             await session.rollback()
             raise DatabaseError(server_message=f"[User | unfollow] {error}")
+        if not deleted_count:
+            usernames = await UserRepository._get_usernames(
+                session, subscriber_id, target_id, include_deleted=True
+            )
+            if subscriber_id not in usernames:
+                raise UserNotFoundError(subscriber_id)
+            if target_id not in usernames:
+                raise UserNotFoundError(target_id)
+            raise NotFollowingAnywayError(
+                sub_username=usernames[subscriber_id],
+                target_username=usernames[target_id],
+            )
+        return await UserRepository._get_without_graph(
+            session, target_id, include_deleted=True
+        )
 
     @staticmethod
     async def complete_registration(
@@ -358,44 +381,54 @@ class UserRepository:
             raise DatabaseError(server_message=f"[User | delete_avatar] {error}")
 
     @staticmethod
-    async def toggle_online(
-        session: AsyncSession, user_id: str, new_is_online_value: bool
-    ) -> User:
-        user: User = await UserRepository.get_by_id_with_relations(
-            session=session, user_id=user_id
-        )
-        if not user:
-            raise UserNotFoundError(user_id)
-        if user.is_online and not new_is_online_value:
-            user.last_seen = datetime.now(timezone.utc)
-        user.is_online = new_is_online_value
+    async def set_current_sid(
+        session: AsyncSession,
+        user_id: str,
+        new_sid: str | None,
+        only_if_sid: str | None = None,
+    ) -> None:
+        # ? Presence lives in redis (PresenceService), here is only the sid
+        query = update(User).where(User.id == user_id).values(current_sid=new_sid)
+        if only_if_sid is not None:
+            # * Don't clear the sid of a newer connection
+            query = query.where(User.current_sid == only_if_sid)
         try:
-            await session.flush()
-            await session.refresh(user)
-            return user
+            await session.execute(query.execution_options(synchronize_session=False))
         except Exception as error:
             await session.rollback()
-            raise DatabaseError(server_message=f"[User | toggle_online] {error}")
+            raise DatabaseError(server_message=f"[User | set_current_sid] {error}")
 
     @staticmethod
-    async def set_current_sid(
-        session: AsyncSession, user_id: str, new_sid: str | None
-    ) -> User:
-        user: User = await UserRepository.get_by_id_with_relations(
-            session=session, user_id=user_id
+    async def flush_presences(session: AsyncSession, presences: list[Presence]) -> int:
+        if not presences:
+            return 0
+        users_table = User.__table__
+        query = (
+            update(users_table)
+            .where(
+                users_table.c.id == bindparam("b_id"),
+                users_table.c.deleted_at.is_(None),
+            )
+            .values(
+                is_online=bindparam("b_is_online"),
+                last_seen=func.coalesce(
+                    bindparam("b_last_seen", type_=users_table.c.last_seen.type),
+                    users_table.c.last_seen,
+                ),
+            )
         )
-        if not user:
-            raise UserNotFoundError(user_id)
-        if not new_sid:
-            await UserRepository.toggle_online(session, user_id, False)
-        user.current_sid = new_sid
-        try:
-            await session.flush()
-            await session.refresh(user)
-            return user
-        except Exception as error:
-            await session.rollback()
-            raise DatabaseError(server_message=f"[User | set_current_sid] {error}")
+        await session.execute(
+            query,
+            [
+                {
+                    "b_id": presence.user_id,
+                    "b_is_online": presence.is_online,
+                    "b_last_seen": presence.last_seen,
+                }
+                for presence in presences
+            ],
+        )
+        return len(presences)
 
     @staticmethod
     async def update_(session: AsyncSession, user_id: str, update_data: dict) -> User:
@@ -438,11 +471,7 @@ class UserRepository:
             select(User)
             .join(user_subscriptions, user_subscriptions.c.following_id == User.id)
             .where(user_subscriptions.c.follower_id == target_id)
-            .options(
-                selectinload(User.following).load_only(User.id),
-                selectinload(User.followers).load_only(User.id),
-                selectinload(User.posts).load_only(Post.id, Post.deleted_at),
-            )
+            .options(*load_short_user_only_options)
             .offset(pagination.offset)
             .limit(pagination.limit)
         )
@@ -462,11 +491,7 @@ class UserRepository:
             select(User)
             .join(user_subscriptions, user_subscriptions.c.follower_id == User.id)
             .where(user_subscriptions.c.following_id == target_id)
-            .options(
-                selectinload(User.following).load_only(User.id),
-                selectinload(User.followers).load_only(User.id),
-                selectinload(User.posts).load_only(Post.id, Post.deleted_at),
-            )
+            .options(*load_short_user_only_options)
             .offset(pagination.offset)
             .limit(pagination.limit)
         )
@@ -494,8 +519,17 @@ class UserRepository:
             raise DatabaseError(server_message=f"[User | update_role] {error}")
 
     @staticmethod
-    async def reset_sids(session: AsyncSession) -> None:
-        await session.execute(update(User).values(current_sid=None))
+    async def reset_sids(session: AsyncSession, sids: list[str] | None = None) -> None:
+        if sids is None:
+            await session.execute(update(User).values(current_sid=None, is_online=False))
+        elif sids:
+            # * Only sessions of one (crashed) node
+            await session.execute(
+                update(User)
+                .where(User.current_sid.in_(sids))
+                .values(current_sid=None)
+                .execution_options(synchronize_session=False)
+            )
         await session.flush()
 
     @staticmethod
@@ -525,7 +559,20 @@ class UserRepository:
         target_user.last_seen = None
 
         target_user.deleted_at = datetime.now(timezone.utc)
+        target_user.following_count = 0
 
+        await session.execute(
+            update(User)
+            .where(
+                User.id.in_(
+                    select(user_subscriptions.c.following_id).where(
+                        user_subscriptions.c.follower_id == target_id
+                    )
+                )
+            )
+            .values(followers_count=User.followers_count - 1)
+            .execution_options(synchronize_session=False)
+        )
         await session.execute(
             delete(user_subscriptions).where(
                 user_subscriptions.c.follower_id == target_id
@@ -535,3 +582,113 @@ class UserRepository:
         await session.flush()
         await session.refresh(target_user)
         return target_user
+
+    @staticmethod
+    async def shift_counters(session: AsyncSession, user_id: str, **deltas: int) -> None:
+        await session.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(
+                {
+                    getattr(User, counter): getattr(User, counter) + delta
+                    for counter, delta in deltas.items()
+                }
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+    @staticmethod
+    async def recalculate_counters(
+        session: AsyncSession, after_id: str | None = None, limit: int = 1000
+    ) -> list[str]:
+        # ? One primary key batch per call (and per transaction),
+        # ? so rows are locked only for a short while
+        ids_query = select(User.id).order_by(User.id).limit(limit)
+        if after_id is not None:
+            ids_query = ids_query.where(User.id > after_id)
+        ids = list((await session.scalars(ids_query)).all())
+        if not ids:
+            return ids
+        following_count = (
+            select(func.count())
+            .select_from(user_subscriptions)
+            .where(user_subscriptions.c.follower_id == User.id)
+            .scalar_subquery()
+        )
+        followers_count = (
+            select(func.count())
+            .select_from(user_subscriptions)
+            .where(user_subscriptions.c.following_id == User.id)
+            .scalar_subquery()
+        )
+        posts_count = (
+            select(func.count())
+            .select_from(Post)
+            .where(Post.author_id == User.id, Post.deleted_at.is_(None))
+            .scalar_subquery()
+        )
+        await session.execute(
+            update(User)
+            .values(
+                following_count=following_count,
+                followers_count=followers_count,
+                posts_count=posts_count,
+            )
+            .where(User.id.in_(ids))
+            .execution_options(synchronize_session=False)
+        )
+        await session.flush()
+        return ids
+
+    @staticmethod
+    async def get_presence_audience_ids(
+        session: AsyncSession, user_id: str, limit: int
+    ) -> set[str] | None:
+        # ? Followers and chat partners, the only users who care about presence.
+        # ? None if there are more than limit of them (too popular to fan out)
+        followers_query = select(user_subscriptions.c.follower_id).where(
+            user_subscriptions.c.following_id == user_id
+        )
+        chat_partners_query = select(
+            case((Chat.user1_id == user_id, Chat.user2_id), else_=Chat.user1_id)
+        ).where(
+            or_(Chat.user1_id == user_id, Chat.user2_id == user_id),
+            Chat.last_message_id.is_not(None),
+        )
+        result = await session.scalars(
+            followers_query.union(chat_partners_query).limit(limit + 2)
+        )
+        audience_ids = set(result.all())
+        audience_ids.discard(user_id)
+        if len(audience_ids) > limit:
+            return None
+        return audience_ids
+
+    @staticmethod
+    async def get_relations(
+        session: AsyncSession, viewer_id: str, user_ids: list[str]
+    ) -> UserRelations:
+        relations = UserRelations(viewer_id)
+        user_ids = set(user_ids)
+        if not user_ids:
+            return relations
+        query = select(
+            user_subscriptions.c.follower_id, user_subscriptions.c.following_id
+        ).where(
+            or_(
+                and_(
+                    user_subscriptions.c.follower_id == viewer_id,
+                    user_subscriptions.c.following_id.in_(user_ids),
+                ),
+                and_(
+                    user_subscriptions.c.following_id == viewer_id,
+                    user_subscriptions.c.follower_id.in_(user_ids),
+                ),
+            )
+        )
+        for follower_id, following_id in (await session.execute(query)).all():
+            if follower_id == viewer_id:
+                relations.following_ids.add(following_id)
+            if following_id == viewer_id:
+                relations.followed_by_ids.add(follower_id)
+        return relations
@@ -0,0 +1,166 @@
+from sqlalchemy import Select, func, not_, or_, select
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.exceptions.api_exceptions import BadRequestError
+from models.loaders import load_short_user_only_options
+from models.user import User
+
+
+class SearchPhase:
+    prefix = "prefix"  # % username starts with the pattern
+    fulltext = "fulltext"  # % pattern is somewhere in username or fullname (LIKE if short)
+
+
+class UserSearchRepository:
+    # ! Must be equal to the MySQL ngram_token_size (2 by default)
+    NGRAM_TOKEN_SIZE = 2
+    LIKE_ESCAPE = "/"
+
+    @staticmethod
+    def _base_query(ignore_id: str) -> Select:
+        return (
+            select(User)
+            .where(
+                User.id != ignore_id,
+                User.is_registration_completed,
+                User.deleted_at.is_(None),
+            )
+            .options(*load_short_user_only_options)
+            .order_by(User.username)
+        )
+
+    @staticmethod
+    def _escape_like(pattern: str) -> str:
+        escape = UserSearchRepository.LIKE_ESCAPE
+        return (
+            pattern.replace(escape, escape * 2)
+            .replace("%", f"{escape}%")
+            .replace("_", f"{escape}_")
+        )
+
+    @staticmethod
+    def _username_prefix(pattern: str):
+        escaped = UserSearchRepository._escape_like(pattern)
+        # ? Range scan on the unique username index
+        return User.username.like(
+            f"{escaped}%", escape=UserSearchRepository.LIKE_ESCAPE
+        )
+
+    @staticmethod
+    def _short_substring(pattern: str):
+        # ? Shorter than an ngram token, so not in the FULLTEXT index: legacy LIKE.
+        # ? It's a scan, but a one-char pattern matches almost every row,
+        # ? so LIMIT stops it early
+        escaped = f"%{UserSearchRepository._escape_like(pattern)}%"
+        return or_(
+            User.username.like(escaped, escape=UserSearchRepository.LIKE_ESCAPE),
+            User.fullname.like(escaped, escape=UserSearchRepository.LIKE_ESCAPE),
+        )
+
+    @staticmethod
+    def _fulltext(pattern: str):
+        # ? Phrase search over ngram index == substring search
+        phrase = pattern.replace('"', " ").strip()
+        return match(User.username, User.fullname, against=f'"{phrase}"').in_boolean_mode()
+
+    @staticmethod
+    def _can_use_fulltext(pattern: str) -> bool:
+        return len(pattern.replace('"', " ").strip()) >= UserSearchRepository.NGRAM_TOKEN_SIZE
+
+    @staticmethod
+    def _substring(pattern: str):
+        if UserSearchRepository._can_use_fulltext(pattern):
+            return UserSearchRepository._fulltext(pattern)
+        return UserSearchRepository._short_substring(pattern)
+
+    @staticmethod
+    def _prefix_query(pattern: str, ignore_id: str) -> Select:
+        return UserSearchRepository._base_query(ignore_id).where(
+            UserSearchRepository._username_prefix(pattern)
+        )
+
+    @staticmethod
+    def _fulltext_query(pattern: str, ignore_id: str) -> Select:
+        return UserSearchRepository._base_query(ignore_id).where(
+            UserSearchRepository._substring(pattern),
+            not_(UserSearchRepository._username_prefix(pattern)),
+        )
+
+    @staticmethod
+    async def search_by_offset(
+        session: AsyncSession,
+        pattern: str,
+        offset: int = 0,
+        limit: int = 10,
+        ignore_id: str = "",
+    ) -> list[User]:
+        prefix_query = UserSearchRepository._prefix_query(pattern, ignore_id)
+        users = list(
+            (await session.scalars(prefix_query.offset(offset).limit(limit))).all()
+        )
+        if len(users) == limit or not pattern.strip():
+            return users
+        if users or not offset:
+            prefix_total = offset + len(users)
+        else:
+            prefix_total = await session.scalar(
+                select(func.count()).select_from(
+                    prefix_query.order_by(None).subquery()
+                )
+            )
+        fulltext_query = (
+            UserSearchRepository._fulltext_query(pattern, ignore_id)
+            .offset(max(0, offset - prefix_total))
+            .limit(limit - len(users))
+        )
+        users.extend((await session.scalars(fulltext_query)).all())
+        return users
+
+    @staticmethod
+    async def search_by_cursor(
+        session: AsyncSession,
+        pattern: str,
+        cursor: dict | None = None,
+        limit: int = 10,
+        ignore_id: str = "",
+    ) -> tuple[list[User], dict | None]:
+        phase, after_username = SearchPhase.prefix, None
+        if cursor is not None:
+            phase = cursor.get("phase")
+            after_username = cursor.get("username")
+            if phase not in (SearchPhase.prefix, SearchPhase.fulltext) or not isinstance(
+                after_username, str
+            ):
+                raise BadRequestError("Invalid cursor")
+
+        prefix_users: list[User] = []
+        if phase == SearchPhase.prefix:
+            query = UserSearchRepository._prefix_query(pattern, ignore_id)
+            if after_username is not None:
+                query = query.where(User.username > after_username)
+            prefix_users = list((await session.scalars(query.limit(limit))).all())
+            if len(prefix_users) < limit:
+                phase, after_username = SearchPhase.fulltext, None
+
+        fulltext_users: list[User] = []
+        if (
+            phase == SearchPhase.fulltext
+            and len(prefix_users) < limit
+            and pattern.strip()
+        ):
+            query = UserSearchRepository._fulltext_query(pattern, ignore_id)
+            if after_username is not None:
+                query = query.where(User.username > after_username)
+            fulltext_users = list(
+                (await session.scalars(query.limit(limit - len(prefix_users)))).all()
+            )
+
+        users = prefix_users + fulltext_users
+        next_cursor = None
+        if users and len(users) == limit:
+            next_cursor = {
+                "phase": SearchPhase.fulltext if fulltext_users else SearchPhase.prefix,
+                "username": users[-1].username,
+            }
+        return users, next_cursor
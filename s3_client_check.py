@@ -0,0 +1,285 @@
+import asyncio
+import hashlib
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from minio.signer import presign_v4, sign_v4_s3
+from minio.credentials import Credentials
+
+from services.s3_client import S3Client, S3Error
+
+# ? Runs S3Client against an in-process fake S3 that checks every request
+# ? signature with the minio SDK signer. No MinIO or network is needed:
+# ? python s3_client_check.py
+ACCESS_KEY = "access"
+SECRET_KEY = "secret"
+REGION = "us-east-1"
+NAMESPACE = "http://s3.amazonaws.com/doc/2006-03-01/"
+LIST_PAGE_SIZE = 2  # ? Small pages, so listings always go through continuation tokens
+FAILING_COPY_KEY = "broken/copy.jpg"  # ? Copy into it fails after 200 OK
+
+
+class FakeS3:
+    def __init__(self):
+        self.buckets: dict[str, dict[str, tuple[bytes, str, datetime]]] = {}
+        self.verified_signatures = 0
+        self.listed_pages = 0
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route("*", "/{tail:.*}", self.handle)
+        return app
+
+    def is_signature_valid(self, request: web.Request, body: bytes) -> bool:
+        authorization = request.headers["Authorization"]
+        signed_names = authorization.split("SignedHeaders=")[1].split(",")[0]
+        payload_hash = request.headers["x-amz-content-sha256"]
+        expected = sign_v4_s3(
+            method=request.method,
+            url=urlsplit(f"http://{request.host}{request.raw_path}"),
+            region=REGION,
+            headers={name: request.headers[name] for name in signed_names.split(";")},
+            credentials=Credentials(ACCESS_KEY, SECRET_KEY),
+            content_sha256=payload_hash,
+            date=datetime.strptime(
+                request.headers["x-amz-date"], "%Y%m%dT%H%M%SZ"
+            ).replace(tzinfo=timezone.utc),
+        )
+        if expected["Authorization"] != authorization:
+            return False
+        if payload_hash != hashlib.sha256(body).hexdigest():
+            return False
+        self.verified_signatures += 1
+        return True
+
+    @staticmethod
+    def error(status: int, code: str) -> web.Response:
+        return web.Response(
+            status=status,
+            text=f"<Error><Code>{code}</Code><Message>{code}</Message></Error>",
+            content_type="application/xml",
+        )
+
+    def list_objects(self, request: web.Request, bucket: str) -> web.Response:
+        prefix = request.query.get("prefix", "")
+        delimiter = request.query.get("delimiter")
+        keys = sorted(
+            key
+            for key in self.buckets.get(bucket, {})
+            if key.startswith(prefix)
+            and not (delimiter and delimiter in key[len(prefix) :])
+        )
+        start = int(request.query.get("continuation-token", 0))
+        page = keys[start : start + LIST_PAGE_SIZE]
+        is_truncated = start + LIST_PAGE_SIZE < len(keys)
+        contents = ""
+        for key in page:
+            data, etag, modified = self.buckets[bucket][key]
+            contents += (
+                f"<Contents><Key>{key}</Key>"
+                f"<LastModified>{modified:%Y-%m-%dT%H:%M:%S.000Z}</LastModified>"
+                f"<ETag>&quot;{etag}&quot;</ETag><Size>{len(data)}</Size></Contents>"
+            )
+        if is_truncated:
+            contents += (
+                f"<NextContinuationToken>{start + LIST_PAGE_SIZE}</NextContinuationToken>"
+            )
+        self.listed_pages += 1
+        return web.Response(
+            text=(
+                f'<ListBucketResult xmlns="{NAMESPACE}">'
+                f"<IsTruncated>{str(is_truncated).lower()}</IsTruncated>"
+                f"{contents}</ListBucketResult>"
+            ),
+            content_type="application/xml",
+        )
+
+    def copy_object(self, store: dict, key: str, source: str) -> web.Response:
+        source_bucket, _, source_key = unquote(source).lstrip("/").partition("/")
+        source_object = self.buckets.get(source_bucket, {}).get(source_key)
+        if source_object is None:
+            return self.error(404, "NoSuchKey")
+        if key == FAILING_COPY_KEY:
+            return self.error(200, "InternalError")
+        data, etag, _ = source_object
+        modified = datetime.now(timezone.utc)
+        store[key] = (data, etag, modified)
+        return web.Response(
+            text=(
+                f'<CopyObjectResult xmlns="{NAMESPACE}">'
+                f"<LastModified>{modified:%Y-%m-%dT%H:%M:%S.000Z}</LastModified>"
+                f"<ETag>&quot;{etag}&quot;</ETag></CopyObjectResult>"
+            ),
+            content_type="application/xml",
+        )
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        if not self.is_signature_valid(request, body):
+            return self.error(403, "SignatureDoesNotMatch")
+        bucket, _, key = unquote(request.path).lstrip("/").partition("/")
+        if not key:
+            if request.method == "HEAD":
+                return web.Response(status=200 if bucket in self.buckets else 404)
+            if request.method == "PUT":
+                self.buckets.setdefault(bucket, {})
+                return web.Response()
+            return self.list_objects(request, bucket)
+        store = self.buckets.get(bucket)
+        if store is None:
+            return self.error(404, "NoSuchBucket")
+        if request.method == "PUT":
+            source = request.headers.get("x-amz-copy-source")
+            if source:
+                return self.copy_object(store, key, source)
+            etag = hashlib.md5(body).hexdigest()
+            store[key] = (body, etag, datetime.now(timezone.utc))
+            return web.Response(headers={"ETag": f'"{etag}"'})
+        if request.method == "DELETE":
+            store.pop(key, None)
+            return web.Response(status=204)
+        if key not in store:
+            if request.method == "HEAD":
+                return web.Response(status=404)
+            return self.error(404, "NoSuchKey")
+        data, etag, modified = store[key]
+        headers = {
+            "ETag": f'"{etag}"',
+            "Last-Modified": format_datetime(modified, usegmt=True),
+            "Content-Type": "image/jpeg",
+        }
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(len(data))
+            return web.Response(headers=headers)
+        byte_range = request.headers.get("Range")
+        if byte_range:
+            start, _, end = byte_range.removeprefix("bytes=").partition("-")
+            end = int(end) if end else len(data) - 1
+            return web.Response(
+                status=206, body=data[int(start) : end + 1], headers=headers
+            )
+        return web.Response(body=data, headers=headers)
+
+
+async def check_objects(client: S3Client, fake: FakeS3):
+    assert not await client.bucket_exists("posts")
+    await client.make_bucket("posts")
+    assert await client.bucket_exists("posts")
+
+    small = await client.put_object("posts", "p1/256.jpg", b"x" * 1000, "image/jpeg")
+    assert small.size == 1000 and small.etag == hashlib.md5(b"x" * 1000).hexdigest()
+    # * Bigger than HASH_IN_THREAD_BYTES, the payload hash is computed in a thread
+    original = bytes(range(256)) * 8192
+    await client.put_object("posts", "p1/original.jpg", memoryview(original))
+
+    stat = await client.stat_object("posts", "p1/256.jpg")
+    assert stat.size == 1000 and stat.etag == small.etag and stat.last_modified
+
+    stream = await client.get_object("posts", "p1/original.jpg", offset=100, length=50)
+    try:
+        assert stream.size == 50 and await stream.read() == original[100:150]
+    finally:
+        stream.close()
+    stream = await client.get_object("posts", "p1/original.jpg", offset=len(original) - 10)
+    try:
+        assert await stream.read() == original[-10:]
+    finally:
+        stream.close()
+    stream = await client.get_object("posts", "p1/original.jpg")
+    try:
+        chunks = [chunk async for chunk in stream.iter_chunks()]
+    finally:
+        stream.close()
+    assert b"".join(chunks) == original
+
+    try:
+        await client.get_object("posts", "p1/missing.jpg")
+        raise AssertionError("missing object was returned")
+    except S3Error as error:
+        assert error.code == "NoSuchKey" and error.status == 404
+    try:
+        await client.stat_object("posts", "p1/missing.jpg")
+        raise AssertionError("missing object was stated")
+    except S3Error as error:
+        assert error.status == 404
+
+    await client.remove_object("posts", "p1/256.jpg")
+    assert not await client.list_objects("posts", "p1/256")
+    print(f"Objects: ok ({fake.verified_signatures} signatures verified)")
+
+
+async def check_listing(client: S3Client, fake: FakeS3):
+    keys = [f"p2/{index}.jpg" for index in range(5)] + ["p2/nested/0.jpg"]
+    for key in keys:
+        await client.put_object("posts", key, b"y")
+    pages_before = fake.listed_pages
+    listed = await client.list_objects("posts", "p2/")
+    assert [s3_object.key for s3_object in listed] == sorted(keys[:5])
+    assert fake.listed_pages - pages_before == 3
+    assert all(s3_object.size == 1 and s3_object.etag for s3_object in listed)
+    listed = await client.list_objects("posts", "p2/", recursive=True)
+    assert [s3_object.key for s3_object in listed] == sorted(keys)
+    print("ListObjectsV2 paging: ok")
+
+
+async def check_copy(client: S3Client):
+    await client.put_object("posts", "p3/256.jpg", b"z" * 10)
+    copied = await client.copy_object("posts", "p4/256.jpg", "posts", "p3/256.jpg")
+    assert copied.etag == hashlib.md5(b"z" * 10).hexdigest() and copied.last_modified
+    stream = await client.get_object("posts", "p4/256.jpg")
+    try:
+        assert await stream.read() == b"z" * 10
+    finally:
+        stream.close()
+    try:
+        await client.copy_object("posts", FAILING_COPY_KEY, "posts", "p3/256.jpg")
+        raise AssertionError("failed copy was accepted")
+    except S3Error as error:
+        assert error.code == "InternalError" and error.status == 200
+    try:
+        await client.copy_object("posts", "p4/missing.jpg", "posts", "p3/missing.jpg")
+        raise AssertionError("copy of a missing object was accepted")
+    except S3Error as error:
+        assert error.code == "NoSuchKey" and error.status == 404
+    print("Copy: ok")
+
+
+def check_presign(client: S3Client):
+    url = urlsplit(
+        client.presign_get("apks", "socially_app-v1.0.0.apk", timedelta(minutes=5))
+    )
+    query = parse_qs(url.query)
+    expected = presign_v4(
+        method="GET",
+        url=url._replace(query=""),
+        region=REGION,
+        credentials=Credentials(ACCESS_KEY, SECRET_KEY),
+        date=datetime.strptime(query["X-Amz-Date"][0], "%Y%m%dT%H%M%SZ").replace(
+            tzinfo=timezone.utc
+        ),
+        expires=5 * 60,
+    )
+    assert parse_qs(expected.query) == query, "presigned query mismatch"
+    print("Presigned query: ok")
+
+
+async def main():
+    fake = FakeS3()
+    server = TestServer(fake.app(), port=0)
+    await server.start_server()
+    client = S3Client(f"127.0.0.1:{server.port}", ACCESS_KEY, SECRET_KEY)
+    try:
+        await check_objects(client, fake)
+        await check_listing(client, fake)
+        await check_copy(client)
+        check_presign(client)
+    finally:
+        await client.close()
+        await server.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,134 @@
+import asyncio
+from os import getenv
+from random import choice, randint
+from string import ascii_lowercase
+from time import perf_counter
+from uuid import uuid4
+
+from sqlalchemy import insert, or_, select, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import models.apk_update  # noqa: F401
+import models.chat  # noqa: F401
+import models.comment  # noqa: F401
+import models.message  # noqa: F401
+import models.otp  # noqa: F401
+import models.post  # noqa: F401
+import models.refresh_token  # noqa: F401
+from models.base import BaseModel
+from models.loaders import load_short_user_only_options
+from models.user import User
+from repositories.user_search_repository import UserSearchRepository
+
+# ? Seeds a separate database with USERS_COUNT users and compares
+# ? the legacy ILIKE '%pattern%' + OFFSET query with UserSearchRepository
+USERS_COUNT = int(getenv("BENCHMARK_USERS_COUNT", 1_000_000))
+BATCH_SIZE = 10_000
+REPEATS = 5
+PATTERNS = ("al", "ser", "ivan", "xq", "kot_")
+PAGES = 5
+LIMIT = 10
+
+db_host = getenv("MYSQL_HOST")
+db_port = getenv("MYSQL_PORT")
+db_user = getenv("MYSQL_USER")
+db_password = getenv("MYSQL_PASSWORD")
+db_name = f"{getenv('MYSQL_NAME')}_search_benchmark"
+server_url = f"mysql+asyncmy://{db_user}:{db_password}@{db_host}:{db_port}"
+
+NAMES = ("alex", "ivan", "sergey", "maria", "olga", "kot", "anna", "dmitry", "elena")
+
+
+def random_user(index: int) -> dict:
+    name = choice(NAMES)
+    suffix = "".join(choice(ascii_lowercase) for _ in range(randint(2, 5)))
+    return {
+        "id": str(uuid4()),
+        "email_address": f"user{index}@benchmark.local",
+        "username": f"{name}_{suffix}{index}"[:16],
+        "fullname": f"{name.capitalize()} {suffix.capitalize()}",
+        "is_registration_completed": True,
+    }
+
+
+async def seed(engine):
+    async with engine.begin() as connection:
+        await connection.execute(text("SET SESSION innodb_ft_enable_stopword = OFF"))
+        await connection.run_sync(BaseModel.metadata.drop_all)
+        await connection.run_sync(BaseModel.metadata.create_all)
+    for start in range(0, USERS_COUNT, BATCH_SIZE):
+        batch = [random_user(i) for i in range(start, min(start + BATCH_SIZE, USERS_COUNT))]
+        async with engine.begin() as connection:
+            await connection.execute(insert(User), batch)
+        print(f"Seeded {start + len(batch)}/{USERS_COUNT}", end="\r")
+    print()
+
+
+async def measure(name: str, func) -> None:
+    timings = []
+    for _ in range(REPEATS):
+        started_at = perf_counter()
+        await func()
+        timings.append((perf_counter() - started_at) * 1000)
+    timings.sort()
+    print(f"{name:<48} median {timings[len(timings) // 2]:8.2f}ms  max {timings[-1]:8.2f}ms")
+
+
+async def main():
+    server_engine = create_async_engine(server_url, isolation_level="AUTOCOMMIT")
+    async with server_engine.connect() as connection:
+        await connection.execute(text(f"CREATE DATABASE IF NOT EXISTS `{db_name}`"))
+    await server_engine.dispose()
+
+    engine = create_async_engine(f"{server_url}/{db_name}")
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    if getenv("BENCHMARK_SKIP_SEED") is None:
+        await seed(engine)
+
+    for pattern in PATTERNS:
+        async def legacy():
+            async with session_maker() as session:
+                for page in range(PAGES):
+                    query = (
+                        select(User)
+                        .where(
+                            or_(
+                                User.username.ilike(f"%{pattern}%"),
+                                User.fullname.ilike(f"%{pattern}%"),
+                            ),
+                            User.is_registration_completed,
+                            User.deleted_at.is_(None),
+                        )
+                        .options(*load_short_user_only_options)
+                        .offset(page * LIMIT)
+                        .limit(LIMIT)
+                    )
+                    await session.scalars(query)
+
+        async def by_offset():
+            async with session_maker() as session:
+                for page in range(PAGES):
+                    await UserSearchRepository.search_by_offset(
+                        session, pattern, offset=page * LIMIT, limit=LIMIT
+                    )
+
+        async def by_cursor():
+            async with session_maker() as session:
+                cursor = None
+                for _ in range(PAGES):
+                    _, cursor = await UserSearchRepository.search_by_cursor(
+                        session, pattern, cursor=cursor, limit=LIMIT
+                    )
+                    if cursor is None:
+                        break
+
+        print(f"Pattern '{pattern}', {PAGES} pages by {LIMIT}:")
+        await measure("  legacy ILIKE + OFFSET", legacy)
+        await measure("  prefix + FULLTEXT, offset", by_offset)
+        await measure("  prefix + FULLTEXT, cursor", by_cursor)
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
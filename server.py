@@ -1,5 +1,8 @@
 import asyncio
+import signal
 import sys
+from logging import Logger
+from multiprocessing.synchronize import Event
 
 import socketio
 from aiohttp import web
@@ -25,12 +28,16 @@ from controllers.sio_controller import SioController
 from controllers.test_users_controller import TestUsersController
 from controllers.users_controller import UsersController
 from database.database import Database
+from services.media_index import MediaIndex
 from services.minio_service import MinioService
+from services.presence_service import PresenceService
+from services.revocation_store import RevocationStore
 from services.session_store import SessionStore
 from services.test_users import TestUsers
+from services.workers_launcher import WorkersLauncher
 
 
-async def initialize():
+async def initialize(create_buckets: bool = True):
     ServerConfig.initialize()  #! Must be called first (loaging env variables)
     DatabaseConfig.initialize()
     JwtConfig.initialize()
@@ -38,22 +45,17 @@ async def initialize():
     MyLoggerConfig.initialize()
     MinioConfig.initialize()
     await SessionStore.initialize()
-    await MinioService.initialize()
+    await RevocationStore.initialize()
+    await PresenceService.initialize()
+    await MediaIndex.initialize()
+    await MinioService.initialize(create_buckets=create_buckets)
     await Database.initialize()
 
-    from services.fcm_service import FCMService
-    FCMService.initialize()
-
-async def main():
-    await initialize()
 
+async def run_startup_work(server_logger: Logger):
+    # ? Must be done once, not in every worker
     from services.my_logger import MyLogger
 
-    server_logger = MyLogger.get_logger("Server")
-    server_logger.info(
-        f"Initialized with logging level: {MyLoggerConfig.LEVEL}, run in docker: {ServerConfig.RUN_IN_DOCKER}\n"
-    )
-
     try:
         test_users_service = TestUsers(logger=MyLogger.get_logger("Test Users Service"))
         await test_users_service.create_test_users()
@@ -66,10 +68,54 @@ async def main():
     except Exception as reset_sids_error:
         server_logger.warning(f"Error on reset sids: {reset_sids_error}")
 
+
+async def startup_once():
+    await initialize()
+
+    from services.my_logger import MyLogger
+
+    await run_startup_work(MyLogger.get_logger("Server"))
+    await Database.dispose()
+    await MinioService.close()
+
+
+async def main(ready_event: Event | None = None):
+    in_worker = ready_event is not None
+    await initialize(create_buckets=not in_worker)
+
+    from services.fcm_service import FCMService
+    from services.my_logger import MyLogger
+
+    FCMService.initialize()
+
+    server_logger = MyLogger.get_logger("Server")
+    server_logger.info(
+        f"Initialized with logging level: {MyLoggerConfig.LEVEL}, run in docker: {ServerConfig.RUN_IN_DOCKER}, node: {ServerConfig.NODE_ID} (role: {ServerConfig.ROLE.value}, multi node: {ServerConfig.MULTI_NODE}, workers: {ServerConfig.WORKERS})\n"
+    )
+
+    if not in_worker:
+        await run_startup_work(server_logger)
+
     middlewares = Middlewares(MyLogger.get_logger("Middlewares"))
 
+    client_manager = None
+    transports = None
+    if ServerConfig.is_distributed():
+        # * Emits to sids and rooms of other nodes go through redis pub/sub,
+        # * rest node only publishes (it holds no sockets)
+        client_manager = socketio.AsyncRedisManager(
+            "redis://redis:6379/0",
+            write_only=not ServerConfig.serves_realtime(),
+        )
+    if ServerConfig.WORKERS > 1:
+        # ? Long-polling requests of one client may land on different workers
+        transports = ["websocket"]
     sio = socketio.AsyncServer(
-        async_mode="aiohttp", async_handlers=True, cors_allowed_origins="*"
+        async_mode="aiohttp",
+        async_handlers=True,
+        cors_allowed_origins="*",
+        client_manager=client_manager,
+        transports=transports,
     )
     app = web.Application(
         middlewares=(
@@ -77,7 +123,8 @@ async def main():
             middlewares.database_session,
         ),
     )
-    sio.attach(app)
+    if ServerConfig.serves_realtime():
+        sio.attach(app)
     main_sio_namespace = SioController(
         logger=MyLogger.get_logger("Socket IO"),
         namespace="/",
@@ -122,79 +169,87 @@ async def main():
 
     app.add_routes(
         [
-            web.post(
-                Paths.Registration.CHECK_EMAIL, registration_controller.check_email
-            ),
-            web.post(Paths.Registration.VERIFY_OTP, registration_controller.check_otp),
-            web.put(
-                Paths.Registration.COMPLETE_REGISTRATION,
-                registration_controller.complete_registration,
-            ),
-            #
-            web.post(Paths.Auth.LOGIN, auth_controller.login),
-            web.post(
-                Paths.Auth.ResetPassword.SEND_OTP,
-                auth_controller.send_otp_to_reset_password,
-            ),
-            web.post(
-                Paths.Auth.ResetPassword.VERIFY_OTP,
-                auth_controller.verify_otp_for_reset_password,
-            ),
-            web.post(Paths.Auth.REFRESH, auth_controller.refresh),
-            web.put(Paths.Auth.LOGOUT, auth_controller.logout),
-            #
-            web.get(Paths.Users.CHECK_USERNAME, users_controller.check_username),
-            web.get(Paths.Users.GET_BY_ID, users_controller.get_by_id),
-            web.get(Paths.Users.SEARCH, users_controller.search),
-            web.put(Paths.Users.UPDATE_PROFILE, users_controller.update_profile),
-            web.put(Paths.Users.UPDATE_PASSWORD, users_controller.update_password),
-            web.put(Paths.Users.UPDATE_AVATAR, users_controller.update_avatar),
-            web.delete(Paths.Users.DELETE_AVATAR, users_controller.delete_avatar),
-            web.put(Paths.Users.FOLLOW, users_controller.follow),
-            web.delete(Paths.Users.UNFOLLOW, users_controller.unfollow),
-            web.get(Paths.Users.GET_FOLLOWINGS, users_controller.get_followings),
-            web.get(Paths.Users.GET_FOLLOWERS, users_controller.get_followers),
-            web.put(Paths.Users.UPDATE_ROLE, users_controller.update_role),
-            web.delete(Paths.Users.DELETE, users_controller.soft_delete),
-            web.put(Paths.Users.FCM_TOKENS, users_controller.update_fcm_token),
-            #
-            web.get(
-                Paths.TestUsers.ADMIN_ROLE_TEST, test_users_controller.test_admin_role
-            ),
-            web.get(
-                Paths.TestUsers.OWNER_ROLE_TEST, test_users_controller.test_owner_role
-            ),
-            #
-            web.post(Paths.ApkUpdates.ADD, apk_updates_controller.add),
-            web.get(Paths.ApkUpdates.GET_ONE, apk_updates_controller.get_one),
-            web.get(Paths.ApkUpdates.GET_MANY, apk_updates_controller.get_many),
-            web.delete(Paths.ApkUpdates.DELETE, apk_updates_controller.delete),
-            #
-            web.get(Paths.Posts.GET_ALL, posts_controller.get_all),
-            web.get(Paths.Posts.GET_ONE, posts_controller.get_one),
-            web.delete(Paths.Posts.DELETE, posts_controller.delete),
-            web.post(Paths.Posts.CREATE, posts_controller.create),
-            web.post(Paths.Posts.LIKE, posts_controller.like),
-            web.delete(Paths.Posts.UNLIKE, posts_controller.unlike),
-            web.get(Paths.Posts.Comments.GET_ALL, comments_controller.get_all),
-            web.post(Paths.Posts.Comments.CREATE, comments_controller.add),
-            web.delete(Paths.Posts.Comments.DELETE, comments_controller.delete),
-            #
-            #web.get(Paths.Media.AVATARS, media_controller.get_avatar_image),
-            # web.get(Paths.Media.POSTS, media_controller.get_post_image),
-            # web.get(Paths.Media.MESSAGES, media_controller.get_message_image),
-            web.get(Paths.Media.UNIVERSAL, media_controller.get),
-            web.get(Paths.Media.WITH_FOLDER, media_controller.get_with_folder),
-            #
-            web.get(Paths.Messages.GET_CHATS, messages_controller.get_chats),
-            web.get(Paths.Messages.GET_MESSAGES, messages_controller.get_messages),
-            web.post(Paths.Messages.CREATE_MESSAGE, messages_controller.create_message),
-            web.delete(Paths.Messages.DELETE_MESSAGE, messages_controller.delete_message),
-            web.put(Paths.Messages.MARK_READED, messages_controller.mark_readed),
-            #
-            web.get(Paths.Admin.GET_MINIO_STAT, dashboard_controller.get_minio_stat),
+            web.get(Paths.Admin.GET_METRICS, dashboard_controller.get_metrics),
         ]
     )
+    rest_routes = [
+        web.post(
+            Paths.Registration.CHECK_EMAIL, registration_controller.check_email
+        ),
+        web.post(Paths.Registration.VERIFY_OTP, registration_controller.check_otp),
+        web.put(
+            Paths.Registration.COMPLETE_REGISTRATION,
+            registration_controller.complete_registration,
+        ),
+        #
+        web.post(Paths.Auth.LOGIN, auth_controller.login),
+        web.post(
+            Paths.Auth.ResetPassword.SEND_OTP,
+            auth_controller.send_otp_to_reset_password,
+        ),
+        web.post(
+            Paths.Auth.ResetPassword.VERIFY_OTP,
+            auth_controller.verify_otp_for_reset_password,
+        ),
+        web.post(Paths.Auth.REFRESH, auth_controller.refresh),
+        web.put(Paths.Auth.LOGOUT, auth_controller.logout),
+        #
+        web.get(Paths.Users.CHECK_USERNAME, users_controller.check_username),
+        web.get(Paths.Users.GET_BY_ID, users_controller.get_by_id),
+        web.get(Paths.Users.SEARCH, users_controller.search),
+        web.put(Paths.Users.UPDATE_PROFILE, users_controller.update_profile),
+        web.put(Paths.Users.UPDATE_PASSWORD, users_controller.update_password),
+        web.put(Paths.Users.UPDATE_AVATAR, users_controller.update_avatar),
+        web.delete(Paths.Users.DELETE_AVATAR, users_controller.delete_avatar),
+        web.put(Paths.Users.FOLLOW, users_controller.follow),
+        web.delete(Paths.Users.UNFOLLOW, users_controller.unfollow),
+        web.get(Paths.Users.GET_FOLLOWINGS, users_controller.get_followings),
+        web.get(Paths.Users.GET_FOLLOWERS, users_controller.get_followers),
+        web.put(Paths.Users.UPDATE_ROLE, users_controller.update_role),
+        web.delete(Paths.Users.DELETE, users_controller.soft_delete),
+        web.put(Paths.Users.FCM_TOKENS, users_controller.update_fcm_token),
+        #
+        web.get(
+            Paths.TestUsers.ADMIN_ROLE_TEST, test_users_controller.test_admin_role
+        ),
+        web.get(
+            Paths.TestUsers.OWNER_ROLE_TEST, test_users_controller.test_owner_role
+        ),
+        #
+        web.post(Paths.ApkUpdates.ADD, apk_updates_controller.add),
+        web.get(Paths.ApkUpdates.GET_ONE, apk_updates_controller.get_one),
+        web.get(Paths.ApkUpdates.GET_MANY, apk_updates_controller.get_many),
+        web.delete(Paths.ApkUpdates.DELETE, apk_updates_controller.delete),
+        #
+        web.get(Paths.Posts.GET_ALL, posts_controller.get_all),
+        web.get(Paths.Posts.GET_ONE, posts_controller.get_one),
+        web.delete(Paths.Posts.DELETE, posts_controller.delete),
+        web.post(Paths.Posts.CREATE, posts_controller.create),
+        web.post(Paths.Posts.LIKE, posts_controller.like),
+        web.delete(Paths.Posts.UNLIKE, posts_controller.unlike),
+        web.get(Paths.Posts.Comments.GET_ALL, comments_controller.get_all),
+        web.post(Paths.Posts.Comments.CREATE, comments_controller.add),
+        web.delete(Paths.Posts.Comments.DELETE, comments_controller.delete),
+        #
+        #web.get(Paths.Media.AVATARS, media_controller.get_avatar_image),
+        # web.get(Paths.Media.POSTS, media_controller.get_post_image),
+        # web.get(Paths.Media.MESSAGES, media_controller.get_message_image),
+        web.get(Paths.Media.UNIVERSAL, media_controller.get),
+        web.get(Paths.Media.WITH_FOLDER, media_controller.get_with_folder),
+        #
+        web.get(Paths.Messages.GET_CHATS, messages_controller.get_chats),
+        web.get(Paths.Messages.GET_TOTAL_UNREAD_COUNT, messages_controller.get_total_unread_count),
+        web.get(Paths.Messages.GET_MESSAGES, messages_controller.get_messages),
+        web.get(Paths.Messages.GET_CHANGES, messages_controller.get_changes),
+        web.post(Paths.Messages.CREATE_MESSAGE, messages_controller.create_message),
+        web.delete(Paths.Messages.DELETE_MESSAGE, messages_controller.delete_message),
+        web.put(Paths.Messages.MARK_READED, messages_controller.mark_readed),
+        web.put(Paths.Messages.MARK_READ_UNTIL, messages_controller.mark_read_until),
+        #
+        web.get(Paths.Admin.GET_MINIO_STAT, dashboard_controller.get_minio_stat),
+    ]
+    if ServerConfig.serves_rest():
+        app.add_routes(rest_routes)
 
     from services.background_services import BackgroundServices
 
@@ -208,6 +263,7 @@ async def main():
         runner,
         host=ServerConfig.HOST,
         port=ServerConfig.PORT,
+        reuse_port=ServerConfig.WORKERS > 1,
     )
 
     await site.start()
@@ -215,15 +271,47 @@ async def main():
         f"Server started on {ServerConfig.HOST}:{ServerConfig.PORT}...\n"
     )
 
-    while True:
-        await asyncio.sleep(3600)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    if sys.platform != "win32":
+        for stop_signal in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(stop_signal, stop_event.set)
+    if ready_event is not None:
+        ready_event.set()
+    await stop_event.wait()
 
+    server_logger.info("Stopping server...\n")
+    await runner.cleanup()
+    await Database.dispose()
+    await MinioService.close()
 
-def run_server():
+
+def set_event_loop_policy():
     if sys.platform != "win32":
         import uvloop
         asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
-    asyncio.run(main())
+
+
+def run_worker(ready_event: Event):
+    set_event_loop_policy()
+    asyncio.run(main(ready_event))
+
+
+def run_server():
+    set_event_loop_policy()
+    ServerConfig.initialize()  # ? Only to know the workers count
+    if ServerConfig.WORKERS == 1 or sys.platform == "win32":
+        asyncio.run(main())
+        return
+    asyncio.run(startup_once())
+
+    from services.my_logger import MyLogger
+
+    WorkersLauncher(
+        logger=MyLogger.get_logger("Launcher"),
+        workers_count=ServerConfig.WORKERS,
+        target=run_worker,
+    ).run()
 
 
 if __name__ == "__main__":
@@ -3,9 +3,15 @@ from datetime import datetime, timedelta, timezone
 
 from aiohttp.web import Application
 
+from config.server_config import ServerConfig
 from database.database import Database
+from repositories.message_repository import MessagesRepository
 from repositories.otp_repository import OtpRepository
+from repositories.post_repository import PostRepository
+from repositories.user_repository import UserRepository
 from services.my_logger import MyLogger
+from services.presence_service import PresenceService
+from services.session_store import SessionStore
 from services.tokens_service import TokensService
 from utils.datetime_utils import DateTimeUtils
 
@@ -13,24 +19,59 @@ from utils.datetime_utils import DateTimeUtils
 class BackgroundServices:
     CLEANING_OTP_SECONDS_DELAY = 60 * 60 * 6  # ? EVERY 6 HOURS
     CLEANING_REFRESH_TOKEN_SECONDS_DELAY = 60 * 60 * 24  # ? EVERY 24 HOURS
+    RECALCULATING_COUNTERS_BATCH_SIZE = 1000
+    RECALCULATING_COUNTERS_SECONDS_DELAY = 60 * 60 * 24  # ? EVERY 24 HOURS
+    # ? Presence flush delay is ServerConfig.PRESENCE_FLUSH_SECONDS,
+    # ? node heartbeat delay is ServerConfig.NODE_HEARTBEAT_SECONDS
+
+    TASKS = (
+        "heartbeating_node",
+        "listening_session_invalidations",
+        "flushing_presence",
+        "cleaning_otp_database",
+        "cleaning_refresh_token_database",
+        "recalculating_counters",
+    )
+    MAINTENANCE_TASKS = (
+        "cleaning_otp_database",
+        "cleaning_refresh_token_database",
+        "recalculating_counters",
+    )
+    REALTIME_TASKS = (
+        "heartbeating_node",
+        "listening_session_invalidations",
+        "flushing_presence",
+    )
 
     @staticmethod
     async def start_background_tasks(app: Application):
-        app["cleaning_otp_database"] = asyncio.create_task(
-            BackgroundServices.cleaning_otp_database()
-        )
-        app["cleaning_refresh_token_database"] = asyncio.create_task(
-            BackgroundServices.cleaning_refresh_token_database()
-        )
+        if ServerConfig.serves_realtime():
+            # * Sessions left by a previous process with the same node id
+            await BackgroundServices.cleanup_node(ServerConfig.NODE_ID)
+            await SessionStore.heartbeat()
+        for task_name in BackgroundServices.TASKS:
+            if (
+                task_name in BackgroundServices.MAINTENANCE_TASKS
+                and not ServerConfig.runs_maintenance()
+            ) or (
+                task_name in BackgroundServices.REALTIME_TASKS
+                and not ServerConfig.serves_realtime()
+            ):
+                continue
+            app[task_name] = asyncio.create_task(
+                getattr(BackgroundServices, task_name)()
+            )
 
     @staticmethod
     async def cleanup_background_tasks(app: Application):
-        cleaning_otp_task: asyncio.Task = app["cleaning_otp_database"]
-        cleaning_refresh_token_task: asyncio.Task = app[
-            "cleaning_refresh_token_database"
-        ]
-        cleaning_otp_task.cancel()
-        cleaning_refresh_token_task.cancel()
+        for task_name in BackgroundServices.TASKS:
+            task: asyncio.Task | None = app.get(task_name)
+            if task:
+                task.cancel()
+        if ServerConfig.serves_realtime():
+            await BackgroundServices.cleanup_node(ServerConfig.NODE_ID)
+            # * Write behind what is left
+            await BackgroundServices.flush_presence()
 
     @staticmethod
     async def cleaning_otp_database():
@@ -88,3 +129,147 @@ class BackgroundServices:
                     except asyncio.CancelledError:
                         logger.warning("Refresh token cleaning task was cancelled")
                         break
+
+    @staticmethod
+    async def recalculating_counters():
+        # ? Fixes a drift of users, posts and chats denormalized counters (if there is any)
+        logger = MyLogger.get_logger("Background Service")
+        delay = BackgroundServices.RECALCULATING_COUNTERS_SECONDS_DELAY
+        while True:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                logger.warning("Counters recalculating task was cancelled")
+                break
+            try:
+                users_count = await BackgroundServices._recalculate_in_batches(
+                    UserRepository.recalculate_counters
+                )
+                posts_count = await BackgroundServices._recalculate_in_batches(
+                    PostRepository.recalculate_counters
+                )
+                chats_count = await BackgroundServices._recalculate_in_batches(
+                    MessagesRepository.recalculate_unread_counters
+                )
+                logger.info(
+                    f"Recalculated counters of {users_count} users, {posts_count} posts and {chats_count} chats\n"
+                )
+            except Exception as error:
+                logger.error(f"Error on recalculating counters: {error}")
+
+    @staticmethod
+    async def _recalculate_in_batches(recalculate) -> int:
+        # ? A transaction per primary key batch, rows aren't locked for the whole run
+        recalculated_count = 0
+        after_id = None
+        while True:
+            async with Database.session_maker() as session:
+                try:
+                    ids = await recalculate(
+                        session,
+                        after_id=after_id,
+                        limit=BackgroundServices.RECALCULATING_COUNTERS_BATCH_SIZE,
+                    )
+                    await session.commit()
+                except Exception:
+                    await session.rollback()
+                    raise
+            if not ids:
+                return recalculated_count
+            recalculated_count += len(ids)
+            after_id = ids[-1]
+            await asyncio.sleep(0)
+
+    @staticmethod
+    async def flush_presence() -> int:
+        flushed_count = 0
+        while presences := await PresenceService.pop_dirty():
+            async with Database.session_maker() as session:
+                try:
+                    await UserRepository.flush_presences(session, presences)
+                    await session.commit()
+                except Exception:
+                    await session.rollback()
+                    await PresenceService.mark_dirty([p.user_id for p in presences])
+                    raise
+            flushed_count += len(presences)
+            if len(presences) < PresenceService.FLUSH_BATCH_SIZE:
+                break
+        return flushed_count
+
+    @staticmethod
+    async def flushing_presence():
+        # ? Write-behind of redis presence (is_online, last_seen) to MySQL
+        logger = MyLogger.get_logger("Background Service")
+        delay = ServerConfig.PRESENCE_FLUSH_SECONDS
+        while True:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                logger.warning("Presence flushing task was cancelled")
+                break
+            try:
+                flushed_count = await BackgroundServices.flush_presence()
+                if flushed_count:
+                    logger.debug(f"Flushed presence of {flushed_count} users\n")
+            except Exception as error:
+                logger.error(f"Error on flushing presence: {error}")
+
+    @staticmethod
+    async def cleanup_node(node_id: str) -> int:
+        sessions = await SessionStore.remove_node_sessions(node_id)
+        if not sessions:
+            return 0
+        async with Database.session_maker() as session:
+            try:
+                await UserRepository.reset_sids(
+                    session, [sio_session.sid for sio_session in sessions]
+                )
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+        for user_id in {sio_session.user_id for sio_session in sessions}:
+            if not await SessionStore.get_sids_by_user_id(user_id):
+                await PresenceService.set_offline(user_id)
+        return len(sessions)
+
+    @staticmethod
+    async def heartbeating_node():
+        logger = MyLogger.get_logger("Background Service")
+        delay = ServerConfig.NODE_HEARTBEAT_SECONDS
+        while True:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                logger.warning("Node heartbeat task was cancelled")
+                break
+            try:
+                await SessionStore.heartbeat()
+                for node_id in await SessionStore.get_dead_nodes():
+                    if not await SessionStore.lock_node_cleanup(node_id):
+                        continue
+                    removed_count = await BackgroundServices.cleanup_node(node_id)
+                    logger.warning(
+                        f"Node {node_id} is dead, removed {removed_count} of its sessions\n"
+                    )
+            except Exception as error:
+                logger.error(f"Error on node heartbeat: {error}")
+
+    @staticmethod
+    async def listening_session_invalidations():
+        logger = MyLogger.get_logger("Background Service")
+        while True:
+            try:
+                await SessionStore.listen_invalidations()
+            except asyncio.CancelledError:
+                logger.warning("Session invalidations listening task was cancelled")
+                break
+            except Exception as error:
+                logger.error(f"Error on listening session invalidations: {error}")
+            # * Cache could miss invalidations while reconnecting
+            SessionStore.clear_cache()
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                break
@@ -0,0 +1,183 @@
+import asyncio
+import os
+from collections import OrderedDict
+from pathlib import Path
+from urllib.parse import quote, unquote
+
+from config.server_config import ServerConfig
+from models.exceptions.initalize_exceptions import UnableToInitializeServiceError
+from services.metrics import Metrics
+
+
+# ? Two-tier cache of small media objects (avatars, feed thumbnails):
+# ? in-process LRU bounded by bytes + optional LRU directory on the local disk.
+# ? Object keys are content-addressed, so entries never go stale, they are only
+# ? dropped on delete (other workers/nodes keep theirs until evicted, but they
+# ? aren't requested anymore: deleted media is gone from MediaIndex)
+class MediaCache:
+    INITALIZED: bool = False
+    memory: OrderedDict[tuple[str, str], bytes] = OrderedDict()
+    memory_bytes = 0
+    disk_dir: Path | None = None
+    disk: OrderedDict[tuple[str, str], int] = OrderedDict()  # % -> file size
+    disk_bytes = 0
+
+    @classmethod
+    async def initialize(cls):
+        try:
+            cls.memory.clear()
+            cls.memory_bytes = 0
+            cls.disk.clear()
+            cls.disk_bytes = 0
+            cls.disk_dir = None
+            if ServerConfig.MEDIA_CACHE_DIR:
+                # * Every worker owns its directory, it survives restarts
+                worker_dir = (
+                    f"w{ServerConfig.WORKER_INDEX}"
+                    if ServerConfig.WORKER_INDEX is not None
+                    else "main"
+                )
+                cls.disk_dir = Path(ServerConfig.MEDIA_CACHE_DIR) / worker_dir
+                await asyncio.to_thread(cls._load_disk)
+            Metrics.track_ratio(
+                "media_cache_hit_ratio", "media_cache_hits", "media_cache_misses"
+            )
+            cls._update_gauges()
+            cls.INITALIZED = True
+        except Exception as error:
+            raise UnableToInitializeServiceError("MediaCache") from error
+
+    @classmethod
+    def _load_disk(cls):
+        cls.disk_dir.mkdir(parents=True, exist_ok=True)
+        entries = []
+        for entry in os.scandir(cls.disk_dir):
+            if not entry.is_file() or entry.name.endswith(".tmp"):
+                continue
+            bucket, _, key = unquote(entry.name).partition("/")
+            stat = entry.stat()
+            entries.append((stat.st_mtime, (bucket, key), stat.st_size))
+        for _, cache_key, size in sorted(entries):
+            cls.disk[cache_key] = size
+            cls.disk_bytes += size
+        cls._remove_files(cls._evict_disk())
+
+    @classmethod
+    def _path(cls, cache_key: tuple[str, str]) -> Path:
+        bucket, key = cache_key
+        return cls.disk_dir / quote(f"{bucket}/{key}", safe="")
+
+    @staticmethod
+    def accepts(byte_size: int) -> bool:
+        return 0 < byte_size <= ServerConfig.MEDIA_CACHE_MAX_ITEM_KB * 1024
+
+    @classmethod
+    def _update_gauges(cls):
+        Metrics.set_gauge("media_cache_memory_bytes", cls.memory_bytes)
+        Metrics.set_gauge("media_cache_memory_items", len(cls.memory))
+        Metrics.set_gauge("media_cache_disk_bytes", cls.disk_bytes)
+        Metrics.set_gauge("media_cache_disk_items", len(cls.disk))
+
+    @classmethod
+    def _put_memory(cls, cache_key: tuple[str, str], body: bytes):
+        previous = cls.memory.pop(cache_key, None)
+        if previous is not None:
+            cls.memory_bytes -= len(previous)
+        cls.memory[cache_key] = body
+        cls.memory_bytes += len(body)
+        budget = ServerConfig.MEDIA_CACHE_MEMORY_MB * 1024 * 1024
+        while cls.memory_bytes > budget and cls.memory:
+            _, evicted = cls.memory.popitem(last=False)
+            cls.memory_bytes -= len(evicted)
+            Metrics.increment("media_cache_memory_evictions")
+
+    @classmethod
+    def _evict_disk(cls) -> list[Path]:
+        # % Paths of evicted files, to be removed out of the event loop
+        budget = ServerConfig.MEDIA_CACHE_DISK_MB * 1024 * 1024
+        evicted_paths = []
+        while cls.disk_bytes > budget and cls.disk:
+            cache_key, size = cls.disk.popitem(last=False)
+            cls.disk_bytes -= size
+            evicted_paths.append(cls._path(cache_key))
+            Metrics.increment("media_cache_disk_evictions")
+        return evicted_paths
+
+    @staticmethod
+    def _remove_files(paths: list[Path]):
+        for path in paths:
+            path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _write_file(path: Path, body: bytes):
+        temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        temp_path.write_bytes(body)
+        os.replace(temp_path, path)  # ? Readers never see a partial file
+
+    @classmethod
+    async def get(cls, bucket: str, key: str) -> bytes | None:
+        if not cls.INITALIZED:
+            return None
+        cache_key = (bucket, key)
+        body = cls.memory.get(cache_key)
+        if body is not None:
+            cls.memory.move_to_end(cache_key)
+            Metrics.increment("media_cache_hits")
+            return body
+        if cls.disk_dir is not None and cache_key in cls.disk:
+            cls.disk.move_to_end(cache_key)
+            try:
+                body = await asyncio.to_thread(cls._path(cache_key).read_bytes)
+            except OSError:
+                # * Removed outside (or by an old worker during a rolling restart)
+                cls.disk_bytes -= cls.disk.pop(cache_key, 0)
+            else:
+                cls._put_memory(cache_key, body)
+                cls._update_gauges()
+                Metrics.increment("media_cache_hits")
+                Metrics.increment("media_cache_disk_hits")
+                return body
+        Metrics.increment("media_cache_misses")
+        return None
+
+    @classmethod
+    async def put(cls, bucket: str, key: str, body: bytes):
+        if not cls.INITALIZED or not cls.accepts(len(body)):
+            return
+        cache_key = (bucket, key)
+        cls._put_memory(cache_key, body)
+        if cls.disk_dir is not None:
+            try:
+                await asyncio.to_thread(cls._write_file, cls._path(cache_key), body)
+            except OSError:
+                Metrics.increment("media_cache_disk_errors")
+            else:
+                cls.disk_bytes += len(body) - cls.disk.pop(cache_key, 0)
+                cls.disk[cache_key] = len(body)
+                evicted_paths = cls._evict_disk()
+                if evicted_paths:
+                    await asyncio.to_thread(cls._remove_files, evicted_paths)
+        cls._update_gauges()
+
+    @classmethod
+    async def invalidate_prefix(cls, bucket: str, prefix: str):
+        if not cls.INITALIZED:
+            return
+        for cache_key in [
+            cache_key
+            for cache_key in cls.memory
+            if cache_key[0] == bucket and cache_key[1].startswith(prefix)
+        ]:
+            cls.memory_bytes -= len(cls.memory.pop(cache_key))
+        disk_keys = [
+            cache_key
+            for cache_key in cls.disk
+            if cache_key[0] == bucket and cache_key[1].startswith(prefix)
+        ]
+        for cache_key in disk_keys:
+            cls.disk_bytes -= cls.disk.pop(cache_key)
+        if disk_keys:
+            await asyncio.to_thread(
+                cls._remove_files, [cls._path(cache_key) for cache_key in disk_keys]
+            )
+        cls._update_gauges()
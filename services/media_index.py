@@ -0,0 +1,111 @@
+import json
+from functools import wraps
+
+from redis.asyncio import Redis
+
+from models.exceptions.initalize_exceptions import (
+    ServiceNotInitalizedButUsingError,
+    UnableToInitializeServiceError,
+)
+from models.image_sizes import ImageSizes
+from models.media_variant import MediaVariant
+from services.metrics import Metrics
+from services.minio_service import Buckets
+
+
+def check_initialized(handler):
+    @wraps(handler)
+    async def wrapper(cls, *args, **kwargs):
+        if not cls.INITALIZED:
+            raise ServiceNotInitalizedButUsingError("MediaIndex(redis)")
+        return await handler(cls, *args, **kwargs)
+
+    return wrapper
+
+
+# ? media:{bucket}:{media_id} (hash) - variant name (image size) -> MediaVariant json.
+# ? Written on upload, so serving a media needs no MinIO listing or stat.
+# ? Media uploaded before the index (or lost with redis) is indexed on first GET.
+# ? media_missing:{bucket}:{media_id} - ids MinIO had nothing for, kept shortly
+# ? so requests of unknown or deleted media don't list MinIO every time
+class MediaIndex:
+    INITALIZED: bool = False
+    redis: Redis
+    MISSING_TTL_SECONDS = 60
+
+    @classmethod
+    async def initialize(cls):
+        try:
+            cls.redis = Redis(host="redis", port=6379, decode_responses=True)
+            Metrics.track_ratio(
+                "media_index_hit_ratio", "media_index_hits", "media_index_misses"
+            )
+            cls.INITALIZED = True
+        except Exception as error:
+            raise UnableToInitializeServiceError("MediaIndex(redis)") from error
+
+    @staticmethod
+    def _key(bucket: Buckets, media_id: str) -> str:
+        return f"media:{bucket.value}:{media_id}"
+
+    @staticmethod
+    def _missing_key(bucket: Buckets, media_id: str) -> str:
+        return f"media_missing:{bucket.value}:{media_id}"
+
+    @classmethod
+    @check_initialized
+    async def add_variants(cls, bucket: Buckets, variants: list[MediaVariant]):
+        if not variants:
+            return
+        async with cls.redis.pipeline(transaction=False) as pipe:
+            for variant in variants:
+                pipe.hset(
+                    cls._key(bucket, variant.media_id),
+                    variant.name,
+                    json.dumps(variant.to_json()),
+                )
+            for media_id in {variant.media_id for variant in variants}:
+                pipe.delete(cls._missing_key(bucket, media_id))
+            await pipe.execute()
+
+    @classmethod
+    @check_initialized
+    async def get_variants(
+        cls, bucket: Buckets, media_id: str
+    ) -> dict[str, MediaVariant] | None:
+        # % None if the media was recently looked up in MinIO and not found
+        async with cls.redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(cls._key(bucket, media_id))
+            pipe.exists(cls._missing_key(bucket, media_id))
+            data, is_missing = await pipe.execute()
+        if not data and is_missing:
+            return None
+        return {
+            name: MediaVariant.from_json(json.loads(json_variant))
+            for name, json_variant in data.items()
+        }
+
+    @classmethod
+    @check_initialized
+    async def mark_missing(cls, bucket: Buckets, media_id: str):
+        await cls.redis.set(
+            cls._missing_key(bucket, media_id), 1, ex=cls.MISSING_TTL_SECONDS
+        )
+
+    @classmethod
+    @check_initialized
+    async def remove_objects(cls, bucket: Buckets, object_keys: list[str]):
+        media_ids = {object_key.rsplit("/", 1)[0] for object_key in object_keys}
+        keys = [cls._key(bucket, media_id) for media_id in media_ids]
+        if keys:
+            await cls.redis.delete(*keys)
+
+    @staticmethod
+    def pick(
+        variants: dict[str, MediaVariant], requested_size: ImageSizes
+    ) -> MediaVariant | None:
+        for size in ImageSizes.get_next_available_size(requested_size):
+            variant = variants.get(size.str_view)
+            if variant is not None:
+                return variant
+        return None
@@ -0,0 +1,71 @@
+from time import time
+
+
+class Distribution:
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, value: int | float):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def to_json(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "avg": round(self.total / self.count, 3) if self.count else 0,
+            "max": self.max,
+        }
+
+
+# ? In-process metrics (every worker has its own)
+class Metrics:
+    STARTED_AT = time()
+    counters: dict[str, int] = {}
+    gauges: dict[str, int | float] = {}
+    distributions: dict[str, Distribution] = {}
+    tracked_ratios: dict[str, tuple[str, str]] = {}
+
+    @classmethod
+    def increment(cls, name: str, value: int = 1):
+        cls.counters[name] = cls.counters.get(name, 0) + value
+
+    @classmethod
+    def set_gauge(cls, name: str, value: int | float):
+        cls.gauges[name] = value
+
+    @classmethod
+    def observe(cls, name: str, value: int | float):
+        distribution = cls.distributions.get(name)
+        if distribution is None:
+            distribution = cls.distributions[name] = Distribution()
+        distribution.observe(value)
+
+    @classmethod
+    def ratio(cls, hits_name: str, misses_name: str) -> float:
+        hits = cls.counters.get(hits_name, 0)
+        total = hits + cls.counters.get(misses_name, 0)
+        return round(hits / total, 4) if total else 0.0
+
+    @classmethod
+    def track_ratio(cls, name: str, hits_name: str, misses_name: str):
+        cls.tracked_ratios[name] = (hits_name, misses_name)
+
+    @classmethod
+    def to_json(cls):
+        return {
+            "uptime_seconds": int(time() - cls.STARTED_AT),
+            "counters": dict(cls.counters),
+            "gauges": dict(cls.gauges),
+            "distributions": {
+                name: distribution.to_json()
+                for name, distribution in cls.distributions.items()
+            },
+            "ratios": {
+                name: cls.ratio(hits_name, misses_name)
+                for name, (hits_name, misses_name) in cls.tracked_ratios.items()
+            },
+        }
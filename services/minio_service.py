@@ -1,11 +1,9 @@
 import asyncio
 import mimetypes
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
 from enum import Enum
 from io import BytesIO
-
-from minio import Minio, S3Error
-from minio.commonconfig import CopySource
+from urllib.parse import urlsplit
 
 from config.minio_config import MinioConfig
 from models.exceptions.api_exceptions import MinioError, MinioNotFoundError
@@ -15,6 +13,9 @@ from models.exceptions.initalize_exceptions import (
     UnableToInitializeServiceError,
 )
 from models.image_sizes import ImageSizes
+from models.media_variant import MediaVariant
+from services.media_cache import MediaCache
+from services.s3_client import S3Client, S3Error, S3Object, S3ObjectStream
 
 
 class Buckets(Enum):
@@ -66,32 +67,38 @@ class MinioStat:
 
 class MinioService:
     INITALIZED: bool = False
-    instance: Minio
+    instance: S3Client
 
     @staticmethod
-    async def initialize():
+    async def initialize(create_buckets: bool = True):
         try:
             if not MinioConfig.INITALIZED:
                 raise ConfigNotInitalizedButUsingError(config_name="MinioConfig")
-            MinioService.instance = Minio(
+            MinioService.instance = S3Client(
                 endpoint="minio:9000",
                 access_key=MinioConfig.USER,
                 secret_key=MinioConfig.PASSWORD,
                 secure=False,
+                pool_size=MinioConfig.POOL_SIZE,
             )
-            await MinioService._initialize_buckets()
+            if create_buckets:
+                await MinioService._initialize_buckets()
+            await MediaCache.initialize()
             MinioService.INITALIZED = True
         except Exception as error:
             raise UnableToInitializeServiceError("MinioService") from error
 
+    @staticmethod
+    async def close():
+        if MinioService.INITALIZED:
+            await MinioService.instance.close()
+
     @staticmethod
     async def _initialize_buckets():
         for bucket in Buckets:
-            found = await asyncio.to_thread(
-                MinioService.instance.bucket_exists, bucket.value
-            )
+            found = await MinioService.instance.bucket_exists(bucket.value)
             if not found:
-                await asyncio.to_thread(MinioService.instance.make_bucket, bucket.value)
+                await MinioService.instance.make_bucket(bucket.value)
 
     @staticmethod
     def guess_mime_type(filename: str) -> str:
@@ -106,35 +113,77 @@ class MinioService:
         if not MinioService.INITALIZED:
             raise ServiceNotInitalizedButUsingError("MinioService")
         try:
-            bytes.seek(0)
-            content_type = MinioService.guess_mime_type(filename)
-            size = bytes.getbuffer().nbytes
-            bytes.seek(0)
-            return await asyncio.to_thread(
-                MinioService.instance.put_object,
-                bucket_name=bucket.value,
-                object_name=key,
-                data=bytes,
-                length=size,
-                content_type=content_type,
+            return await MinioService.instance.put_object(
+                bucket=bucket.value,
+                key=key,
+                data=bytes.getbuffer(),
+                content_type=MinioService.guess_mime_type(filename),
             )
         except S3Error as error:
             raise MinioError(error=error) from error
 
     @staticmethod
-    async def get(bucket: Buckets, key: str):
+    async def save_image_variants(
+        bucket: Buckets,
+        media_id: str,
+        images: dict[ImageSizes, BytesIO],
+        extension: str,
+    ) -> list[MediaVariant]:
+        async def save_variant(size: ImageSizes, buffer: BytesIO) -> MediaVariant:
+            key = f"{media_id}/{size.str_view}{extension}"
+            result = await MinioService.save(bucket=bucket, key=key, bytes=buffer)
+            return MediaVariant(
+                object_key=key,
+                byte_size=buffer.getbuffer().nbytes,
+                etag=result.etag,
+                content_type=MinioService.guess_mime_type(key),
+                last_modified=result.last_modified or datetime.now(timezone.utc),
+            )
+
+        return list(
+            await asyncio.gather(
+                *(save_variant(size, buffer) for size, buffer in images.items())
+            )
+        )
+
+    @staticmethod
+    async def list_variants(bucket: Buckets, media_id: str) -> list[MediaVariant]:
         if not MinioService.INITALIZED:
             raise ServiceNotInitalizedButUsingError("MinioService")
         try:
-            data = await asyncio.to_thread(
-                MinioService.instance.get_object,
-                bucket_name=bucket.value,
-                object_name=key,
+            objects = await MinioService.instance.list_objects(
+                bucket=bucket.value,
+                prefix=f"{media_id}/",
             )
-            stat = await asyncio.to_thread(
-                MinioService.instance.stat_object, bucket.value, key
+        except S3Error as error:
+            raise MinioError(error=error) from error
+        return [MinioService._variant_from_object(obj) for obj in objects]
+
+    @staticmethod
+    def _variant_from_object(obj: S3Object) -> MediaVariant:
+        return MediaVariant(
+            object_key=obj.key,
+            byte_size=obj.size,
+            etag=obj.etag,
+            content_type=MinioService.guess_mime_type(obj.key),
+            last_modified=obj.last_modified,
+        )
+
+    @staticmethod
+    async def get_data(
+        bucket: Buckets, key: str, offset: int = 0, length: int = 0
+    ) -> S3ObjectStream:
+        # ? Object body only, metadata is expected to be known (see MediaIndex)
+        # ? offset/length select a byte range (length 0 == up to the end)
+        if not MinioService.INITALIZED:
+            raise ServiceNotInitalizedButUsingError("MinioService")
+        try:
+            return await MinioService.instance.get_object(
+                bucket=bucket.value,
+                key=key,
+                offset=offset,
+                length=length,
             )
-            return data, stat
         except S3Error as error:
             if error.code == "NoSuchKey":
                 raise MinioNotFoundError(key=key)
@@ -142,35 +191,40 @@ class MinioService:
                 raise MinioError(error=error) from error
 
     @staticmethod
-    async def get_first_with_prefix(bucket: Buckets, prefix: str):
+    async def get_bytes(bucket: Buckets, key: str) -> bytes:
+        # ? Whole body of a small object, served from MediaCache when possible
+        body = await MediaCache.get(bucket.value, key)
+        if body is not None:
+            return body
+        data = await MinioService.get_data(bucket=bucket, key=key)
+        try:
+            body = await data.read()
+        except Exception as error:
+            raise MinioError(error=error) from error
+        finally:
+            data.close()
+        await MediaCache.put(bucket.value, key, body)
+        return body
+
+    @staticmethod
+    async def get_variant(bucket: Buckets, key: str) -> MediaVariant:
+        # ? Object metadata only (for single file media, like apks)
         if not MinioService.INITALIZED:
             raise ServiceNotInitalizedButUsingError("MinioService")
         try:
-            objects = tuple(
-                await asyncio.to_thread(
-                    MinioService.instance.list_objects,
-                    bucket_name=bucket.value,
-                    prefix=prefix,
-                    recursive=True,
-                )
-            )
-            if not objects:
-                raise MinioNotFoundError(key=f"prefix: {prefix}")
-            key = objects[0].object_name
-            data = await asyncio.to_thread(
-                MinioService.instance.get_object,
-                bucket_name=bucket.value,
-                object_name=key,
-            )
-            stat = await asyncio.to_thread(
-                MinioService.instance.stat_object, bucket.value, key
-            )
-            return data, stat
+            stat = await MinioService.instance.stat_object(bucket.value, key)
         except S3Error as error:
-            if error.code == "NoSuchKey":
-                raise MinioNotFoundError(key=f"prefix: {prefix}")
+            if error.code in ("NoSuchKey", "NoSuchObject"):
+                raise MinioNotFoundError(key=key)
             else:
                 raise MinioError(error=error) from error
+        return MediaVariant(
+            object_key=key,
+            byte_size=stat.size,
+            etag=stat.etag,
+            content_type=stat.content_type,
+            last_modified=stat.last_modified,
+        )
 
     @staticmethod
     async def copy(
@@ -184,14 +238,11 @@ class MinioService:
         to_bucket = to_bucket or source_bucket
         new_key = new_key or source_key
         try:
-            await asyncio.to_thread(
-                MinioService.instance.copy_object,
-                bucket_name=to_bucket.value,
-                object_name=new_key,
-                source=CopySource(
-                    bucket_name=source_bucket.value,
-                    object_name=source_key,
-                ),
+            await MinioService.instance.copy_object(
+                bucket=to_bucket.value,
+                key=new_key,
+                source_bucket=source_bucket.value,
+                source_key=source_key,
             )
         except S3Error as error:
             if error.code == "NoSuchKey":
@@ -203,35 +254,40 @@ class MinioService:
     async def copy_message_images(
         source_msg_id: str,
         to_msg_id: str,
-    ):
+    ) -> list[MediaVariant]:
         if not MinioService.INITALIZED:
             raise ServiceNotInitalizedButUsingError("MinioService")
         try:
-            objects = tuple(
-                await asyncio.to_thread(
-                    MinioService.instance.list_objects,
-                    bucket_name=Buckets.messages.value,
-                    prefix=source_msg_id,
-                    recursive=True,
-                )
+            objects = await MinioService.instance.list_objects(
+                bucket=Buckets.messages.value,
+                prefix=source_msg_id,
+                recursive=True,
             )
             if not objects:
                 raise MinioNotFoundError(key=f"messages by prefix: {source_msg_id}")
+            copied_variants = []
             for obj in objects:
-                source_object_name = obj.object_name
+                source_object_name = obj.key
                 new_object_name = source_object_name.replace(
                     source_msg_id,
                     to_msg_id,
                 )
-                await asyncio.to_thread(
-                    MinioService.instance.copy_object,
-                    bucket_name=Buckets.messages.value,
-                    object_name=new_object_name,
-                    source=CopySource(
-                        bucket_name=Buckets.messages.value,
-                        object_name=source_object_name,
-                    ),
+                result = await MinioService.instance.copy_object(
+                    bucket=Buckets.messages.value,
+                    key=new_object_name,
+                    source_bucket=Buckets.messages.value,
+                    source_key=source_object_name,
+                )
+                copied_variants.append(
+                    MediaVariant(
+                        object_key=new_object_name,
+                        byte_size=obj.size,
+                        etag=result.etag or obj.etag,
+                        content_type=MinioService.guess_mime_type(new_object_name),
+                        last_modified=result.last_modified or datetime.now(timezone.utc),
+                    )
                 )
+            return copied_variants
         except S3Error as error:
             if error.code == "NoSuchKey":
                 raise MinioNotFoundError(key=f"messages by prefix: {source_msg_id}")
@@ -243,11 +299,7 @@ class MinioService:
         if not MinioService.INITALIZED:
             raise ServiceNotInitalizedButUsingError("MinioService")
         try:
-            await asyncio.to_thread(
-                MinioService.instance.remove_object,
-                bucket_name=bucket.value,
-                object_name=key,
-            )
+            await MinioService.instance.remove_object(bucket=bucket.value, key=key)
         except S3Error as error:
             if error.code == "NoSuchKey":
                 raise MinioNotFoundError(key=key)
@@ -255,26 +307,25 @@ class MinioService:
                 raise MinioError(error=error) from error
 
     @staticmethod
-    async def delete_all_by_prefix(bucket: Buckets, prefix: str):
+    async def delete_all_by_prefix(bucket: Buckets, prefix: str) -> list[str]:
         if not MinioService.INITALIZED:
             raise ServiceNotInitalizedButUsingError("MinioService")
         try:
-            objects = tuple(
-                await asyncio.to_thread(
-                    MinioService.instance.list_objects,
-                    bucket_name=bucket.value,
-                    prefix=prefix,
-                    recursive=True,
-                )
+            objects = await MinioService.instance.list_objects(
+                bucket=bucket.value,
+                prefix=prefix,
+                recursive=True,
             )
             if not objects:
                 raise MinioNotFoundError(key=f"prefix: {prefix}")
-            for obj in objects:
-                await asyncio.to_thread(
-                    MinioService.instance.remove_object,
-                    bucket_name=bucket.value,
-                    object_name=obj.object_name,
+            await asyncio.gather(
+                *(
+                    MinioService.instance.remove_object(bucket=bucket.value, key=obj.key)
+                    for obj in objects
                 )
+            )
+            await MediaCache.invalidate_prefix(bucket.value, prefix)
+            return [obj.key for obj in objects]
         except S3Error as error:
             if error.code == "NoSuchKey":
                 raise MinioNotFoundError(key=f"prefix: {prefix}")
@@ -282,52 +333,28 @@ class MinioService:
                 raise MinioError(error=error) from error
 
     @staticmethod
-    def get_bucket_stats_sync(bucket: Buckets) -> BucketStat:
-        total_size = 0
-        total_objects = 0
-        for obj in MinioService.instance.list_objects(bucket.value, recursive=True):
-            total_size += obj.size
-            total_objects += 1
+    async def get_bucket_stats(bucket: Buckets) -> BucketStat:
+        objects = await MinioService.instance.list_objects(bucket.value, recursive=True)
         return BucketStat(
             bucket=bucket,
-            total_objects=total_objects,
-            total_size=total_size,
+            total_objects=len(objects),
+            total_size=sum(obj.size for obj in objects),
         )
 
     @staticmethod
     async def get_all_stats() -> set[BucketStat]:
         stats = await asyncio.gather(
-            *(
-                asyncio.to_thread(
-                    MinioService.get_bucket_stats_sync,
-                    bucket,
-                )
-                for bucket in Buckets
-            )
+            *(MinioService.get_bucket_stats(bucket) for bucket in Buckets)
         )
         return set(stats)
 
     @staticmethod
-    async def find_existing_with_size(
-        bucket: Buckets,
-        prefix: str,
-        requested_size: ImageSizes,
+    async def generate_presigned_path(
+        bucket: Buckets, key: str, expires=timedelta(minutes=1)
     ) -> str:
-        for size in ImageSizes.get_next_available_size(requested_size):
-            try:
-                objects = tuple(
-                    await asyncio.to_thread(
-                        MinioService.instance.list_objects,
-                        bucket_name=bucket.value,
-                        prefix=f"{prefix}/{size.str_view}",
-                    )
-                )
-                if objects:
-                    return objects[0].object_name
-            except S3Error as e:
-                if e.code != "NoSuchKey":
-                    raise MinioError(error=e) from e
-        raise MinioNotFoundError(key=f"{prefix=}, {requested_size=}")
+        # % /{bucket}/{key}?X-Amz-... (to be proxied to minio as is)
+        link = urlsplit(await MinioService.generate_temp_link(bucket, key, expires))
+        return f"{link.path}?{link.query}"
 
     @staticmethod
     async def generate_temp_link(
@@ -335,15 +362,7 @@ class MinioService:
     ) -> str:
         if not MinioService.INITALIZED:
             raise ServiceNotInitalizedButUsingError("MinioService")
-        try:
-            return await asyncio.to_thread(
-                MinioService.instance.presigned_get_object,
-                bucket_name=bucket.value,
-                object_name=key,
-                expires=expires,
-            )
-        except S3Error as error:
-            if error.code == "NoSuchKey":
-                raise MinioNotFoundError(key=key)
-            else:
-                raise MinioError(error=error) from error
+        # ? Signed locally, the object isn't checked
+        return MinioService.instance.presign_get(
+            bucket=bucket.value, key=key, expires=expires
+        )
@@ -0,0 +1,141 @@
+from datetime import datetime, timezone
+from functools import wraps
+
+from redis.asyncio import Redis
+from redis.commands.core import AsyncScript
+
+from models.exceptions.initalize_exceptions import (
+    ServiceNotInitalizedButUsingError,
+    UnableToInitializeServiceError,
+)
+from models.presence import Presence
+
+# ? KEYS[1] - presence key, KEYS[2] - dirty set, ARGV[1] - user id,
+# ? ARGV[2] - last_seen, ARGV[3] - ttl. Writes only if the user wasn't offline yet
+SET_OFFLINE_SCRIPT = """
+if redis.call("HGET", KEYS[1], "online") == "0" then
+    return redis.call("HGET", KEYS[1], "last_seen")
+end
+redis.call("HSET", KEYS[1], "online", "0", "last_seen", ARGV[2])
+redis.call("EXPIRE", KEYS[1], ARGV[3])
+redis.call("SADD", KEYS[2], ARGV[1])
+return ARGV[2]
+"""
+
+
+def check_initialized(handler):
+    @wraps(handler)
+    async def wrapper(cls, *args, **kwargs):
+        if not cls.INITALIZED:
+            raise ServiceNotInitalizedButUsingError("PresenceService(redis)")
+        return await handler(cls, *args, **kwargs)
+
+    return wrapper
+
+
+# ? Live presence is kept in redis (presence:{user_id} hash),
+# ? MySQL is_online/last_seen are written behind by BackgroundServices
+class PresenceService:
+    INITALIZED: bool = False
+    redis: Redis
+    _set_offline_script: AsyncScript
+    DIRTY_KEY = "presence:dirty"
+    PRESENCE_TTL_SECONDS = 60 * 60 * 24
+    FLUSH_BATCH_SIZE = 500
+
+    @classmethod
+    async def initialize(cls):
+        try:
+            cls.redis = Redis(host="redis", port=6379, decode_responses=True)
+            cls._set_offline_script = cls.redis.register_script(SET_OFFLINE_SCRIPT)
+            cls.INITALIZED = True
+        except Exception as error:
+            raise UnableToInitializeServiceError("PresenceService(redis)") from error
+
+    @staticmethod
+    def _key(user_id: str) -> str:
+        return f"presence:{user_id}"
+
+    @staticmethod
+    def _from_hash(user_id: str, data: list | dict) -> Presence | None:
+        if isinstance(data, dict):
+            data = [data.get("online"), data.get("last_seen")]
+        online, last_seen = data
+        if online is None:
+            return None
+        return Presence(
+            user_id=user_id,
+            is_online=online == "1",
+            last_seen=datetime.fromisoformat(last_seen) if last_seen else None,
+        )
+
+    @classmethod
+    @check_initialized
+    async def set_online(cls, user_id: str) -> Presence:
+        key = cls._key(user_id)
+        async with cls.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(key, "online", "1")
+            pipe.expire(key, cls.PRESENCE_TTL_SECONDS)
+            pipe.sadd(cls.DIRTY_KEY, user_id)
+            pipe.hget(key, "last_seen")
+            *_, last_seen = await pipe.execute()
+        return cls._from_hash(user_id, ["1", last_seen])
+
+    @classmethod
+    @check_initialized
+    async def set_offline(cls, user_id: str) -> Presence:
+        # * Repeated offline events keep the first last_seen and aren't flushed again
+        last_seen = await cls._set_offline_script(
+            keys=[cls._key(user_id), cls.DIRTY_KEY],
+            args=[
+                user_id,
+                datetime.now(timezone.utc).isoformat(),
+                cls.PRESENCE_TTL_SECONDS,
+            ],
+        )
+        return cls._from_hash(user_id, ["0", last_seen])
+
+    @classmethod
+    @check_initialized
+    async def get_presences(cls, user_ids) -> dict[str, Presence]:
+        # ? Users without live state are absent, their MySQL values are actual
+        user_ids = list(set(filter(None, user_ids)))
+        if not user_ids:
+            return {}
+        async with cls.redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.hmget(cls._key(user_id), "online", "last_seen")
+            results = await pipe.execute()
+        presences = {}
+        for user_id, data in zip(user_ids, results):
+            presence = cls._from_hash(user_id, data)
+            if presence:
+                presences[user_id] = presence
+        return presences
+
+    @classmethod
+    @check_initialized
+    async def swap_emitted(cls, presence: Presence) -> bool:
+        # ? Returns False if the same state has already been emitted (debounce)
+        key = cls._key(presence.user_id)
+        new_value = "1" if presence.is_online else "0"
+        async with cls.redis.pipeline(transaction=True) as pipe:
+            pipe.hget(key, "emitted")
+            pipe.hset(key, "emitted", new_value)
+            previous_value, _ = await pipe.execute()
+        return previous_value != new_value
+
+    @classmethod
+    @check_initialized
+    async def pop_dirty(cls) -> list[Presence]:
+        user_ids = await cls.redis.spop(cls.DIRTY_KEY, cls.FLUSH_BATCH_SIZE)
+        if not user_ids:
+            return []
+        presences = await cls.get_presences(user_ids)
+        return list(presences.values())
+
+    @classmethod
+    @check_initialized
+    async def mark_dirty(cls, user_ids: list[str]):
+        if user_ids:
+            await cls.redis.sadd(cls.DIRTY_KEY, *user_ids)
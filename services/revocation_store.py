@@ -0,0 +1,61 @@
+from functools import wraps
+from time import time
+
+from redis.asyncio import Redis
+
+from config.jwt_config import JwtConfig
+from models.exceptions.initalize_exceptions import (
+    ConfigNotInitalizedButUsingError,
+    ServiceNotInitalizedButUsingError,
+    UnableToInitializeServiceError,
+)
+
+
+def check_initialized(handler):
+    @wraps(handler)
+    async def wrapper(cls, *args, **kwargs):
+        if not cls.INITALIZED:
+            raise ServiceNotInitalizedButUsingError("RevocationStore(redis)")
+        return await handler(cls, *args, **kwargs)
+
+    return wrapper
+
+
+# ? Every access token of the user issued before the mark is treated as revoked.
+# ? The mark lives as long as an access token does, so it never has to be cleaned up
+class RevocationStore:
+    INITALIZED: bool = False
+    redis: Redis
+
+    @classmethod
+    async def initialize(cls):
+        try:
+            if not JwtConfig.INITALIZED:
+                raise ConfigNotInitalizedButUsingError("JWT_CONFIG")
+            cls.redis = Redis(host="redis", port=6379, decode_responses=True)
+            cls.INITALIZED = True
+        except Exception as error:
+            raise UnableToInitializeServiceError("RevocationStore(redis)") from error
+
+    @staticmethod
+    def _key(user_id: str) -> str:
+        return f"revoked_before:{user_id}"
+
+    @classmethod
+    @check_initialized
+    async def revoke_user_tokens(cls, user_id: str):
+        await cls.redis.set(
+            cls._key(user_id),
+            time(),
+            ex=JwtConfig.ACCESS_DURABILITY_MIN * 60,
+        )
+
+    @classmethod
+    @check_initialized
+    async def is_revoked(cls, user_id: str, issued_at: float | None) -> bool:
+        revoked_before = await cls.redis.get(cls._key(user_id))
+        if revoked_before is None:
+            return False
+        if issued_at is None:
+            return True
+        return float(issued_at) < float(revoked_before)
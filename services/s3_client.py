@@ -0,0 +1,387 @@
+import asyncio
+import hashlib
+import hmac
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from time import perf_counter
+from urllib.parse import quote
+from xml.etree import ElementTree
+
+from aiohttp import (
+    ClientError,
+    ClientResponse,
+    ClientSession,
+    ClientTimeout,
+    TCPConnector,
+)
+from yarl import URL
+
+from services.metrics import Metrics
+
+S3_NAMESPACE = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+EMPTY_SHA256 = hashlib.sha256(b"").hexdigest()
+UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+
+
+class S3Error(Exception):
+    def __init__(self, code: str, message: str = "", status: int = 0):
+        super().__init__(f"{code}: {message}" if message else code)
+        self.code = code
+        self.message = message
+        self.status = status
+
+
+class S3Object:
+    def __init__(
+        self,
+        key: str,
+        size: int = 0,
+        etag: str | None = None,
+        last_modified: datetime | None = None,
+        content_type: str | None = None,
+    ):
+        self.key = key
+        self.size = size
+        self.etag = etag.strip('"') if etag else None
+        self.last_modified = last_modified
+        self.content_type = content_type
+
+
+class S3ObjectStream:
+    # ? Body of GET object, read straight from the aiohttp connection.
+    # ! Must be closed, otherwise the connection doesn't return to the pool
+    def __init__(self, response: ClientResponse):
+        self._response = response
+        self.size = int(response.headers.get("Content-Length", 0))
+        self.content_type = response.headers.get("Content-Type")
+
+    async def iter_chunks(self, chunk_size: int = 64 * 1024):
+        async for chunk in self._response.content.iter_chunked(chunk_size):
+            yield chunk
+
+    async def read(self) -> bytes:
+        return await self._response.read()
+
+    def close(self):
+        self._response.release()
+
+
+# ? Minimal asyncio S3 client (AWS Signature V4 over aiohttp) with its own
+# ? keep-alive pool: no thread hops and no sharing the default executor
+# ? with image processing. Covers only the calls MinioService needs
+class S3Client:
+    HASH_IN_THREAD_BYTES = 1024 * 1024  # ? Bigger payloads are hashed out of the loop
+
+    def __init__(
+        self,
+        endpoint: str,
+        access_key: str,
+        secret_key: str,
+        region: str = "us-east-1",
+        secure: bool = False,
+        pool_size: int = 64,
+    ):
+        self._host = endpoint
+        self._base_url = f"{'https' if secure else 'http'}://{endpoint}"
+        self._access_key = access_key
+        self._secret_key = secret_key
+        self._region = region
+        self._pool_size = pool_size
+        self._session: ClientSession | None = None
+
+    def _get_session(self) -> ClientSession:
+        # * Created lazily, inside the loop of the process that uses it
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(
+                connector=TCPConnector(limit=self._pool_size, keepalive_timeout=30),
+                timeout=ClientTimeout(total=None, connect=5, sock_read=60),
+                auto_decompress=False,
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    # % Signing
+
+    @staticmethod
+    def _path(bucket: str, key: str | None = None) -> str:
+        path = f"/{bucket}" if key is None else f"/{bucket}/{key}"
+        return quote(path, safe="/~")
+
+    @staticmethod
+    def _canonical_query(query: dict[str, str]) -> str:
+        return "&".join(
+            f"{quote(name, safe='-_.~')}={quote(str(value), safe='-_.~')}"
+            for name, value in sorted(query.items())
+        )
+
+    def _scope(self, date: datetime) -> str:
+        return f"{date:%Y%m%d}/{self._region}/s3/aws4_request"
+
+    def _signature(self, date: datetime, canonical_request: str) -> str:
+        string_to_sign = "\n".join(
+            (
+                "AWS4-HMAC-SHA256",
+                f"{date:%Y%m%dT%H%M%SZ}",
+                self._scope(date),
+                hashlib.sha256(canonical_request.encode()).hexdigest(),
+            )
+        )
+        key = f"AWS4{self._secret_key}".encode()
+        for part in (f"{date:%Y%m%d}", self._region, "s3", "aws4_request"):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        return hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+    def _sign_headers(
+        self,
+        method: str,
+        path: str,
+        query: dict[str, str],
+        headers: dict[str, str],
+        payload_hash: str,
+    ) -> dict[str, str]:
+        date = datetime.now(timezone.utc)
+        headers = {
+            **headers,
+            "Host": self._host,
+            "x-amz-date": f"{date:%Y%m%dT%H%M%SZ}",
+            "x-amz-content-sha256": payload_hash,
+        }
+        signed = {
+            name.lower(): " ".join(str(value).split())
+            for name, value in headers.items()
+            if name.lower() in ("host", "content-type", "content-md5")
+            or name.lower().startswith("x-amz-")
+        }
+        signed_names = ";".join(sorted(signed))
+        canonical_request = "\n".join(
+            (
+                method,
+                path,
+                self._canonical_query(query),
+                "".join(f"{name}:{signed[name]}\n" for name in sorted(signed)),
+                signed_names,
+                payload_hash,
+            )
+        )
+        headers["Authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self._access_key}/{self._scope(date)}, "
+            f"SignedHeaders={signed_names}, "
+            f"Signature={self._signature(date, canonical_request)}"
+        )
+        return headers
+
+    def presign_get(self, bucket: str, key: str, expires: timedelta) -> str:
+        date = datetime.now(timezone.utc)
+        path = self._path(bucket, key)
+        query = {
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{self._access_key}/{self._scope(date)}",
+            "X-Amz-Date": f"{date:%Y%m%dT%H%M%SZ}",
+            "X-Amz-Expires": str(int(expires.total_seconds())),
+            "X-Amz-SignedHeaders": "host",
+        }
+        canonical_request = "\n".join(
+            (
+                "GET",
+                path,
+                self._canonical_query(query),
+                f"host:{self._host}\n",
+                "host",
+                UNSIGNED_PAYLOAD,
+            )
+        )
+        query["X-Amz-Signature"] = self._signature(date, canonical_request)
+        return f"{self._base_url}{path}?{self._canonical_query(query)}"
+
+    # % Transport
+
+    @staticmethod
+    async def _raise_for_error(response: ClientResponse):
+        body = await response.read() if response.method != "HEAD" else b""
+        code, message = None, ""
+        if body:
+            try:
+                root = ElementTree.fromstring(body)
+                code = root.findtext("Code")
+                message = root.findtext("Message") or ""
+            except ElementTree.ParseError:
+                message = body[:200].decode(errors="replace")
+        if code is None:
+            code = "NoSuchKey" if response.status == 404 else f"Http{response.status}"
+        raise S3Error(code=code, message=message, status=response.status)
+
+    async def _request(
+        self,
+        method: str,
+        bucket: str,
+        key: str | None = None,
+        query: dict[str, str] | None = None,
+        headers: dict[str, str] | None = None,
+        data: bytes | memoryview | None = None,
+        stream: bool = False,
+    ) -> tuple[ClientResponse, bytes]:
+        # % (response, body); body is empty and the response stays open with stream=True
+        query = query or {}
+        path = self._path(bucket, key)
+        if data is None:
+            payload_hash = EMPTY_SHA256
+        elif len(data) > self.HASH_IN_THREAD_BYTES:
+            # * hashlib releases the GIL on big buffers
+            payload_hash = (await asyncio.to_thread(hashlib.sha256, data)).hexdigest()
+        else:
+            payload_hash = hashlib.sha256(data).hexdigest()
+        signed_headers = self._sign_headers(
+            method, path, query, headers or {}, payload_hash
+        )
+        url = self._base_url + path
+        if query:
+            url += f"?{self._canonical_query(query)}"
+        started_at = perf_counter()
+        try:
+            response = await self._get_session().request(
+                method,
+                URL(url, encoded=True),
+                headers=signed_headers,
+                data=data,
+            )
+            try:
+                if response.status >= 300:
+                    await self._raise_for_error(response)
+                body = b"" if stream else await response.read()
+            except BaseException:
+                response.release()
+                raise
+        except ClientError as error:
+            Metrics.increment("s3_errors")
+            raise S3Error(code="ClientError", message=str(error)) from error
+        except S3Error:
+            Metrics.increment("s3_errors")
+            raise
+        finally:
+            Metrics.observe("s3_request_ms", (perf_counter() - started_at) * 1000)
+        if not stream:
+            response.release()
+        return response, body
+
+    @staticmethod
+    def _object_from_headers(key: str, response: ClientResponse) -> S3Object:
+        last_modified = response.headers.get("Last-Modified")
+        return S3Object(
+            key=key,
+            size=int(response.headers.get("Content-Length", 0)),
+            etag=response.headers.get("ETag"),
+            last_modified=parsedate_to_datetime(last_modified) if last_modified else None,
+            content_type=response.headers.get("Content-Type"),
+        )
+
+    @staticmethod
+    def _parse_xml_datetime(value: str | None) -> datetime | None:
+        if not value:
+            return None
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+    # % Operations
+
+    async def bucket_exists(self, bucket: str) -> bool:
+        try:
+            await self._request("HEAD", bucket)
+        except S3Error as error:
+            if error.status == 404:
+                return False
+            raise
+        return True
+
+    async def make_bucket(self, bucket: str):
+        await self._request("PUT", bucket)
+
+    async def put_object(
+        self,
+        bucket: str,
+        key: str,
+        data: bytes | memoryview,
+        content_type: str = "application/octet-stream",
+    ) -> S3Object:
+        response, _ = await self._request(
+            "PUT", bucket, key, headers={"Content-Type": content_type}, data=data
+        )
+        s3_object = self._object_from_headers(key, response)
+        s3_object.size = len(data)
+        s3_object.content_type = content_type
+        return s3_object
+
+    async def get_object(
+        self, bucket: str, key: str, offset: int = 0, length: int = 0
+    ) -> S3ObjectStream:
+        headers = {}
+        if length:
+            headers["Range"] = f"bytes={offset}-{offset + length - 1}"
+        elif offset:
+            headers["Range"] = f"bytes={offset}-"
+        response, _ = await self._request(
+            "GET", bucket, key, headers=headers, stream=True
+        )
+        return S3ObjectStream(response)
+
+    async def stat_object(self, bucket: str, key: str) -> S3Object:
+        response, _ = await self._request("HEAD", bucket, key)
+        return self._object_from_headers(key, response)
+
+    async def list_objects(
+        self, bucket: str, prefix: str = "", recursive: bool = False
+    ) -> list[S3Object]:
+        # ? Objects only, "directories" of a non-recursive listing are skipped
+        objects = []
+        query = {"list-type": "2", "prefix": prefix}
+        if not recursive:
+            query["delimiter"] = "/"
+        while True:
+            _, body = await self._request("GET", bucket, query=query)
+            root = ElementTree.fromstring(body)
+            for content in root.iter(f"{S3_NAMESPACE}Contents"):
+                objects.append(
+                    S3Object(
+                        key=content.findtext(f"{S3_NAMESPACE}Key"),
+                        size=int(content.findtext(f"{S3_NAMESPACE}Size") or 0),
+                        etag=content.findtext(f"{S3_NAMESPACE}ETag"),
+                        last_modified=self._parse_xml_datetime(
+                            content.findtext(f"{S3_NAMESPACE}LastModified")
+                        ),
+                    )
+                )
+            is_truncated = root.findtext(f"{S3_NAMESPACE}IsTruncated") == "true"
+            continuation_token = root.findtext(f"{S3_NAMESPACE}NextContinuationToken")
+            if not is_truncated or not continuation_token:
+                return objects
+            query["continuation-token"] = continuation_token
+
+    async def copy_object(
+        self, bucket: str, key: str, source_bucket: str, source_key: str
+    ) -> S3Object:
+        _, body = await self._request(
+            "PUT",
+            bucket,
+            key,
+            headers={"x-amz-copy-source": self._path(source_bucket, source_key)},
+        )
+        root = ElementTree.fromstring(body)
+        if root.tag == "Error":
+            # * Copy may fail after 200 OK was already sent
+            raise S3Error(
+                code=root.findtext("Code") or "CopyError",
+                message=root.findtext("Message") or "",
+                status=200,
+            )
+        return S3Object(
+            key=key,
+            etag=root.findtext(f"{S3_NAMESPACE}ETag"),
+            last_modified=self._parse_xml_datetime(
+                root.findtext(f"{S3_NAMESPACE}LastModified")
+            ),
+        )
+
+    async def remove_object(self, bucket: str, key: str):
+        await self._request("DELETE", bucket, key)
@@ -1,13 +1,17 @@
-import json
 from functools import wraps
 
 from redis.asyncio import Redis
+from redis.commands.core import AsyncScript
 
+from config.server_config import ServerConfig
 from models.exceptions.initalize_exceptions import (
+    ConfigNotInitalizedButUsingError,
     ServiceNotInitalizedButUsingError,
     UnableToInitializeServiceError,
 )
+from models.role import Role
 from models.sio.sio_session import SioSession
+from services.metrics import Metrics
 
 
 def check_initialized(handler):
@@ -20,50 +24,302 @@ def check_initialized(handler):
     return wrapper
 
 
+# ? session:{node_id}:{sid} (hash) - session, namespaced by the node that holds the socket
+# ? node_sids:{node_id} (set of sids) - sessions of the node
+# ? user_sid:{user_id} (set of "{node_id}:{sid}") - sessions of the user on every node
+
+# ? KEYS - session keys, ARGV[1] - role. Sessions removed meanwhile aren't recreated
+UPDATE_ROLE_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    if redis.call("EXISTS", key) == 1 then
+        redis.call("HSET", key, "user_role", ARGV[1])
+    end
+end
+return #KEYS
+"""
+
+
+# ? Every node keeps its node_alive key and TTLs of its sessions by heartbeats,
+# ? sessions of a node whose key has expired are removed by another node
+# ? (see BackgroundServices). Sids of expired sessions are pruned lazily on read.
+# ? Sessions of this node are cached in process, redis is read on a miss only
 class SessionStore:
     INITALIZED: bool = False
     redis: Redis
+    _update_role_script: AsyncScript
+    NODES_KEY = "nodes"
+    INVALIDATION_CHANNEL = "session_invalidation"
+    _cache: dict[str, SioSession] = {}
+    _cached_user_sids: dict[str, set[str]] = {}
 
     @classmethod
-    async def initialize(cls, clear_data: bool = True):
+    async def initialize(cls):
         try:
+            if not ServerConfig.INITIALIZED:
+                raise ConfigNotInitalizedButUsingError("SERVER_CONFIG")
             cls.redis = Redis(host="redis", port=6379, decode_responses=True)
-            if clear_data:
-                await cls.redis.flushall()
+            cls._update_role_script = cls.redis.register_script(UPDATE_ROLE_SCRIPT)
+            Metrics.track_ratio(
+                "session_cache_hit_ratio", "session_cache_hits", "session_cache_misses"
+            )
             cls.INITALIZED = True
         except Exception as error:
             raise UnableToInitializeServiceError("SessionStore(redis)") from error
 
+    @staticmethod
+    def _member(sid: str, node_id: str | None = None) -> str:
+        return f"{node_id or ServerConfig.NODE_ID}:{sid}"
+
+    @staticmethod
+    def _sid_from_member(member: str) -> str:
+        return member.rsplit(":", 1)[-1]
+
+    @staticmethod
+    def _session_key(sid: str, node_id: str | None = None) -> str:
+        return f"session:{SessionStore._member(sid, node_id)}"
+
+    @staticmethod
+    def _node_sids_key(node_id: str | None = None) -> str:
+        return f"node_sids:{node_id or ServerConfig.NODE_ID}"
+
+    @staticmethod
+    def _node_alive_key(node_id: str | None = None) -> str:
+        return f"node_alive:{node_id or ServerConfig.NODE_ID}"
+
+    @staticmethod
+    def _user_sids_key(user_id: str) -> str:
+        return f"user_sid:{user_id}"
+
+    @classmethod
+    def _cache_session(cls, session: SioSession):
+        cls._cache[session.sid] = session
+        cls._cached_user_sids.setdefault(session.user_id, set()).add(session.sid)
+
+    @classmethod
+    def _uncache_session(cls, sid: str):
+        session = cls._cache.pop(sid, None)
+        if session is None:
+            return
+        user_sids = cls._cached_user_sids.get(session.user_id)
+        if user_sids is not None:
+            user_sids.discard(sid)
+            if not user_sids:
+                cls._cached_user_sids.pop(session.user_id, None)
+
+    @classmethod
+    def _uncache_user(cls, user_id: str):
+        for sid in list(cls._cached_user_sids.get(user_id, ())):
+            cls._uncache_session(sid)
+
+    @classmethod
+    def clear_cache(cls):
+        cls._cache.clear()
+        cls._cached_user_sids.clear()
+
+    @classmethod
+    @check_initialized
+    async def invalidate_user(cls, user_id: str):
+        # * Drops cached sessions of the user on every node
+        cls._uncache_user(user_id)
+        await cls.redis.publish(cls.INVALIDATION_CHANNEL, user_id)
+
+    @classmethod
+    @check_initialized
+    async def update_user_role(cls, user_id: str, user_role: Role):
+        # ? Live sessions keep working with the new role, caches are dropped after
+        members = list(await cls.redis.smembers(cls._user_sids_key(user_id)))
+        if members:
+            await cls._update_role_script(
+                keys=[f"session:{member}" for member in members],
+                args=[user_role.value],
+            )
+        await cls.invalidate_user(user_id)
+
+    @classmethod
+    @check_initialized
+    async def listen_invalidations(cls):
+        async with cls.redis.pubsub() as pubsub:
+            await pubsub.subscribe(cls.INVALIDATION_CHANNEL)
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    cls._uncache_user(message["data"])
+                    Metrics.increment("session_cache_invalidations")
+
     @classmethod
     @check_initialized
     async def get_all_keys(cls):
         return await cls.redis.scan()
 
+    @classmethod
+    @check_initialized
+    async def heartbeat(cls):
+        async with cls.redis.pipeline(transaction=False) as pipe:
+            pipe.set(cls._node_alive_key(), 1, ex=ServerConfig.NODE_TTL_SECONDS)
+            pipe.sadd(cls.NODES_KEY, ServerConfig.NODE_ID)
+            await pipe.execute()
+        node_sids_key = cls._node_sids_key()
+        ttl = ServerConfig.NODE_TTL_SECONDS
+        sids = list(await cls.redis.smembers(node_sids_key))
+        results = []
+        if sids:
+            async with cls.redis.pipeline(transaction=False) as pipe:
+                for sid in sids:
+                    pipe.expire(cls._session_key(sid), ttl)
+                    pipe.hget(cls._session_key(sid), "user_id")
+                results = await pipe.execute()
+        async with cls.redis.pipeline(transaction=False) as pipe:
+            for sid, is_alive, user_id in zip(sids, results[::2], results[1::2]):
+                if not is_alive:
+                    pipe.srem(node_sids_key, sid)
+                elif user_id:
+                    pipe.expire(cls._user_sids_key(user_id), ttl)
+            pipe.expire(node_sids_key, ttl)
+            await pipe.execute()
+
+    @classmethod
+    @check_initialized
+    async def get_dead_nodes(cls) -> list[str]:
+        node_ids = [
+            node_id
+            for node_id in await cls.redis.smembers(cls.NODES_KEY)
+            if node_id != ServerConfig.NODE_ID
+        ]
+        if not node_ids:
+            return []
+        async with cls.redis.pipeline(transaction=False) as pipe:
+            for node_id in node_ids:
+                pipe.exists(cls._node_alive_key(node_id))
+            alive = await pipe.execute()
+        return [node_id for node_id, is_alive in zip(node_ids, alive) if not is_alive]
+
+    @classmethod
+    @check_initialized
+    async def lock_node_cleanup(cls, node_id: str) -> bool:
+        # * Only one of the alive nodes cleans up after the dead one
+        return bool(
+            await cls.redis.set(
+                f"node_cleanup:{node_id}",
+                ServerConfig.NODE_ID,
+                nx=True,
+                ex=ServerConfig.NODE_TTL_SECONDS,
+            )
+        )
+
+    @classmethod
+    @check_initialized
+    async def remove_node_sessions(cls, node_id: str) -> list[SioSession]:
+        sids = list(await cls.redis.smembers(cls._node_sids_key(node_id)))
+        sessions: list[SioSession] = []
+        if sids:
+            async with cls.redis.pipeline(transaction=False) as pipe:
+                for sid in sids:
+                    pipe.hgetall(cls._session_key(sid, node_id))
+                data = await pipe.execute()
+            sessions = [
+                SioSession.from_json(hash_session)
+                for hash_session in data
+                if hash_session
+            ]
+        async with cls.redis.pipeline(transaction=True) as pipe:
+            for session in sessions:
+                pipe.srem(
+                    cls._user_sids_key(session.user_id),
+                    cls._member(session.sid, node_id),
+                )
+            for sid in sids:
+                pipe.delete(cls._session_key(sid, node_id))
+            pipe.delete(cls._node_sids_key(node_id))
+            if node_id != ServerConfig.NODE_ID:
+                pipe.srem(cls.NODES_KEY, node_id)
+            await pipe.execute()
+        for sid in sids:
+            cls._uncache_session(sid)
+        return sessions
+
     @classmethod
     @check_initialized
     async def save_session(cls, session: SioSession):
-        sid = session.sid
-        user_id = session.user_id
-        json_session = session.to_json()
-        await cls.redis.set(f"sid:{sid}", json.dumps(json_session))
-        await cls.redis.sadd(f"user_sid:{user_id}", sid)
+        session_key = cls._session_key(session.sid)
+        node_sids_key = cls._node_sids_key()
+        user_sids_key = cls._user_sids_key(session.user_id)
+        ttl = ServerConfig.NODE_TTL_SECONDS
+        async with cls.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(session_key, mapping=session.to_json())
+            pipe.expire(session_key, ttl)
+            pipe.sadd(node_sids_key, session.sid)
+            pipe.expire(node_sids_key, ttl)
+            pipe.sadd(user_sids_key, cls._member(session.sid))
+            pipe.expire(user_sids_key, ttl)
+            await pipe.execute()
+        cls._cache_session(session)
 
     @classmethod
     @check_initialized
     async def get_session_by_sid(cls, sid: str) -> SioSession | None:
-        data = await cls.redis.get(f"sid:{sid}")
-        return SioSession.from_json(json.loads(data)) if data else None
+        session = cls._cache.get(sid)
+        if session is not None:
+            Metrics.increment("session_cache_hits")
+            return session
+        Metrics.increment("session_cache_misses")
+        data = await cls.redis.hgetall(cls._session_key(sid))
+        if not data:
+            return None
+        session = SioSession.from_json(data)
+        cls._cache_session(session)
+        return session
+
+    @classmethod
+    @check_initialized
+    async def get_sids_by_user_ids(cls, user_ids) -> dict[str, set[str]]:
+        user_ids = list(set(filter(None, user_ids)))
+        if not user_ids:
+            return {}
+        async with cls.redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.smembers(cls._user_sids_key(user_id))
+            members_by_user = await pipe.execute()
+        members = [
+            (user_id, member)
+            for user_id, user_members in zip(user_ids, members_by_user)
+            for member in user_members
+        ]
+        if not members:
+            return {user_id: set() for user_id in user_ids}
+        async with cls.redis.pipeline(transaction=False) as pipe:
+            for _, member in members:
+                pipe.exists(f"session:{member}")
+            exist = await pipe.execute()
+
+        sids_by_user: dict[str, set[str]] = {user_id: set() for user_id in user_ids}
+        dead_members: list[tuple[str, str]] = []
+        for (user_id, member), is_alive in zip(members, exist):
+            if is_alive:
+                sids_by_user[user_id].add(cls._sid_from_member(member))
+            else:
+                dead_members.append((user_id, member))
+        if dead_members:
+            # * Sessions of crashed processes expire, their sids are pruned here
+            async with cls.redis.pipeline(transaction=False) as pipe:
+                for user_id, member in dead_members:
+                    pipe.srem(cls._user_sids_key(user_id), member)
+                await pipe.execute()
+            Metrics.increment("pruned_dead_sids", len(dead_members))
+        return sids_by_user
 
     @classmethod
     @check_initialized
     async def get_sids_by_user_id(cls, user_id: str) -> set:
-        return await cls.redis.smembers(f"user_sid:{user_id}")
+        return (await cls.get_sids_by_user_ids([user_id])).get(user_id, set())
 
     @classmethod
     @check_initialized
     async def remove_session(cls, sid: str):
-        session = await cls.get_session_by_sid(sid)
-        if session:
-            user_id = session.user_id
-            await cls.redis.srem(f"user_sid:{user_id}", sid)
-        await cls.redis.delete(f"sid:{sid}")
+        session_key = cls._session_key(sid)
+        user_id = await cls.redis.hget(session_key, "user_id")
+        async with cls.redis.pipeline(transaction=True) as pipe:
+            if user_id:
+                pipe.srem(cls._user_sids_key(user_id), cls._member(sid))
+            pipe.srem(cls._node_sids_key(), sid)
+            pipe.delete(session_key)
+            await pipe.execute()
+        cls._uncache_session(sid)
@@ -26,6 +26,8 @@ class TokensService:
             days=JwtConfig.REFRESH_DURABILITY_DAYS
         )
         access_payload["exp"] = access_exp
+        # ? Float iat, so that a token issued right after revocation is not revoked too
+        access_payload["iat"] = datetime.now(timezone.utc).timestamp()
         refresh_payload["exp"] = refresh_exp
         access_token = jwt.encode(
             payload=access_payload,
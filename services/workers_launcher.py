@@ -0,0 +1,105 @@
+import multiprocessing
+import os
+import signal
+import time
+from logging import Logger
+from multiprocessing.process import BaseProcess
+from multiprocessing.synchronize import Event
+from typing import Callable
+
+
+# ? Master process: forks workers sharing the listen socket (SO_REUSEPORT),
+# ? respawns crashed ones and restarts them one by one on SIGHUP
+class WorkersLauncher:
+    READY_TIMEOUT_SECONDS = 60
+    STOP_TIMEOUT_SECONDS = 30
+
+    def __init__(
+        self,
+        logger: Logger,
+        workers_count: int,
+        target: Callable[[Event], None],
+    ):
+        self._logger = logger
+        self._workers_count = workers_count
+        self._target = target
+        self._context = multiprocessing.get_context("fork")
+        self._workers: list[BaseProcess | None] = [None] * workers_count
+        self._restart_requested = False
+        self._stop_requested = False
+
+    def _run_worker(self, index: int, ready_event: Event):
+        os.environ["WORKER_INDEX"] = str(index)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        # * Forked with the launcher's handlers, the worker's loop installs its own
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        self._target(ready_event)
+
+    def _spawn(self, index: int, wait_ready: bool = False) -> BaseProcess:
+        ready_event = self._context.Event()
+        worker = self._context.Process(
+            target=self._run_worker,
+            args=(index, ready_event),
+            name=f"worker-{index}",
+        )
+        worker.start()
+        self._logger.info(f"Worker {index} started (pid {worker.pid})\n")
+        if wait_ready and not ready_event.wait(self.READY_TIMEOUT_SECONDS):
+            self._logger.warning(f"Worker {index} (pid {worker.pid}) isn't ready yet\n")
+        return worker
+
+    def _stop(self, worker: BaseProcess):
+        if not worker.is_alive():
+            return
+        worker.terminate()  # ? SIGTERM, worker shuts down gracefully
+        worker.join(self.STOP_TIMEOUT_SECONDS)
+        if worker.is_alive():
+            self._logger.warning(f"Worker (pid {worker.pid}) didn't stop, killing\n")
+            worker.kill()
+            worker.join()
+
+    def _rolling_restart(self):
+        self._logger.info("Rolling restart of workers...\n")
+        for index, old_worker in enumerate(self._workers):
+            # * The new worker accepts connections before the old one stops
+            self._workers[index] = self._spawn(index, wait_ready=True)
+            if old_worker is not None:
+                self._stop(old_worker)
+            if self._stop_requested:
+                return
+        self._logger.info("Rolling restart completed\n")
+
+    def _on_restart_signal(self, signum, frame):
+        self._restart_requested = True
+
+    def _on_stop_signal(self, signum, frame):
+        self._stop_requested = True
+
+    def run(self):
+        signal.signal(signal.SIGHUP, self._on_restart_signal)
+        signal.signal(signal.SIGTERM, self._on_stop_signal)
+        signal.signal(signal.SIGINT, self._on_stop_signal)
+        for index in range(self._workers_count):
+            self._workers[index] = self._spawn(index)
+
+        while not self._stop_requested:
+            if self._restart_requested:
+                self._restart_requested = False
+                self._rolling_restart()
+                continue
+            for index, worker in enumerate(self._workers):
+                if worker is not None and not worker.is_alive():
+                    self._logger.error(
+                        f"Worker {index} (pid {worker.pid}) exited with code {worker.exitcode}, respawning\n"
+                    )
+                    self._workers[index] = self._spawn(index)
+            time.sleep(1)
+
+        self._logger.info("Stopping workers...\n")
+        for worker in self._workers:
+            if worker is not None:
+                worker.terminate()
+        for worker in self._workers:
+            if worker is not None:
+                self._stop(worker)